@@ -1,15 +1,24 @@
+from . import metrics
+from . import model_prefetch  # noqa: F401  регистрирует предзагрузку моделей при постановке в очередь
 from .ollama_node_base import OllamaNodeBase
 from .ollama_vision_node_base import OllamaVisionNodeBase
+from .ollama_vision_batch_node import OllamaVisionBatchNode
 from .ollama_preset_nodes import OllamaSavePresetNode, OllamaLoadPresetNode
 from .ollama_model_node import OllamaModelNode
 from .ollama_run_preset_node import OllamaRunPresetNode
 from .ollama_reasoning_node import OllamaReasoningNode
 from .ollama_reasoning_model_node import OllamaReasoningModelNode
 from .ollama_compare_image_node import OllamaCompareImageNode
+from .ollama_session_nodes import OllamaSessionNode, OllamaSessionChatNode
+from .ollama_structured_nodes import OllamaStructuredNode, OllamaJsonFieldNode
+
+# /ollama/metrics и файл с метриками
+metrics.start_exporters()
 
 NODE_CLASS_MAPPINGS = {
     "OllamaNodeBase": OllamaNodeBase,
     "OllamaVisionNodeBase": OllamaVisionNodeBase,
+    "OllamaVisionBatchNode": OllamaVisionBatchNode,
     "OllamaSavePresetNode": OllamaSavePresetNode,
     "OllamaLoadPresetNode": OllamaLoadPresetNode,
     "OllamaModelNode": OllamaModelNode,
@@ -17,11 +26,16 @@ NODE_CLASS_MAPPINGS = {
     "OllamaReasoningNode": OllamaReasoningNode,
     "OllamaReasoningModelNode": OllamaReasoningModelNode,
     "OllamaCompareImageNode": OllamaCompareImageNode,
+    "OllamaSessionNode": OllamaSessionNode,
+    "OllamaSessionChatNode": OllamaSessionChatNode,
+    "OllamaStructuredNode": OllamaStructuredNode,
+    "OllamaJsonFieldNode": OllamaJsonFieldNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "OllamaNodeBase": "Ollama Base",
     "OllamaVisionNodeBase": "Ollama Vision Base",
+    "OllamaVisionBatchNode": "Ollama Vision Batch",
     "OllamaSavePresetNode": "💾 Ollama Save Preset",
     "OllamaLoadPresetNode": "📂 Ollama Load Preset",
     "OllamaModelNode": "Ollama Model",
@@ -29,4 +43,8 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "OllamaReasoningNode": "Ollama Reasoning",
     "OllamaReasoningModelNode": "Reasoning Model",
     "OllamaCompareImageNode": "Ollama Compare Image",
+    "OllamaSessionNode": "Ollama Session",
+    "OllamaSessionChatNode": "Ollama Session Chat",
+    "OllamaStructuredNode": "Ollama Structured Output",
+    "OllamaJsonFieldNode": "Ollama JSON Field",
 }
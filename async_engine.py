@@ -0,0 +1,140 @@
+# async_engine.py
+
+"""asyncio front-end for the blocking request code.
+
+ComfyUI runs ``async`` node functions concurrently when they don't depend on
+each other.  The node entry points (``call_ollama``, ``run``, ``compare``)
+are thin coroutines that hand the synchronous request pipeline to a shared
+thread pool via :func:`run_blocking`, so several Ollama branches of a graph
+are in flight at the same time instead of one after another.
+
+A per-server semaphore caps how many requests go to one Ollama instance at
+once (``OLLAMA_NUM_PARALLEL``, 4 by default; a server pool gets that many
+slots per server).  When the ComfyUI job is
+interrupted, or the awaiting task is cancelled, the request's
+:class:`http_client.CancelScope` is cancelled: its sockets are shut down so
+the worker thread stops reading immediately.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .http_client import CancelScope, reset_scope, set_scope
+from .load_balancer import resolve_endpoints
+from .log_utils import get_logger
+
+logger = get_logger("OllamaAsyncEngine")
+
+try:
+    import comfy.model_management
+except ImportError:  # запуск вне ComfyUI
+    comfy = None
+
+# Как часто проверять прерывание задания ComfyUI, секунды
+INTERRUPT_POLL_INTERVAL = 0.1
+MAX_WORKERS = 32
+
+
+def default_parallel() -> int:
+    """Requests per server: Ollama's ``OLLAMA_NUM_PARALLEL`` or 4."""
+    try:
+        return max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "4")))
+    except ValueError:
+        return 4
+
+
+def server_slots(ip_port: str) -> int:
+    """Requests in flight allowed for ``ip_port``: :func:`default_parallel` per server."""
+    try:
+        servers = len(resolve_endpoints(ip_port))
+    except ValueError:
+        servers = 1
+    return default_parallel() * max(1, servers)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_semaphores = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="ollama-io")
+        return _executor
+
+
+def _server_semaphore(ip_port: str) -> asyncio.Semaphore:
+    """Semaphore for ``ip_port``; a pool of N servers gets N times the slots."""
+    loop = asyncio.get_running_loop()
+    key = (id(loop), ip_port.strip())
+    sem = _semaphores.get(key)
+    if sem is None:
+        sem = _semaphores[key] = asyncio.Semaphore(server_slots(ip_port))
+    return sem
+
+
+def _interrupted() -> bool:
+    return comfy is not None and comfy.model_management.processing_interrupted()
+
+
+def _run_in_scope(scope, fn):
+    token = set_scope(scope)
+    try:
+        return fn()
+    finally:
+        reset_scope(token)
+
+
+async def run_blocking(ip_port, fn, *args, **kwargs):
+    """Run blocking ``fn(*args, **kwargs)`` in the I/O pool and await it.
+
+    ``ip_port`` selects the per-server concurrency semaphore; ``None`` skips
+    it (for callers that manage their own concurrency).
+    """
+    sem = _server_semaphore(ip_port) if ip_port else None
+    if sem is not None:
+        waited = time.perf_counter()
+        await sem.acquire()
+        owner = getattr(fn, "__self__", None)
+        metrics.queue_wait_seconds.observe(time.perf_counter() - waited,
+                                           node=type(owner).__name__ if owner is not None else fn.__name__,
+                                           server=ip_port.strip())
+    scope = CancelScope()
+    try:
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, _run_in_scope, scope, functools.partial(fn, *args, **kwargs))
+        future = loop.run_in_executor(_get_executor(), call)
+        # После отмены результат никто не заберёт — гасим предупреждение asyncio
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=INTERRUPT_POLL_INTERVAL)
+            if done:
+                return future.result()
+            if _interrupted():
+                logger.info("run_blocking: ComfyUI interrupt, cancelling request")
+                scope.cancel()
+                raise comfy.model_management.InterruptProcessingException()
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
+    finally:
+        if sem is not None:
+            sem.release()
+
+
+def run_sync(coro):
+    """Run a node coroutine from synchronous code (scripts, benchmarks)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    raise RuntimeError("run_sync() called from a running event loop, await the coroutine instead")
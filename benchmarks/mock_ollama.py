@@ -0,0 +1,338 @@
+# benchmarks/mock_ollama.py
+
+"""Local stand-in for the Ollama HTTP API.
+
+Serves the endpoints the nodes use — ``/v1/chat/completions``,
+``/api/chat`` and ``/api/generate`` (streamed or not; generate also
+loads/unloads and returns a ``context`` for sessions),
+``/api/pull``, ``/api/tags``, ``/api/show`` and ``/api/ps`` — with a
+configurable time to first token, token rate and failure injection, so the
+nodes can be benchmarked offline on CPU.
+
+Run it standalone to point ComfyUI at it::
+
+    python benchmarks/mock_ollama.py --port 11434 --latency 0.05 --token-rate 200
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the", "image", "shows", "a", "red", "car", "parked", "near", "an", "old", "brick", "building")
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.02, token_rate: float = 500.0, tokens: int = 32,
+                 failure_rate: float = 0.0, failure_status: int = 500, pull_seconds: float = 0.05,
+                 thinking_tokens: int = 16, seed: int = 0):
+        # Время до первого токена (загрузка промпта)
+        self.latency = latency
+        # Скорость генерации, токенов в секунду (0 — мгновенно)
+        self.token_rate = token_rate
+        self.tokens = tokens
+        # Доля запросов к чату, на которые отвечаем ошибкой
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.pull_seconds = pull_seconds
+        # Длина блока <think> для моделей-рассуждений
+        self.thinking_tokens = thinking_tokens
+        self.seed = seed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят отдельными записями: без TCP_NODELAY на
+    # повторно используемом соединении каждый ответ ждал бы delayed ACK (~40 мс)
+    disable_nagle_algorithm = True
+    server: "MockOllama"
+
+    def log_message(self, *args):
+        pass
+
+    # --- helpers
+
+    def _send_json(self, data, status: int = 200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            return {}
+
+    # --- routes
+
+    def do_GET(self):
+        self.server.count(self.path)
+        if self.path == "/api/tags":
+            self._send_json({"models": [self.server.model_entry(m) for m in sorted(self.server.installed)]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [dict(self.server.model_entry(m), size_vram=1 << 30)
+                                        for m in sorted(self.server.loaded)]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        self.server.count(self.path)
+        request = self._read_json()
+        if self.path == "/v1/chat/completions":
+            self._generation(request, "openai")
+        elif self.path == "/api/chat":
+            self._generation(request, "chat")
+        elif self.path == "/api/generate":
+            if "prompt" in request:
+                self._generation(request, "generate")
+            else:
+                self._load(request)
+        elif self.path == "/api/pull":
+            self._pull(request)
+        elif self.path == "/api/show":
+            self._send_json({
+                "model_info": {"mock.context_length": 8192},
+                "capabilities": ["completion", "vision", "thinking"],
+            })
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _generation(self, request: dict, api: str):
+        self.server.track(1)
+        try:
+            self._chat(request, api)
+        finally:
+            self.server.track(-1)
+
+    @staticmethod
+    def _prompt_tokens(request: dict, api: str) -> int:
+        """Tokens the server would evaluate: everything, or only the new turn with ``context``."""
+        if api == "generate":
+            texts = [request.get("prompt") or ""]
+            if not request.get("context"):
+                texts.append(request.get("system") or "")
+            images = len(request.get("images") or ())
+        else:
+            texts, images = [], 0
+            for message in request.get("messages") or ():
+                content = message.get("content")
+                if isinstance(content, list):
+                    texts += [part.get("text") or "" for part in content]
+                    images += sum(part.get("type") == "image_url" for part in content)
+                else:
+                    texts.append(content or "")
+                images += len(message.get("images") or ())
+        return sum(len(t.split()) for t in texts) + 256 * images + 8
+
+    def _message(self, model: str, api: str, token: str, done: bool) -> dict:
+        if api == "generate":
+            return {"model": model, "response": token, "done": done}
+        return {"model": model, "message": {"role": "assistant", "content": token}, "done": done}
+
+    def _chat(self, request: dict, api: str):
+        server = self.server
+        model = server.canonical(request.get("model"))
+        if model not in server.installed:
+            self._send_json({"error": f"model '{request.get('model')}' not found, try pulling it first"}, 404)
+            return
+        if server.should_fail():
+            self._send_json({"error": "injected failure"}, server.config.failure_status)
+            return
+        server.loaded.add(model)
+        server.recent.append(request)
+        config = server.config
+        thinking = config.thinking_tokens if "reason" in model or "r1" in model else 0
+        tokens = server.answer_tokens(thinking)
+        if request.get("format") or request.get("response_format"):
+            # Структурированный ответ: слова — в строковое поле объекта
+            start = tokens.index("</think>\n") + 1 if thinking else 0
+            tokens[start:] = ['{"answer": "'] + tokens[start:] + ['"}']
+        limit = (request.get("options") or {}).get("num_predict", request.get("max_tokens"))
+        reason = "stop"
+        if limit and len(tokens) > limit:
+            tokens, reason = tokens[:limit], "length"
+        prompt_tokens = self._prompt_tokens(request, api)
+        time.sleep(config.latency)
+        delay = 1.0 / config.token_rate if config.token_rate > 0 else 0.0
+        final = {"prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(config.latency * 1e9),
+                 "eval_count": len(tokens), "eval_duration": int(delay * len(tokens) * 1e9) or 1}
+        if api == "generate":
+            # Условные id токенов: старый context + новый ход
+            final["context"] = list(request.get("context") or ()) + list(range(prompt_tokens + len(tokens)))
+
+        if not request.get("stream"):
+            time.sleep(delay * len(tokens))
+            text = "".join(tokens)
+            if api == "openai":
+                self._send_json({
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": reason}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)},
+                })
+            else:
+                self._send_json(dict(self._message(model, api, text, True), total_duration=1, done_reason=reason,
+                                     **final))
+            return
+
+        self._start_chunked("text/event-stream" if api == "openai" else "application/x-ndjson")
+        try:
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                if api == "openai":
+                    chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                    self._chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+                else:
+                    self._chunk(json.dumps(self._message(model, api, token, False)).encode("utf-8") + b"\n")
+            if api == "openai":
+                chunk = {"choices": [{"index": 0, "delta": {}, "finish_reason": reason}]}
+                self._chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\ndata: [DONE]\n\n")
+            else:
+                chunk = dict(self._message(model, api, "", True), done_reason=reason, **final)
+                self._chunk(json.dumps(chunk).encode("utf-8") + b"\n")
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент оборвал стрим (стоп-последовательность, бюджет токенов)
+            pass
+
+    def _load(self, request: dict):
+        model = self.server.canonical(request.get("model"))
+        if request.get("keep_alive") == 0:
+            self.server.loaded.discard(model)
+        elif model in self.server.installed:
+            self.server.loaded.add(model)
+        else:
+            self._send_json({"error": "model not found"}, 404)
+            return
+        self._send_json({"model": model, "response": "", "done": True})
+
+    def _pull(self, request: dict):
+        model = self.server.canonical(request.get("name") or request.get("model"))
+        self._start_chunked("application/x-ndjson")
+        total = 100
+        steps = 5
+        for i in range(steps + 1):
+            status = {"status": "pulling", "digest": "sha256:mock", "total": total, "completed": total * i // steps}
+            self._chunk(json.dumps(status).encode("utf-8") + b"\n")
+            time.sleep(self.server.config.pull_seconds / steps)
+        self.server.installed.add(model)
+        self._chunk(b'{"status":"success"}\n')
+        self._end_chunked()
+
+
+class MockOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0, models=("mock:latest",)):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.installed = {self.canonical(m) for m in models}
+        self.loaded = set()
+        self.requests = {}
+        # Последние запросы к чату (тела), для проверок в тестах
+        self.recent = deque(maxlen=64)
+        # Генераций в работе сейчас и максимум за всё время
+        self.active = 0
+        self.peak = 0
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    @staticmethod
+    def canonical(name) -> str:
+        name = (name or "").strip()
+        return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+    @staticmethod
+    def model_entry(name: str) -> dict:
+        return {"name": name, "model": name, "size": 1 << 30, "digest": f"sha256:{abs(hash(name)):x}",
+                "details": {"family": "mock", "parameter_size": "1B", "quantization_level": "Q4_0"}}
+
+    def handle_error(self, request, client_address):
+        # Клиенты обрывают стримы (стоп-последовательности, бюджеты) — это не ошибка
+        pass
+
+    def count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def track(self, delta: int):
+        with self._lock:
+            self.active += delta
+            self.peak = max(self.peak, self.active)
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self.config.failure_rate > 0 and self._random.random() < self.config.failure_rate
+
+    def answer_tokens(self, thinking: int = 0) -> list:
+        with self._lock:
+            words = [self._random.choice(WORDS) for _ in range(self.config.tokens)]
+            thoughts = [self._random.choice(WORDS) for _ in range(thinking)]
+        tokens = []
+        if thoughts:
+            tokens += ["<think>"] + [f" {w}" for w in thoughts] + ["</think>\n"]
+        tokens += [w if i == 0 else f" {w}" for i, w in enumerate(words)]
+        return tokens
+
+    def start(self) -> "MockOllama":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name="mock-ollama")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds to first token")
+    parser.add_argument("--token-rate", type=float, default=500.0, help="tokens per second, 0 for instant")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per answer")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of chat requests that fail")
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--model", action="append", default=None, help="installed model (repeatable)")
+    args = parser.parse_args()
+    config = MockConfig(args.latency, args.token_rate, args.tokens, args.failure_rate, args.failure_status)
+    server = MockOllama(config, args.host, args.port, args.model or ("mock:latest", "reason:latest"))
+    print(f"mock Ollama on {server.address}, models: {', '.join(sorted(server.installed))}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+# benchmarks/run_benchmarks.py
+
+"""Benchmarks for the Ollama nodes against a local mock server.
+
+Measures, offline and on CPU only:
+
+* ``encode/*`` — image resize + JPEG encode cost (cold and from the image
+  cache) for the sizes the vision nodes receive;
+* ``latency/*`` — end-to-end time of one node call (through the async
+  entry point ComfyUI uses) for ``OllamaVisionNodeBase``,
+  ``OllamaCompareImageNode``, ``OllamaRunPresetNode`` and
+  ``OllamaReasoningNode``;
+* ``throughput/*`` — requests per second with many calls in flight;
+* ``retries/*`` — latency when the server fails a share of requests.
+
+Absolute timings depend on the machine, so every metric is also expressed
+as a ratio to a reference workload measured in the same run:
+
+* ``reference/jpeg`` — a plain Pillow JPEG encode of a 512 px frame, for
+  the ``encode/*`` metrics;
+* ``reference/request`` — one raw chat request to the mock over the pooled
+  client, with no node code around it, for the other metrics.
+
+``benchmarks/baseline.json`` holds only these ratios.  A metric whose ratio
+is more than ``--tolerance`` worse than its baseline is reported as a
+regression and the exit status is 1.  ``--update-baseline`` rewrites the
+ratios after an intended change.
+
+::
+
+    python benchmarks/run_benchmarks.py            # full run
+    python benchmarks/run_benchmarks.py --quick    # CI smoke run
+"""
+
+import argparse
+import asyncio
+import importlib
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BASELINE = os.path.join(HERE, "baseline.json")
+PACKAGE = "ollama_nodes"
+
+sys.path.insert(0, HERE)
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+# Абсолютный порог для задержек: шум планировщика меньше него не считаем регрессией
+MIN_DELTA_MS = 1.0
+# Эталон, к которому приводится метрика, по префиксу её имени
+REFERENCES = {"encode/": "reference/jpeg"}
+DEFAULT_REFERENCE = "reference/request"
+
+
+def load_nodes():
+    """Import the node package from the repository root under a fixed name."""
+    if PACKAGE in sys.modules:
+        return sys.modules[PACKAGE]
+    spec = importlib.util.spec_from_file_location(PACKAGE, os.path.join(ROOT, "__init__.py"),
+                                                  submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def submodule(name: str):
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 3)
+
+
+def latency_result(samples) -> dict:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    return {
+        "value": _ms(statistics.median(samples)),
+        "p95": _ms(p95),
+        "mean": _ms(statistics.fmean(samples)),
+        "n": len(samples),
+        "unit": "ms",
+        "better": "lower",
+    }
+
+
+def rate_result(count: int, elapsed: float) -> dict:
+    return {"value": round(count / elapsed, 2), "n": count, "unit": "req/s", "better": "higher"}
+
+
+def random_image(rng, size: int) -> np.ndarray:
+    """A ComfyUI-style ``[1, H, W, 3]`` float image (numpy stands in for torch)."""
+    return rng.random((1, size, size, 3), dtype=np.float32)
+
+
+def reference_jpeg(repeats: int) -> dict:
+    """Plain Pillow JPEG encode of a 512 px frame: the CPU reference for ``encode/*``."""
+    from PIL import Image
+
+    rng = np.random.default_rng(2)
+    image = Image.fromarray((rng.random((512, 512, 3)) * 255).astype(np.uint8), "RGB")
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        image.save(io.BytesIO(), format="JPEG", quality=90)
+        samples.append(time.perf_counter() - started)
+    return {"reference/jpeg": latency_result(samples)}
+
+
+def reference_request(server: str, repeats: int) -> dict:
+    """One raw chat request to the mock, without any node code: the reference for the rest."""
+    urlopen = submodule("http_client").urlopen
+    body = json.dumps({"model": "mock", "stream": False,
+                       "messages": [{"role": "user", "content": "Describe"}]}).encode("utf-8")
+
+    def request():
+        with urlopen(server, "/api/chat", data=body, timeout=30) as resp:
+            resp.read()
+
+    request()  # прогрев соединения
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        request()
+        samples.append(time.perf_counter() - started)
+    return {"reference/request": latency_result(samples)}
+
+
+def reference_for(name: str) -> str:
+    for prefix, reference in REFERENCES.items():
+        if name.startswith(prefix):
+            return reference
+    return DEFAULT_REFERENCE
+
+
+def add_ratios(results: dict):
+    """Add ``ratio`` — the value relative to the metric's reference — to every result.
+
+    Latencies become multiples of the reference time, rates — requests per
+    reference time; both stay comparable across machines.
+    """
+    for name, result in results.items():
+        if name.startswith("reference/"):
+            continue
+        reference = results[reference_for(name)]["value"]
+        if result["better"] == "lower":
+            result["ratio"] = round(result["value"] / reference, 4)
+        else:
+            result["ratio"] = round(result["value"] * reference / 1000.0, 4)
+
+
+def bench_encode(sizes, repeats: int) -> dict:
+    encoding = submodule("image_encoding")
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in sizes:
+        frames = [random_image(rng, size) for _ in range(repeats)]
+        cold = []
+        for frame in frames:
+            started = time.perf_counter()
+            encoding.encode_image(frame)
+            cold.append(time.perf_counter() - started)
+        warm = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            encoding.encode_image(frames[0])
+            warm.append(time.perf_counter() - started)
+        results[f"encode/{size}px/cold"] = latency_result(cold)
+        results[f"encode/{size}px/cached"] = latency_result(warm)
+    return results
+
+
+class NodeCalls:
+    """Coroutine factories for one call of each benchmarked node."""
+
+    def __init__(self, server: str, image: np.ndarray, image2: np.ndarray, preset_name: str):
+        self.server = server
+        self.image = image
+        self.image2 = image2
+        self.preset_name = preset_name
+        self.vision = submodule("ollama_vision_node_base").OllamaVisionNodeBase()
+        self.compare = submodule("ollama_compare_image_node").OllamaCompareImageNode()
+        run_preset = submodule("ollama_run_preset_node")
+        self.preset = run_preset.OllamaRunPresetNode()
+        self.preset_model = run_preset.PRESET_MODEL
+        self.reasoning = submodule("ollama_reasoning_node").OllamaReasoningNode()
+
+    def factories(self) -> dict:
+        common = {"system_prompt": "You describe images.", "keep_in_memory": True}
+        return {
+            "vision": lambda i: self.vision.call_ollama(
+                self.server, model_name="mock", user_prompt=f"Describe #{i}", img=self.image, **common),
+            "vision-stream": lambda i: self.vision.call_ollama(
+                self.server, model_name="mock", user_prompt=f"Describe #{i}", img=self.image, stream=True, **common),
+            "compare": lambda i: self.compare.compare(
+                self.server, model_name="mock", user_prompt=f"Compare #{i}", image1=self.image, image2=self.image2,
+                **common),
+            "run-preset": lambda i: self.preset.run(
+                self.server, preset_name=self.preset_name, model_name=self.preset_model,
+                user_prompt=f"Describe #{i}", img=self.image, keep_in_memory=True),
+            "reasoning": lambda i: self.reasoning.run(
+                self.server, model_name="reason", user_prompt=f"Think about #{i}", **common),
+        }
+
+
+def _check(name: str, result):
+    outputs = result[0] if isinstance(result[0], list) else result
+    for value in outputs:
+        if isinstance(value, str) and value.startswith("Error"):
+            raise RuntimeError(f"{name}: {value}")
+
+
+def bench_latency(calls: NodeCalls, repeats: int) -> dict:
+    run_sync = submodule("async_engine").run_sync
+    results = {}
+    for name, factory in calls.factories().items():
+        _check(name, run_sync(factory(-1)))  # прогрев: соединение, кеш картинки
+        samples = []
+        for i in range(repeats):
+            started = time.perf_counter()
+            _check(name, run_sync(factory(i)))
+            samples.append(time.perf_counter() - started)
+        results[f"latency/{name}"] = latency_result(samples)
+    return results
+
+
+async def _burst(factory, total: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            return await factory(i)
+
+    return await asyncio.gather(*(one(i) for i in range(total)))
+
+
+def bench_throughput(calls: NodeCalls, total: int, concurrency: int, names=("vision", "reasoning")) -> dict:
+    factories = calls.factories()
+    results = {}
+    for name in names:
+        started = time.perf_counter()
+        outputs = asyncio.run(_burst(factories[name], total, concurrency))
+        elapsed = time.perf_counter() - started
+        for output in outputs:
+            _check(name, output)
+        results[f"throughput/{name}@{concurrency}"] = rate_result(total, elapsed)
+    return results
+
+
+def bench_retries(server: MockOllama, calls: NodeCalls, repeats: int) -> dict:
+    run_sync = submodule("async_engine").run_sync
+    retry_policy = submodule("retry_policy")
+    saved = server.config.failure_rate, retry_policy.BACKOFF_BASE
+    # Повторяем без пауз: меряем накладные расходы повторов, а не backoff
+    server.config.failure_rate, retry_policy.BACKOFF_BASE = 0.3, 0.0
+    try:
+        factory = calls.factories()["vision"]
+        samples = []
+        for i in range(repeats):
+            started = time.perf_counter()
+            run_sync(factory(i))
+            samples.append(time.perf_counter() - started)
+    finally:
+        server.config.failure_rate, retry_policy.BACKOFF_BASE = saved
+    return {"retries/vision@30%": latency_result(samples)}
+
+
+def run(args) -> dict:
+    load_nodes()
+    preset_dir = tempfile.mkdtemp(prefix="ollama-bench-")
+    preset_name = "bench.json"
+    with open(os.path.join(preset_dir, preset_name), "w", encoding="utf-8") as f:
+        json.dump({"system_prompt": "You describe images.", "model": "mock", "max_tokens": 64,
+                   "options": {"temperature": 0.7}}, f)
+    # Пресеты из временной папки, а не из ComfyUI
+    submodule("ollama_run_preset_node").preset_store = submodule("preset_store").PresetStore(preset_dir)
+
+    config = MockConfig(latency=args.latency, token_rate=args.token_rate, tokens=args.tokens)
+    server = MockOllama(config, models=("mock:latest", "reason:latest")).start()
+    try:
+        rng = np.random.default_rng(1)
+        calls = NodeCalls(server.address, random_image(rng, 1024), random_image(rng, 768), preset_name)
+        repeats = 5 if args.quick else 20
+        results = {}
+        # Эталоны дешёвые — меряем их дольше, чтобы шум не попадал во все отношения сразу
+        results.update(reference_jpeg(50))
+        results.update(reference_request(server.address, 20))
+        results.update(bench_encode((512, 1024) if args.quick else (512, 1024, 2048), repeats))
+        results.update(bench_latency(calls, repeats))
+        results.update(bench_throughput(calls, 16 if args.quick else 64, 8))
+        results.update(bench_retries(server, calls, repeats))
+    finally:
+        server.stop()
+    add_ratios(results)
+    return results
+
+
+def to_baseline(results: dict) -> dict:
+    """Machine-independent part of ``results``: ratios only, no reference timings."""
+    return {name: {"ratio": result["ratio"], "better": result["better"]}
+            for name, result in results.items() if "ratio" in result}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """``[(name, ratio, base, change)]`` of metrics whose ratio is worse than ``baseline``."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if "ratio" not in result or not base or not base.get("ratio"):
+            continue
+        ratio, base_ratio = result["ratio"], base["ratio"]
+        change = ratio / base_ratio - 1.0
+        if result["better"] == "lower":
+            # Разница в миллисекундах этой машины
+            delta_ms = (ratio - base_ratio) * results[reference_for(name)]["value"]
+            worse = change > tolerance and delta_ms > MIN_DELTA_MS
+        else:
+            worse = change < -tolerance
+        if worse:
+            regressions.append((name, ratio, base_ratio, change))
+    return regressions
+
+
+def report(results: dict, baseline: dict):
+    print(f"{'benchmark':30} {'value':>10} {'unit':6} {'p95':>10} {'ratio':>8} {'baseline':>8} {'change':>8}")
+    for name, result in results.items():
+        ratio = result.get("ratio")
+        base = baseline.get(name, {}).get("ratio")
+        change = f"{ratio / base - 1.0:+.0%}" if ratio and base else ""
+        p95 = f"{result['p95']:.2f}" if "p95" in result else ""
+        ratio_text = f"{ratio:.3f}" if ratio else "-"
+        base_text = f"{base:.3f}" if base else "-"
+        print(f"{name:30} {result['value']:>10.2f} {result['unit']:6} {p95:>10} {ratio_text:>8} {base_text:>8} "
+              f"{change:>8}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Ollama nodes against a mock server.")
+    parser.add_argument("--quick", action="store_true", help="fewer repeats, for CI")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--latency", type=float, default=0.005, help="mock time to first token, seconds")
+    parser.add_argument("--token-rate", type=float, default=2000.0, help="mock tokens per second")
+    parser.add_argument("--tokens", type=int, default=32, help="mock tokens per answer")
+    args = parser.parse_args()
+
+    results = run(args)
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(to_baseline(results), f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, ratio, base, change in regressions:
+        print(f"REGRESSION {name}: ratio {ratio:.3f} vs baseline {base:.3f} ({change:+.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# chat_backend.py
+
+"""Choice between the OpenAI-compatible and the native Ollama chat API.
+
+The nodes build an OpenAI-style payload.  With ``backend="native"`` it is
+rewritten for ``/api/chat``, which accepts every Ollama option (``num_ctx``,
+``num_predict``, ``num_batch``, ``num_thread``, ``seed``...) and reports
+timings (``eval_count``, ``eval_duration``, ``load_duration``,
+``prompt_eval_duration``...) that the shim drops.
+
+The rewrite keeps the prompt layout stable for Ollama's prompt cache: the
+system prompt is always the first message as a plain string, the options
+are serialized in sorted order, and everything that changes per call
+(user text, images) comes after it.  Consecutive calls with the same system
+prompt then share a prefix the server doesn't have to evaluate again.
+"""
+
+import json
+
+from .http_client import CHAT_PATH
+from .image_encoding import dumps_with_images
+from .log_utils import get_logger
+
+logger = get_logger("OllamaBackend")
+
+BACKENDS = ["openai", "native"]
+NATIVE_CHAT_PATH = "/api/chat"
+GENERATE_PATH = "/api/generate"
+
+# Параметры верхнего уровня OpenAI, которые в нативном API живут в options
+_OPENAI_TO_OPTIONS = {
+    "max_tokens": "num_predict",
+    "temperature": "temperature",
+    "top_p": "top_p",
+    "seed": "seed",
+    "frequency_penalty": "frequency_penalty",
+    "presence_penalty": "presence_penalty",
+    "stop": "stop",
+}
+# Обратное соответствие: какие options OpenAI-совместимый API принимает полями верхнего уровня
+_OPTIONS_TO_OPENAI = {option: key for key, option in _OPENAI_TO_OPTIONS.items()}
+# Поля таймингов нативного ответа
+TIMING_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration",
+                 "eval_count", "eval_duration")
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_stop(value) -> bool:
+    return isinstance(value, str) or (isinstance(value, list) and all(isinstance(v, str) for v in value))
+
+
+# Типы известных опций Ollama; остальные передаются как есть
+_OPTION_TYPES = {
+    **dict.fromkeys(("seed", "num_ctx", "num_predict", "top_k", "num_batch", "num_thread", "num_gpu", "num_keep",
+                     "repeat_last_n", "mirostat"), (_is_int, "an integer")),
+    **dict.fromkeys(("temperature", "top_p", "min_p", "typical_p", "repeat_penalty", "presence_penalty",
+                     "frequency_penalty", "mirostat_tau", "mirostat_eta"), (_is_number, "a number")),
+    "stop": (_is_stop, "a string or a list of strings"),
+}
+
+
+def parse_options(text: str) -> dict:
+    """Ollama options given on a node as a JSON object; ``""`` means none."""
+    if not text or not text.strip():
+        return {}
+    options = json.loads(text)
+    if not isinstance(options, dict):
+        raise ValueError("options must be a JSON object")
+    for name, value in options.items():
+        check = _OPTION_TYPES.get(name)
+        if check is not None and not check[0](value):
+            raise ValueError(f"{name} must be {check[1]}, got {json.dumps(value)}")
+    return options
+
+
+def apply_options(payload: dict, options: dict):
+    """Merge node-level Ollama ``options`` into an OpenAI-style payload."""
+    if options:
+        merged = dict(payload.get("options") or {})
+        merged.update(options)
+        payload["options"] = merged
+
+
+def apply_format(payload: dict, schema):
+    """Ask for JSON output: any JSON for ``"json"``, else matching the ``schema`` dict."""
+    if schema == "json":
+        payload["response_format"] = {"type": "json_object"}
+    else:
+        payload["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": schema}}
+
+
+def _native_message(message: dict) -> dict:
+    content = message.get("content")
+    if not isinstance(content, list):
+        return {"role": message["role"], "content": content or ""}
+    texts = []
+    images = []
+    for part in content:
+        if part.get("type") == "text":
+            texts.append(part.get("text") or "")
+        elif part.get("type") == "image_url":
+            # Плейсхолдер из image_part(); base64 подставит dumps_with_images
+            images.append(part["image_url"]["url"])
+    native = {"role": message["role"], "content": "\n".join(texts)}
+    if images:
+        native["images"] = images
+    return native
+
+
+def to_native(payload: dict) -> dict:
+    """Rewrite an OpenAI-style chat payload for ``/api/chat``."""
+    options = {}
+    for key, option in _OPENAI_TO_OPTIONS.items():
+        if key in payload:
+            options[option] = payload[key]
+    # Явно заданные options важнее
+    options.update(payload.get("options") or {})
+    native = {
+        "model": payload["model"],
+        "messages": [_native_message(m) for m in payload["messages"]],
+        # Нативный API по умолчанию стримит
+        "stream": bool(payload.get("stream")),
+    }
+    if "keep_alive" in payload:
+        native["keep_alive"] = payload["keep_alive"]
+    response_format = payload.get("response_format")
+    if response_format:
+        # format нативного API: "json" или сама схема
+        native["format"] = (response_format.get("json_schema") or {}).get("schema") or "json"
+    for key in ("format", "think", "tools"):
+        if key in payload:
+            native[key] = payload[key]
+    if options:
+        native["options"] = dict(sorted(options.items()))
+    return native
+
+
+def to_openai(payload: dict) -> dict:
+    """Payload for ``/v1/chat/completions``, which ignores ``options``.
+
+    Options it has a field for (``temperature``, ``seed``, ``top_p``,
+    ``stop``, ``num_predict``...) are moved to the top level; the rest
+    (``num_ctx``, ``top_k``...) are dropped with a warning.
+    """
+    if "options" not in payload:
+        return payload
+    options = payload["options"]
+    openai = {k: v for k, v in payload.items() if k != "options"}
+    ignored = []
+    for name, value in (options or {}).items():
+        key = _OPTIONS_TO_OPENAI.get(name)
+        if key is None:
+            ignored.append(name)
+        else:
+            # Как и в to_native, явно заданные options важнее
+            openai[key] = value
+    if ignored:
+        logger.warning("OpenAI-compatible API ignores options %s; use backend=native for them",
+                       ", ".join(sorted(ignored)))
+    return openai
+
+
+def to_generate(payload: dict, context=None) -> dict:
+    """Rewrite the last user turn of a chat payload for ``/api/generate``.
+
+    With ``context`` (token ids returned by the previous turn) only the new
+    message is sent; without it the system prompt starts a new context.
+    """
+    native = to_native(payload)
+    messages = native.pop("messages")
+    user = messages[-1]
+    generate = {"model": native["model"], "prompt": user.get("content") or ""}
+    if context:
+        generate["context"] = list(context)
+    elif messages[0]["role"] == "system" and messages[0]["content"]:
+        generate["system"] = messages[0]["content"]
+    if user.get("images"):
+        generate["images"] = user["images"]
+    for key in ("stream", "keep_alive", "format", "think", "options"):
+        if key in native:
+            generate[key] = native[key]
+    return generate
+
+
+def build_request(payload: dict, images=(), backend: str = "openai"):
+    """``(path, body, payload)`` for ``payload`` sent over ``backend``."""
+    if backend == "native":
+        native = to_native(payload)
+        return NATIVE_CHAT_PATH, dumps_with_images(native, list(images), data_url=False), native
+    openai = to_openai(payload)
+    return CHAT_PATH, dumps_with_images(openai, list(images)), openai
+
+
+def build_generate_request(payload: dict, images=(), context=None):
+    """``(path, body, payload)`` for a session turn continuing ``context``."""
+    generate = to_generate(payload, context)
+    return GENERATE_PATH, dumps_with_images(generate, list(images), data_url=False), generate
+
+
+def format_timings(info: dict) -> str:
+    """JSON string with the response's timings and derived throughput."""
+    if not info:
+        return ""
+    timings = {k: info[k] for k in TIMING_FIELDS if k in info}
+    usage = info.get("usage")
+    if usage:
+        timings["prompt_eval_count"] = usage.get("prompt_tokens")
+        timings["eval_count"] = usage.get("completion_tokens")
+    if timings.get("eval_duration") and timings.get("eval_count"):
+        timings["tokens_per_second"] = round(timings["eval_count"] / (timings["eval_duration"] / 1e9), 2)
+    if info.get("image_tokens"):
+        # Оценка до отправки (image_planner), входит в prompt_eval_count
+        timings["image_tokens"] = info["image_tokens"]
+    if timings.get("prompt_eval_duration") and timings.get("prompt_eval_count"):
+        timings["prompt_tokens_per_second"] = round(
+            timings["prompt_eval_count"] / (timings["prompt_eval_duration"] / 1e9), 2)
+    return json.dumps(timings) if timings else ""
@@ -0,0 +1,166 @@
+# chat_session.py
+
+"""Multi-turn chat sessions that reuse the server's prompt state.
+
+Every node used to send a fresh ``system`` + ``user`` pair, so a graph that
+refines an answer step by step re-sent the whole conversation each time and
+Ollama evaluated a prompt that grew with every turn.  A session keeps the
+conversation between nodes instead:
+
+* :class:`ChatSession` is the ``OLLAMA_SESSION`` handle passed from node to
+  node.  It is immutable — each turn returns a new handle — so re-running a
+  node from an older handle simply branches the conversation;
+* :data:`sessions` keeps, per session, the server the conversation ran on
+  and the native ``context`` (token ids of the conversation so far)
+  returned by ``/api/generate``, keyed by a hash of the history it
+  represents, so branches never pick up each other's context.  The next turn sends only the new user
+  message with that context to the same server, whose KV cache already
+  holds the prefix, so only the new turn is evaluated;
+* when there is no context for this exact history (evicted, another
+  branch, or the previous turn came from the response cache) the turn
+  falls back to ``/api/chat`` with the full
+  history, still pinned to the same server for its prompt cache.
+
+Server state is dropped for sessions idle longer than
+``OLLAMA_NODES_SESSION_IDLE`` seconds (1800 by default) and, least recently
+used first, beyond ``OLLAMA_NODES_MAX_SESSIONS`` (32).  History itself lives
+in the handles, so an evicted session still works, only slower.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .log_utils import _env_float, get_logger
+
+logger = get_logger("OllamaSession")
+
+
+IDLE_TIMEOUT = _env_float("OLLAMA_NODES_SESSION_IDLE", 1800.0)
+MAX_SESSIONS = max(1, int(_env_float("OLLAMA_NODES_MAX_SESSIONS", 32)))
+# Сколько последних состояний сессии (ходов и веток) помнят свой context
+CONTEXTS_PER_SESSION = 4
+
+
+class ChatSession:
+    """Handle of one conversation state (the ``OLLAMA_SESSION`` type)."""
+
+    __slots__ = ("id", "ip_port", "model_name", "system_prompt", "messages", "_history_key")
+
+    def __init__(self, ip_port: str, model_name: str, system_prompt: str = "", messages=(), session_id: str = None):
+        self.id = session_id or uuid.uuid4().hex
+        self.ip_port = ip_port
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        # Только текст: картинки остаются в context сервера
+        self.messages = tuple(messages)
+        self._history_key = None
+
+    @property
+    def turn(self) -> int:
+        return len(self.messages) // 2
+
+    @property
+    def history_key(self) -> str:
+        """Hash of the conversation so far: branches of one session differ in it."""
+        if self._history_key is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(json.dumps([self.system_prompt, self.messages], ensure_ascii=False).encode("utf-8"))
+            self._history_key = h.hexdigest()
+        return self._history_key
+
+    def advance(self, user_prompt: str, answer: str) -> "ChatSession":
+        """The session after one more exchange."""
+        messages = self.messages + ({"role": "user", "content": user_prompt},
+                                    {"role": "assistant", "content": answer})
+        return ChatSession(self.ip_port, self.model_name, self.system_prompt, messages, self.id)
+
+    def __repr__(self):
+        return f"ChatSession({self.id[:8]}, {self.model_name}, turn {self.turn})"
+
+
+class _State:
+    __slots__ = ("server", "contexts", "last_used")
+
+    def __init__(self):
+        self.server = None
+        self.contexts = OrderedDict()  # history_key -> context
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_timeout: float = IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict(self, now: float):
+        while self._states:
+            session_id, state = next(iter(self._states.items()))
+            idle = self.idle_timeout > 0 and now - state.last_used > self.idle_timeout
+            if not idle and len(self._states) <= self.max_sessions:
+                break
+            del self._states[session_id]
+            self.evictions += 1
+            logger.debug("SessionStore: evicted %s", session_id[:8])
+
+    def _get(self, session: ChatSession):
+        state = self._states.get(session.id)
+        if state is not None:
+            state.last_used = time.monotonic()
+            self._states.move_to_end(session.id)
+        return state
+
+    def server(self, session: ChatSession):
+        """Server holding the session's KV cache, if known."""
+        with self._lock:
+            self._evict(time.monotonic())
+            state = self._get(session)
+            return state.server if state is not None else None
+
+    def context(self, session: ChatSession):
+        """Native ``context`` for exactly this conversation history, if kept.
+
+        A context left by another branch of the session doesn't match and
+        the caller replays the messages instead.
+        """
+        with self._lock:
+            state = self._get(session)
+            return state.contexts.get(session.history_key) if state is not None else None
+
+    def remember(self, session: ChatSession, server: str = None, context=None):
+        """Record where ``session`` (after its last turn) lives and its context."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._get(session)
+            if state is None:
+                state = self._states[session.id] = _State()
+            if server:
+                state.server = server
+            if context:
+                state.contexts[session.history_key] = context
+                state.contexts.move_to_end(session.history_key)
+                while len(state.contexts) > CONTEXTS_PER_SESSION:
+                    state.contexts.popitem(last=False)
+            self._evict(now)
+
+    def forget(self, session: ChatSession):
+        with self._lock:
+            self._states.pop(session.id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._states),
+                "contexts": sum(len(s.contexts) for s in self._states.values()),
+                "evictions": self.evictions,
+            }
+
+
+# Общее хранилище для всех нод
+sessions = SessionStore()
@@ -0,0 +1,458 @@
+# http_client.py
+
+"""Shared pooled HTTP client for all requests to Ollama.
+
+Every node used to open a fresh ``urllib.request.urlopen`` connection per
+request, paying TCP (and, behind a TLS proxy, TLS) setup each time.  This
+module keeps a small pool of persistent HTTP/1.1 connections per ``ip_port``
+and hands them out through :func:`urlopen`, which mimics the parts of the
+``urllib`` response API the nodes rely on.
+
+A host never has more than ``OLLAMA_NODES_MAX_CONNECTIONS`` connections
+open (in use plus idle); a request beyond that waits for one to come back.
+Expired idle connections are swept from the request path, and the pool is
+closed at interpreter exit.
+"""
+
+import atexit
+import contextvars
+import http.client
+import io
+import select
+import socket
+import threading
+import time
+import urllib.error
+from collections import deque
+
+from . import metrics
+from .log_utils import _env_float, _env_int, get_logger
+
+logger = get_logger("OllamaHTTPClient")
+
+CHAT_PATH = "/v1/chat/completions"
+
+# Максимум простаивающих соединений на один сервер
+MAX_IDLE_PER_HOST = 8
+# Максимум соединений на один сервер — занятых и простаивающих вместе
+MAX_CONNECTIONS_PER_HOST = max(1, _env_int("OLLAMA_NODES_MAX_CONNECTIONS", 16))
+# Через сколько секунд простоя соединение закрывается
+IDLE_TIMEOUT = 60.0
+# Как часто проходить по всем пулам и закрывать истёкшие соединения
+EVICT_INTERVAL = IDLE_TIMEOUT / 2
+# Как часто проверять отмену, пока ждём свободное соединение
+_WAIT_POLL = 0.1
+# Таймаут установки соединения (отдельно от таймаута чтения)
+CONNECT_TIMEOUT = _env_float("OLLAMA_NODES_CONNECT_TIMEOUT", 10.0)
+
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class RequestCancelled(Exception):
+    """Raised when the request's :class:`CancelScope` has been cancelled."""
+
+
+class CancelScope:
+    """Lets another thread abort the requests made inside it.
+
+    Connections opened while the scope is active (see :func:`cancel_scope`)
+    are registered with it; :meth:`cancel` shuts their sockets down so a
+    blocked read returns immediately, and new requests fail fast.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._conns = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise RequestCancelled("request cancelled")
+
+    def sleep(self, seconds: float):
+        """Sleep, waking up with :class:`RequestCancelled` on cancellation."""
+        if self._event.wait(seconds):
+            raise RequestCancelled("request cancelled")
+
+    def register(self, conn):
+        with self._lock:
+            self._conns.add(conn)
+        if self._event.is_set():
+            self._shutdown(conn)
+
+    def unregister(self, conn):
+        with self._lock:
+            self._conns.discard(conn)
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            self._shutdown(conn)
+
+    @staticmethod
+    def _shutdown(conn):
+        sock = conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+_current_scope = contextvars.ContextVar("ollama_cancel_scope", default=None)
+
+
+def current_scope():
+    return _current_scope.get()
+
+
+def set_scope(scope):
+    """Make ``scope`` current in this context; returns a reset token."""
+    return _current_scope.set(scope)
+
+
+def reset_scope(token):
+    _current_scope.reset(token)
+
+
+def split_host(ip_port: str):
+    """Return ``(scheme, netloc)`` for ``ip_port``.
+
+    ``ip_port`` is normally ``host:port``; an explicit ``http://`` or
+    ``https://`` prefix is honoured so servers behind a TLS proxy work too.
+    """
+    value = ip_port.strip().rstrip("/")
+    scheme = "http"
+    if "://" in value:
+        scheme, value = value.split("://", 1)
+        scheme = scheme.lower()
+    if scheme not in ("http", "https"):
+        raise ValueError(f"Unsupported scheme: {scheme}")
+    return scheme, value
+
+
+def base_url(ip_port: str) -> str:
+    scheme, netloc = split_host(ip_port)
+    return f"{scheme}://{netloc}"
+
+
+def _is_alive(conn) -> bool:
+    """Cheap health check for an idle connection.
+
+    An idle keep-alive socket must not be readable: readability means the
+    server either closed it (EOF) or sent something unexpected.
+    """
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class _HostPool:
+    """Connections for a single ``scheme://netloc``: idle ones and a count of those in use."""
+
+    def __init__(self, scheme: str, netloc: str, max_idle: int, idle_timeout: float, max_connections: int):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self._idle = deque()  # (conn, released_at)
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)
+        self.active = 0
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+
+    def _new_connection(self, timeout):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.netloc, timeout=timeout)
+
+    def _pop_idle(self, now):
+        while self._idle:
+            conn, released_at = self._idle.pop()
+            if now - released_at > self.idle_timeout or not _is_alive(conn):
+                conn.close()
+                continue
+            return conn
+        return None
+
+    def acquire(self, timeout, scope=None):
+        """Return ``(conn, reused)``; reused connections are health-checked.
+
+        Waits while the host already has ``max_connections`` in use, up to
+        ``timeout`` seconds (``TimeoutError``) or until ``scope`` is cancelled.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                conn = self._pop_idle(now)
+                if conn is not None:
+                    self.active += 1
+                    self.reused += 1
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                if self.active < self.max_connections:
+                    self.active += 1
+                    self.created += 1
+                    return self._new_connection(timeout), False
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                if scope is not None:
+                    scope.check()
+                if deadline is not None and now >= deadline:
+                    raise TimeoutError(f"no free connection to {self.netloc} "
+                                       f"({self.max_connections} in use) after {timeout:g}s")
+                self._returned.wait(_WAIT_POLL if deadline is None else min(_WAIT_POLL, deadline - now))
+
+    def release(self, conn):
+        """Return a connection whose response has been read in full."""
+        with self._lock:
+            self.active -= 1
+            self._returned.notify()
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def discard(self, conn):
+        """Close a connection that can't be reused and free its slot."""
+        with self._lock:
+            self.active -= 1
+            self._returned.notify()
+        conn.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            keep = deque()
+            for conn, released_at in self._idle:
+                if now - released_at > self.idle_timeout or not _is_alive(conn):
+                    conn.close()
+                else:
+                    keep.append((conn, released_at))
+            self._idle = keep
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "active": self.active, "created": self.created,
+                    "reused": self.reused, "waits": self.waits}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_last_sweep = time.monotonic()
+
+
+def _get_pool(scheme: str, netloc: str) -> _HostPool:
+    key = f"{scheme}://{netloc}"
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _HostPool(scheme, netloc, MAX_IDLE_PER_HOST, IDLE_TIMEOUT, MAX_CONNECTIONS_PER_HOST)
+            _pools[key] = pool
+        return pool
+
+
+def _maybe_evict():
+    """Run :func:`evict_idle` at most every ``EVICT_INTERVAL`` seconds."""
+    global _last_sweep
+    now = time.monotonic()
+    with _pools_lock:
+        if now - _last_sweep < EVICT_INTERVAL:
+            return
+        _last_sweep = now
+    evict_idle()
+
+
+class PooledResponse:
+    """Thin wrapper over ``http.client.HTTPResponse``.
+
+    The connection goes back to the pool once the body has been fully read;
+    closing the response early (e.g. abandoning a stream) drops the
+    connection instead, since it can't be reused mid-body.
+    """
+
+    def __init__(self, pool: _HostPool, conn, resp, url: str, scope=None):
+        self._scope = scope
+        self._pool = pool
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def getcode(self):
+        return self.status
+
+    def _check_cancelled(self):
+        if self._scope is not None and self._scope.cancelled:
+            self.close()
+            raise RequestCancelled("request cancelled")
+
+    def read(self, amt=None):
+        data = self._resp.read(amt)
+        self._check_cancelled()
+        if amt is None or not data:
+            self.close()
+        return data
+
+    def readline(self):
+        line = self._resp.readline()
+        self._check_cancelled()
+        if not line:
+            self.close()
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        cancelled = False
+        if self._scope is not None:
+            self._scope.unregister(conn)
+            cancelled = self._scope.cancelled
+        if not cancelled and self._resp.isclosed() and not self._resp.will_close:
+            self._pool.release(conn)
+        else:
+            self._resp.close()
+            self._pool.discard(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _discard(pool, conn, scope):
+    if scope is not None:
+        scope.unregister(conn)
+    pool.discard(conn)
+
+
+def urlopen(ip_port: str, path: str, data: bytes | None = None, method: str | None = None,
+            headers: dict | None = None, timeout: float | None = None) -> PooledResponse:
+    """Send a request over a pooled connection.
+
+    Behaves like ``urllib.request.urlopen``: HTTP error statuses raise
+    ``urllib.error.HTTPError`` so existing error handling keeps working.
+
+    A reused connection the server has closed is replaced transparently,
+    but a request with a body is only resent if it never left the client;
+    once it has been written the error propagates (the server may have
+    acted on it) and :mod:`retry_policy` decides.
+    """
+    scheme, netloc = split_host(ip_port)
+    pool = _get_pool(scheme, netloc)
+    _maybe_evict()
+    url = f"{scheme}://{netloc}{path}"
+    method = method or ("POST" if data is not None else "GET")
+    hdrs = {"Connection": "keep-alive"}
+    if data is not None:
+        hdrs["Content-Type"] = "application/json"
+    if headers:
+        hdrs.update(headers)
+
+    scope = _current_scope.get()
+    while True:
+        if scope is not None:
+            scope.check()
+        conn, reused = pool.acquire(timeout, scope)
+        sent = False
+        try:
+            if conn.sock is None:
+                started = time.perf_counter()
+                # Недоступный сервер не должен держать воркер дольше CONNECT_TIMEOUT
+                conn.timeout = CONNECT_TIMEOUT if timeout is None else min(timeout, CONNECT_TIMEOUT)
+                conn.connect()
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+                metrics.connect_seconds.observe(time.perf_counter() - started, server=netloc)
+            if scope is not None:
+                scope.register(conn)
+            conn.request(method, path, body=data, headers=hdrs)
+            sent = True
+            resp = conn.getresponse()
+            break
+        except _STALE_ERRORS as e:
+            _discard(pool, conn, scope)
+            if scope is not None:
+                scope.check()
+            # Запрос с телом, уже ушедший на сервер, повторно не шлём: он мог быть выполнен
+            if not reused or (sent and data is not None):
+                raise
+            # Сервер закрыл keep-alive соединение — пробуем на новом
+            logger.debug("urlopen: stale pooled connection to %s (%r), reconnecting", netloc, e)
+        except BaseException:
+            _discard(pool, conn, scope)
+            if scope is not None:
+                scope.check()
+            raise
+
+    response = PooledResponse(pool, conn, resp, url, scope)
+    if response.status >= 400:
+        body = response.read()
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+    return response
+
+
+def evict_idle():
+    """Close idle connections that have expired or gone stale."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.evict_idle()
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_all)
+
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {key: pool.stats() for key, pool in pools.items()}
@@ -0,0 +1,139 @@
+# image_cache.py
+
+"""Bounded cache of encoded images keyed by a cheap tensor fingerprint.
+
+The same IMAGE tensor often feeds several Ollama nodes in one graph and is
+sent again on every re-run.  Instead of hashing the whole tensor, the
+fingerprint combines shape, dtype, per-channel sums and a hash of a
+strided sample of whole pixels, so a lookup costs far less than a resize +
+JPEG encode.  The sample
+is taken on the tensor's own device, so GPU tensors aren't copied whole.
+"""
+
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger("OllamaImageCache")
+
+MAX_BYTES = 64 * 1024 * 1024
+# Примерно сколько значений тензора попадает в отпечаток
+SAMPLE_SIZE = 1 << 16
+
+
+def _stride(pixels: int, channels: int, width: int) -> int:
+    """Pixel stride for about ``SAMPLE_SIZE`` values, coprime with the row width.
+
+    A stride that divides the width would sample the same few columns on
+    every row.
+    """
+    step = max(1, pixels * channels // SAMPLE_SIZE)
+    while width > 1 and step > 1 and math.gcd(step, width) != 1:
+        step += 1
+    return step
+
+
+def fingerprint(img) -> str:
+    """Hash of shape, dtype, per-channel sums and a strided sample of whole pixels.
+
+    The sample takes every channel of each sampled pixel (a stride over the
+    flat values could land on one channel only); the sums cover the values
+    the sample misses.
+    """
+    torch_like = hasattr(img, "cpu")
+    arr = img.detach() if torch_like else np.asarray(img)
+    shape, dtype = tuple(arr.shape), str(arr.dtype)
+    channels = shape[-1] if len(shape) >= 3 else 1
+    width = shape[-2] if len(shape) >= 3 else 1
+    pixels = arr.reshape(-1, channels)
+    count = pixels.shape[0]
+    step = _stride(count, channels, width)
+    sample = pixels[::step]
+    # Сумма по строкам, затем по столбцам: на порядок быстрее pixels.sum(0) с шагом в C значений
+    sums = arr.reshape(-1, width * channels).sum(0).reshape(width, channels).sum(0) if count else pixels[:0]
+    # Последние пиксели сэмпл может не задеть — добавляем их явно
+    tail = pixels[-min(count, 64):]
+    if torch_like:
+        sample, sums, tail = (t.cpu().numpy() for t in (sample, sums, tail))
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((shape, dtype, step)).encode("ascii"))
+    for part in (sums, sample, tail):
+        h.update(np.ascontiguousarray(part).tobytes())
+    return h.hexdigest()
+
+
+def _entry_size(images) -> int:
+    # JPEG + его base64, который почти всегда тоже будет посчитан
+    return sum(len(im.jpeg) + 4 * math.ceil(len(im.jpeg) / 3) for im in images)
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (images, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(img, *params) -> str:
+        return f"{fingerprint(img)}:{':'.join(map(str, params))}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, key, images):
+        size = _entry_size(images)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (list(images), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Общий кеш для всех нод
+image_cache = ImageCache()
+
+
+def image_cache_stats() -> dict:
+    return image_cache.stats()
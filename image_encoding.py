@@ -0,0 +1,283 @@
+# image_encoding.py
+
+"""Shared IMAGE → JPEG data URL encoding for all vision nodes.
+
+ComfyUI hands images over as float tensors ``[B,H,W,C]`` in ``0..1``.  The
+old per-node ``_to_pil`` helpers converted every frame to a full-size uint8
+PIL image, ran ``thumbnail`` on it and only then encoded.  Here downscaling
+and quantization are vectorized over the whole batch (box reduction plus a
+bilinear resample to the exact thumbnail size, done on the float data), so
+only the small final frame is converted to uint8 and handed to Pillow for
+the JPEG encode itself.
+
+The target size comes from :mod:`image_planner`: given the model's image
+geometry the frame is resized (aspect kept) and padded to the model's
+square, tile grid or patch grid, and the estimated image tokens are kept on
+the :class:`EncodedImage`.
+
+Encoded images are spliced into the JSON request body as raw base64 bytes by
+:func:`dumps_with_images` instead of going through a ``str`` data URL and
+``json.dumps`` escaping.
+"""
+
+import base64
+import io
+import json
+import math
+import secrets
+import time
+
+import numpy as np
+from PIL import Image
+
+from . import metrics
+from .image_cache import image_cache
+from .image_planner import DEFAULT_MAX_SIDE, PAD_COLOR, ImagePlan, plan_image, thumbnail_size  # noqa: F401
+from .log_utils import get_logger
+
+logger = get_logger("OllamaImageEncoding")
+
+DEFAULT_QUALITY = 75
+
+# Случайный маркер, чтобы не совпасть с текстом промпта
+_PLACEHOLDER = "__ollama_image_" + secrets.token_hex(8) + "_{}__"
+_DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+
+class EncodedImage:
+    """A JPEG-encoded frame ready to be put into a request."""
+
+    __slots__ = ("jpeg", "width", "height", "tokens", "_b64")
+
+    def __init__(self, jpeg: bytes, width: int, height: int, tokens: int = None):
+        self.jpeg = jpeg
+        self.width = width
+        self.height = height
+        # Оценка числа токенов картинки у модели (image_planner)
+        self.tokens = tokens
+        self._b64 = None
+
+    @property
+    def b64(self) -> bytes:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.jpeg)
+        return self._b64
+
+    def data_url(self) -> str:
+        return (_DATA_URL_PREFIX + self.b64).decode("ascii")
+
+    @property
+    def data_url_length(self) -> int:
+        return len(_DATA_URL_PREFIX) + 4 * math.ceil(len(self.jpeg) / 3)
+
+
+def _as_batch(img) -> np.ndarray:
+    """Return a ``[B,H,W,C]`` array view of a tensor/ndarray/PIL image."""
+    if isinstance(img, Image.Image):
+        arr = np.asarray(img.convert("RGB") if img.mode not in ("L", "RGB") else img)
+    elif hasattr(img, "cpu"):
+        # Для CPU-тензора .numpy() не копирует данные
+        arr = img.detach().cpu().numpy()
+    else:
+        arr = np.asarray(img)
+
+    if arr.ndim == 2:
+        arr = arr[None, :, :, None]
+    elif arr.ndim == 3:
+        if arr.shape[0] in (1, 3, 4) and arr.shape[2] not in (1, 3, 4):
+            arr = np.transpose(arr, (1, 2, 0))  # CHW -> HWC
+        arr = arr[None]
+    elif arr.ndim == 4:
+        if arr.shape[1] in (1, 3, 4) and arr.shape[3] not in (1, 3, 4):
+            arr = np.transpose(arr, (0, 2, 3, 1))  # BCHW -> BHWC
+    else:
+        raise TypeError(f"Cannot handle shape: {arr.shape}")
+
+    channels = arr.shape[3]
+    if channels == 4:
+        arr = arr[..., :3]  # JPEG без альфа-канала
+    elif channels not in (1, 3):
+        raise TypeError(f"Unsupported channels: {channels}")
+    return arr
+
+
+def _box_reduce(arr: np.ndarray, factor: int, scale: float = 1.0) -> np.ndarray:
+    """Average ``factor``×``factor`` blocks over the whole batch at once.
+
+    Rows are summed first (contiguous strided adds), then columns on the
+    already halved array; this is several times faster than ``reshape`` +
+    ``mean`` over two axes.  ``scale`` is folded into the final division.
+    """
+    _, h, w, _ = arr.shape
+    h2, w2 = h // factor, w // factor
+    arr = arr[:, :h2 * factor, :w2 * factor]
+    rows = arr[:, 0::factor].astype(np.float32, copy=True)
+    for i in range(1, factor):
+        rows += arr[:, i::factor]
+    out = rows[:, :, 0::factor].copy()
+    for j in range(1, factor):
+        out += rows[:, :, j::factor]
+    out *= scale / (factor * factor)
+    return out
+
+
+def _bilinear(arr: np.ndarray, out_h: int, out_w: int) -> np.ndarray:
+    b, h, w, c = arr.shape
+    if (h, w) == (out_h, out_w):
+        return arr
+    ys = (np.arange(out_h, dtype=np.float32) + 0.5) * (h / out_h) - 0.5
+    xs = (np.arange(out_w, dtype=np.float32) + 0.5) * (w / out_w) - 0.5
+    ys = np.clip(ys, 0, h - 1)
+    xs = np.clip(xs, 0, w - 1)
+    y0 = ys.astype(np.intp)
+    x0 = xs.astype(np.intp)
+    y1 = np.minimum(y0 + 1, h - 1)
+    x1 = np.minimum(x0 + 1, w - 1)
+    wy = (ys - y0)[None, :, None, None]
+    wx = (xs - x0)[None, None, :, None]
+    top = arr[:, y0]
+    bottom = arr[:, y1]
+    top = top[:, :, x0] * (1 - wx) + top[:, :, x1] * wx
+    bottom = bottom[:, :, x0] * (1 - wx) + bottom[:, :, x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def _pad(arr: np.ndarray, canvas_h: int, canvas_w: int) -> np.ndarray:
+    """Center ``uint8`` frames on a ``canvas_h``×``canvas_w`` canvas of :data:`PAD_COLOR`."""
+    b, h, w, c = arr.shape
+    fill = PAD_COLOR if c == 3 else (round(sum(PAD_COLOR) / 3),)
+    out = np.empty((b, canvas_h, canvas_w, c), dtype=np.uint8)
+    out[...] = np.asarray(fill, dtype=np.uint8)
+    top, left = (canvas_h - h) // 2, (canvas_w - w) // 2
+    out[:, top:top + h, left:left + w] = arr
+    return out
+
+
+def prepare_batch(img, max_side: int = DEFAULT_MAX_SIDE, plan: ImagePlan = None) -> np.ndarray:
+    """Resize and quantize an IMAGE batch to ``uint8 [B,h,w,C]``.
+
+    Without ``plan`` the frames are shrunk to fit ``max_side``; with it they
+    are resized to the plan's size and padded to its canvas.
+    """
+    arr = _as_batch(img)
+    _, h, w, _ = arr.shape
+    if plan is None:
+        out_h, out_w = thumbnail_size(h, w, max_side)
+    else:
+        out_h, out_w = plan.height, plan.width
+    # Float-картинки ComfyUI в 0..1, масштаб до 0..255 совмещаем с усреднением
+    scale = 255.0 if np.issubdtype(arr.dtype, np.floating) else 1.0
+
+    if (out_h, out_w) == (h, w):
+        if arr.dtype != np.uint8:
+            arr = arr * np.float32(scale)
+    else:
+        factor = min(h // out_h, w // out_w)
+        if factor >= 2:
+            arr = _box_reduce(arr, factor, scale)
+        else:
+            arr = arr * np.float32(scale)
+        arr = _bilinear(arr.astype(np.float32, copy=False), out_h, out_w)
+
+    if arr.dtype != np.uint8:
+        arr += 0.5
+        np.clip(arr, 0, 255, out=arr)
+        arr = arr.astype(np.uint8)
+    if plan is not None and plan.padded:
+        arr = _pad(arr, plan.canvas_height, plan.canvas_width)
+    return arr
+
+
+def encode_jpeg(frame: np.ndarray, quality: int = DEFAULT_QUALITY, tokens: int = None) -> EncodedImage:
+    """JPEG-encode one ``uint8 [h,w,C]`` frame."""
+    if frame.shape[2] == 1:
+        pil = Image.fromarray(frame[:, :, 0], "L")
+    else:
+        pil = Image.fromarray(np.ascontiguousarray(frame), "RGB")
+    buf = io.BytesIO()
+    pil.save(buf, format="JPEG", quality=quality)
+    return EncodedImage(buf.getvalue(), frame.shape[1], frame.shape[0], tokens)
+
+
+def encode_images(img, max_side: int = None, quality: int = DEFAULT_QUALITY,
+                  executor=None, use_cache: bool = True, geometry=None, token_budget: int = 0,
+                  labels: dict = None) -> list:
+    """Encode every frame of ``img``; returns a list of :class:`EncodedImage`.
+
+    With a model ``geometry`` (:func:`image_planner.geometry_for`) or an
+    image ``token_budget`` the size comes from :func:`image_planner.plan_image`,
+    ``max_side`` then only bounds it; otherwise frames are shrunk to fit
+    ``max_side`` (``DEFAULT_MAX_SIDE`` if not given).  Results are looked up in / stored to
+    :data:`image_cache.image_cache` by tensor fingerprint.  With
+    ``executor`` the per-frame JPEG encodes run in that pool (Pillow
+    releases the GIL while encoding).  ``labels`` (node, model, server; see
+    :func:`metrics.request_labels`) go on the encode time metric.
+    """
+    started = time.perf_counter()
+    labels = labels or {}
+    plan = None
+    if geometry is not None or token_budget:
+        _, h, w, _ = _as_batch(img).shape
+        plan = plan_image(geometry, h, w, token_budget, max_side)
+    elif not max_side:
+        max_side = DEFAULT_MAX_SIDE
+    key = None
+    if use_cache:
+        key = image_cache.make_key(img, max_side, quality, plan.key() if plan is not None else "")
+    if key is not None:
+        cached = image_cache.get(key)
+        if cached is not None:
+            metrics.encode_seconds.observe(time.perf_counter() - started, cached="true", **labels)
+            return cached
+
+    batch = prepare_batch(img, max_side, plan)
+    tokens = plan.tokens if plan is not None else plan_image(None, batch.shape[1], batch.shape[2]).tokens
+    if executor is not None and len(batch) > 1:
+        encoded = list(executor.map(lambda frame: encode_jpeg(frame, quality, tokens), batch))
+    else:
+        encoded = [encode_jpeg(frame, quality, tokens) for frame in batch]
+
+    if key is not None:
+        image_cache.put(key, encoded)
+    metrics.encode_seconds.observe(time.perf_counter() - started, cached="false", **labels)
+    return encoded
+
+
+def encode_image(img, max_side: int = None, quality: int = DEFAULT_QUALITY,
+                 use_cache: bool = True, geometry=None, token_budget: int = 0, labels: dict = None) -> EncodedImage:
+    """Encode a single image; a batch with more than one frame is an error."""
+    encoded = encode_images(img, max_side, quality, use_cache=use_cache, geometry=geometry,
+                            token_budget=token_budget, labels=labels)
+    if len(encoded) != 1:
+        raise TypeError(f"Got a batch of {len(encoded)} images, use Ollama Vision Batch to caption batches")
+    return encoded[0]
+
+
+def image_part(index: int) -> dict:
+    """Message content part referencing the ``index``-th image passed to :func:`dumps_with_images`."""
+    return {"type": "image_url", "image_url": {"url": _PLACEHOLDER.format(index)}}
+
+
+def dumps_with_images(payload: dict, images: list, data_url: bool = True) -> bytes:
+    """Serialize ``payload`` and splice the images' base64 into the body.
+
+    ``payload`` references images through :func:`image_part`; the JSON is
+    built with short placeholders and the base64 bytes are joined in
+    directly, avoiding a ``str`` copy and ``json`` escaping of each image.
+    ``data_url=False`` splices bare base64, as the native API expects.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    if not images:
+        return body
+    parts = []
+    pos = 0
+    for i, image in enumerate(images):
+        marker = _PLACEHOLDER.format(i).encode("ascii")
+        idx = body.index(marker, pos)
+        parts.append(body[pos:idx])
+        if data_url:
+            parts.append(_DATA_URL_PREFIX)
+        parts.append(image.b64)
+        pos = idx + len(marker)
+    parts.append(body[pos:])
+    return b"".join(parts)
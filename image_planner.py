@@ -0,0 +1,195 @@
+# image_planner.py
+
+"""Choosing the size an image is sent at, per model.
+
+Every vision node used to shrink images to fit 512×512, whatever the model
+does with them next.  Models differ a lot:
+
+* fixed-size encoders (Gemma 3, LLaVA 1.5, Moondream) squash any image to
+  one square and always spend the same number of tokens — a non-square
+  image is distorted, a larger one is wasted upload and encode time;
+* tiled encoders (LLaVA 1.6, MiniCPM-V, Llama 3.2 Vision) cut the image
+  into a grid of square tiles, and tokens grow with the number of tiles;
+* native-resolution encoders (Qwen2.5-VL, Qwen3-VL, Mistral Small 3.x) cut
+  it into patches, one token per ``unit``×``unit`` pixels, so the token
+  count (and prompt-eval time) grows with the area.
+
+:func:`plan_image` picks, for a model family (:func:`geometry_for`, by model
+name), the size to resize the image to (aspect ratio kept) and the canvas
+to pad it onto so that it lines up with the model's square, tile grid or
+patch grid, within an optional budget of image tokens.  The returned
+:class:`ImagePlan` also carries the estimated number of image tokens.
+
+Unknown models keep the old 512-pixel thumbnail; their tokens are estimated
+as for a 28-pixel patch grid.  Token counts are estimates from the models'
+published preprocessing and may be off by a few tokens.
+"""
+
+import math
+
+DEFAULT_MAX_SIDE = 512
+# Средний цвет пикселя CLIP — поля паддинга не отвлекают энкодер
+PAD_COLOR = (122, 116, 104)
+
+
+def thumbnail_size(height: int, width: int, max_side: int):
+    """Same target size as ``PIL.Image.thumbnail((max_side, max_side))``."""
+    if max_side <= 0 or (height <= max_side and width <= max_side):
+        return height, width
+    scale = min(max_side / height, max_side / width)
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+class ImagePlan:
+    """Resize to ``height``×``width``, then pad (centered) to the canvas."""
+
+    __slots__ = ("height", "width", "canvas_height", "canvas_width", "tokens")
+
+    def __init__(self, height: int, width: int, canvas_height: int = None, canvas_width: int = None,
+                 tokens: int = None):
+        self.height = height
+        self.width = width
+        self.canvas_height = canvas_height or height
+        self.canvas_width = canvas_width or width
+        self.tokens = tokens
+
+    @property
+    def padded(self) -> bool:
+        return (self.canvas_height, self.canvas_width) != (self.height, self.width)
+
+    def key(self) -> str:
+        return f"{self.height}x{self.width}/{self.canvas_height}x{self.canvas_width}"
+
+    def __repr__(self):
+        return f"ImagePlan({self.key()}, tokens={self.tokens})"
+
+
+class PatchGeometry:
+    """One token per ``unit``×``unit`` pixels, up to ``max_tokens`` per image."""
+
+    def __init__(self, name: str, unit: int, max_tokens: int, min_tokens: int = 4):
+        self.name = name
+        self.unit = unit
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+
+    def estimate(self, height: int, width: int) -> int:
+        return math.ceil(height / self.unit) * math.ceil(width / self.unit)
+
+    def plan(self, height: int, width: int, budget: int = 0, max_side: int = None) -> ImagePlan:
+        limit = min(budget, self.max_tokens) if budget else self.max_tokens
+        limit = max(limit, self.min_tokens)
+        if not budget and not max_side:
+            max_side = DEFAULT_MAX_SIDE
+        # Не увеличиваем: мелкая картинка и так укладывается в бюджет
+        scale = 1.0
+        if max_side:
+            # Холст округляется вверх до unit — сторона картинки не больше max_side, округлённого вниз
+            max_side = max(max_side // self.unit * self.unit, min(max_side, self.unit))
+            scale = min(scale, max_side / max(height, width))
+        scale = min(scale, math.sqrt(limit * self.unit * self.unit / (height * width)))
+        while True:
+            h, w = max(1, round(height * scale)), max(1, round(width * scale))
+            tokens = self.estimate(h, w)
+            if tokens <= limit or (h == 1 and w == 1):
+                break
+            scale *= 0.97
+        canvas_h = math.ceil(h / self.unit) * self.unit
+        canvas_w = math.ceil(w / self.unit) * self.unit
+        if max_side:
+            canvas_h, canvas_w = min(canvas_h, max(max_side, h)), min(canvas_w, max(max_side, w))
+        return ImagePlan(h, w, canvas_h, canvas_w, tokens)
+
+
+class FixedGeometry:
+    """The model resizes every image to ``size``×``size`` and spends ``tokens`` on it."""
+
+    def __init__(self, name: str, size: int, tokens: int):
+        self.name = name
+        self.size = size
+        self.tokens = tokens
+
+    def plan(self, height: int, width: int, budget: int = 0, max_side: int = None) -> ImagePlan:
+        # Бюджет не меняет число токенов; дополняем до квадрата, чтобы модель не исказила пропорции
+        side = min(self.size, max_side) if max_side else self.size
+        h, w = thumbnail_size(height, width, side)
+        canvas = max(h, w)
+        return ImagePlan(h, w, canvas, canvas, self.tokens)
+
+
+class TiledGeometry:
+    """A grid of up to ``max_tiles`` ``tile``-pixel tiles, plus an overview tile if ``thumbnail``."""
+
+    def __init__(self, name: str, tile: int, tile_tokens: int, max_tiles: int, thumbnail: bool = True):
+        self.name = name
+        self.tile = tile
+        self.tile_tokens = tile_tokens
+        self.max_tiles = max_tiles
+        self.thumbnail = thumbnail
+
+    def tokens(self, tiles: int) -> int:
+        return (tiles + (1 if self.thumbnail and tiles > 1 else 0)) * self.tile_tokens
+
+    def plan(self, height: int, width: int, budget: int = 0, max_side: int = None) -> ImagePlan:
+        allowed = self.max_tiles
+        if budget:
+            while allowed > 1 and self.tokens(allowed) > budget:
+                allowed -= 1
+        best = None
+        for rows in range(1, allowed + 1):
+            for cols in range(1, allowed // rows + 1):
+                if max_side and max(rows, cols) * self.tile > max(max_side, self.tile):
+                    continue
+                scale = min(cols * self.tile / width, rows * self.tile / height, 1.0)
+                # Больше деталей лучше, при равенстве — меньше плиток
+                rank = (round(scale * scale * height * width), -rows * cols)
+                if best is None or rank > best[0]:
+                    best = (rank, rows, cols, scale)
+        _, rows, cols, scale = best
+        canvas_h, canvas_w = rows * self.tile, cols * self.tile
+        if max_side and max(canvas_h, canvas_w) > max_side:
+            # max_side меньше плитки: одна плитка, уменьшенная до max_side; модель сама растянет её
+            scale = min(scale, max_side / max(height, width))
+            canvas_h = canvas_w = max_side
+        h, w = max(1, round(height * scale)), max(1, round(width * scale))
+        return ImagePlan(h, w, canvas_h, canvas_w, self.tokens(rows * cols))
+
+
+# Для неизвестных моделей: оценка по сетке 28 px (ViT 14 px со слиянием 2×2)
+GENERIC = PatchGeometry("generic", 28, 1280)
+
+# Подстрока имени модели -> геометрия; проверяются по порядку
+FAMILIES = (
+    (("qwen3-vl", "qwen3vl"), PatchGeometry("qwen3-vl", 32, 4096)),
+    (("qwen2.5vl", "qwen2.5-vl", "qwen2-vl", "qwen2vl"), PatchGeometry("qwen2.5-vl", 28, 1280)),
+    (("mistral-small3", "mistral-small-3"), PatchGeometry("mistral-small3", 28, 3025)),
+    (("llama3.2-vision", "mllama"), TiledGeometry("llama3.2-vision", 560, 1601, 4, thumbnail=False)),
+    (("minicpm-v",), TiledGeometry("minicpm-v", 448, 64, 9)),
+    (("gemma3",), FixedGeometry("gemma3", 896, 256)),
+    (("moondream",), FixedGeometry("moondream", 378, 729)),
+    (("llava-llama3", "llava-phi3", "bakllava"), FixedGeometry("llava-1.5", 336, 576)),
+    (("llava",), TiledGeometry("llava-1.6", 336, 576, 4)),
+)
+
+
+def geometry_for(model_name: str):
+    """Image geometry of ``model_name``'s family, or ``None`` if unknown."""
+    name = (model_name or "").lower()
+    for patterns, geometry in FAMILIES:
+        if any(p in name for p in patterns):
+            return geometry
+    return None
+
+
+def plan_image(geometry, height: int, width: int, budget: int = 0, max_side: int = None) -> ImagePlan:
+    """Size and padding for a ``height``×``width`` image sent to a model with ``geometry``.
+
+    ``budget`` — image tokens allowed for this image (0 — the model's
+    default); ``max_side`` — an upper bound on the resized image.
+    """
+    if geometry is None:
+        if budget:
+            return GENERIC.plan(height, width, budget, max_side)
+        h, w = thumbnail_size(height, width, max_side or DEFAULT_MAX_SIDE)
+        return ImagePlan(h, w, tokens=GENERIC.estimate(h, w))
+    return geometry.plan(height, width, budget, max_side)
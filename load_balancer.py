@@ -0,0 +1,283 @@
+# load_balancer.py
+
+"""Spreading requests over several Ollama servers.
+
+``ip_port`` may name more than one server:
+
+* a comma-separated list — ``"gpu1:11434, gpu2:11434"``;
+* a named pool from ``server_pools.json`` next to ``list_models.json`` —
+  ``"pool:gpu"`` with ``{"gpu": ["gpu1:11434", "gpu2:11434"]}`` in the file.
+
+Each request goes to the healthy server that already has the model loaded
+(to avoid a cold load), and among those to the one with the fewest
+requests outstanding.  A retry goes to a different server than the one
+that just failed.
+
+Each server has a circuit breaker (passive health checking): after
+``EJECT_AFTER_FAILURES`` failures in a row it is ejected for a growing
+back-off period, then a single probe request is let through — success
+closes the circuit, failure ejects it again for longer.  While every
+server of a request is ejected :meth:`LoadBalancer.choose` raises
+:class:`ServerUnavailable` at once instead of letting the request wait on a
+dead host.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.error
+from collections import OrderedDict
+
+from .log_utils import get_logger
+
+logger = get_logger("OllamaLoadBalancer")
+
+POOLS_FILE = os.path.join(os.path.dirname(__file__), "server_pools.json")
+POOL_PREFIX = "pool:"
+
+# Сколько ошибок подряд до исключения сервера из ротации
+EJECT_AFTER_FAILURES = 2
+EJECT_BASE_SECONDS = 10.0
+EJECT_MAX_SECONDS = 300.0
+# Сколько секунд пробный запрос держит полуоткрытый сервер
+PROBE_WINDOW = 30.0
+# Сколько последних моделей считаем загруженными на сервере
+AFFINITY_MODELS = 3
+
+
+def _load_pools() -> dict:
+    try:
+        with open(POOLS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning("Can't read %s: %s", POOLS_FILE, e)
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+_pools_cache = {"mtime": None, "pools": {}}
+_pools_lock = threading.Lock()
+
+
+def get_pools() -> dict:
+    """Named pools from ``server_pools.json``, re-read when the file changes."""
+    try:
+        mtime = os.path.getmtime(POOLS_FILE)
+    except OSError:
+        mtime = None
+    with _pools_lock:
+        if mtime != _pools_cache["mtime"]:
+            _pools_cache["pools"] = _load_pools() if mtime is not None else {}
+            _pools_cache["mtime"] = mtime
+        return _pools_cache["pools"]
+
+
+def resolve_endpoints(ip_port: str) -> list:
+    """Expand ``ip_port`` into a list of ``host:port`` servers."""
+    value = (ip_port or "").strip()
+    if value.startswith(POOL_PREFIX):
+        name = value[len(POOL_PREFIX):].strip()
+        endpoints = get_pools().get(name)
+        if not endpoints:
+            raise ValueError(f"Unknown server pool '{name}' (see {os.path.basename(POOLS_FILE)})")
+        if isinstance(endpoints, str):
+            endpoints = [endpoints]
+    else:
+        endpoints = value.split(",")
+    endpoints = [e.strip() for e in endpoints if e and e.strip()]
+    if not endpoints:
+        raise ValueError("No Ollama server given")
+    # Порядок сохраняем, дубликаты убираем
+    return list(dict.fromkeys(endpoints))
+
+
+def canonical_model_name(model_name: str) -> str:
+    """``llama3`` -> ``llama3:latest``, the way Ollama lists models."""
+    name = (model_name or "").strip()
+    if name and ":" not in name.rsplit("/", 1)[-1]:
+        name += ":latest"
+    return name
+
+
+def is_host_failure(exc) -> bool:
+    """Whether an error says something about the server's health."""
+    if exc is None:
+        return False
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500
+    return isinstance(exc, OSError)
+
+
+class ServerUnavailable(Exception):
+    """Every server for the request is ejected by its circuit breaker."""
+
+    def __init__(self, endpoints, retry_in: float):
+        super().__init__(f"{', '.join(endpoints)} unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.endpoints = list(endpoints)
+        self.retry_in = retry_in
+
+
+class _Endpoint:
+    __slots__ = ("outstanding", "failures", "ejected_until", "probe_at", "models", "requests")
+
+    def __init__(self):
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.probe_at = 0.0
+        self.models = OrderedDict()
+        self.requests = 0
+
+    def available_at(self) -> float:
+        """When the breaker lets the next request through (0 — now)."""
+        if self.failures < EJECT_AFTER_FAILURES:
+            return 0.0
+        # Полуоткрытое состояние: одна пробная попытка за раз
+        return max(self.ejected_until, self.probe_at + PROBE_WINDOW if self.probe_at else 0.0)
+
+
+class LoadBalancer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _state(self, endpoint: str) -> _Endpoint:
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            state = self._endpoints[endpoint] = _Endpoint()
+        return state
+
+    def _rank(self, endpoints, model_name):
+        def rank(e):
+            state = self._state(e)
+            warm = model_name is not None and canonical_model_name(model_name) in state.models
+            return (not warm, state.outstanding, state.requests)
+
+        return min(endpoints, key=rank)
+
+    def choose(self, endpoints, model_name=None, exclude=(), prefer=None) -> str:
+        """Pick a server for ``model_name`` from ``endpoints``.
+
+        Servers in ``exclude`` (already tried for this request) are skipped
+        unless nothing else is available.  ``prefer`` (e.g. the server that
+        holds a chat session's KV cache) wins whenever it is healthy and not
+        excluded.  Raises :class:`ServerUnavailable` if the circuit of every
+        server is open.
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in endpoints if self._state(e).available_at() <= now]
+            if not healthy:
+                retry_in = min(self._state(e).available_at() for e in endpoints) - now
+                raise ServerUnavailable(endpoints, max(0.0, retry_in))
+            if prefer in healthy and prefer not in exclude:
+                chosen = prefer
+            else:
+                chosen = self._rank([e for e in healthy if e not in exclude] or healthy, model_name)
+            state = self._state(chosen)
+            if state.failures >= EJECT_AFTER_FAILURES:
+                state.probe_at = now
+            return chosen
+
+    def preferred(self, endpoints, model_name=None) -> str:
+        """Server :meth:`choose` would most likely pick, for planning (prefetch, preload)."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in endpoints if self._state(e).available_at() <= now]
+            return self._rank(healthy or list(endpoints), model_name)
+
+    def begin(self, endpoint: str):
+        with self._lock:
+            state = self._state(endpoint)
+            state.outstanding += 1
+            state.requests += 1
+
+    def end(self, endpoint: str, model_name=None, exc=None):
+        with self._lock:
+            state = self._state(endpoint)
+            state.outstanding = max(0, state.outstanding - 1)
+            state.probe_at = 0.0
+            if is_host_failure(exc):
+                state.failures += 1
+                if state.failures >= EJECT_AFTER_FAILURES:
+                    period = min(EJECT_MAX_SECONDS,
+                                 EJECT_BASE_SECONDS * 2 ** (state.failures - EJECT_AFTER_FAILURES))
+                    state.ejected_until = time.monotonic() + period
+                    logger.warning("LoadBalancer: ejecting %s for %.0fs after %s failures (%s)",
+                                   endpoint, period, state.failures, exc)
+            elif exc is None:
+                state.failures = 0
+                state.ejected_until = 0.0
+                if model_name:
+                    self._mark_loaded(state, model_name)
+
+    def lease(self, endpoint: str, model_name=None):
+        return _Lease(self, endpoint, model_name)
+
+    @staticmethod
+    def _mark_loaded(state: _Endpoint, model_name: str):
+        model_name = canonical_model_name(model_name)
+        state.models[model_name] = time.monotonic()
+        state.models.move_to_end(model_name)
+        while len(state.models) > AFFINITY_MODELS:
+            state.models.popitem(last=False)
+
+    def mark_loaded(self, endpoint: str, model_name: str):
+        with self._lock:
+            self._mark_loaded(self._state(endpoint), model_name)
+
+    def mark_unloaded(self, endpoint: str, model_name=None):
+        with self._lock:
+            state = self._state(endpoint)
+            if model_name is None:
+                state.models.clear()
+            else:
+                state.models.pop(canonical_model_name(model_name), None)
+
+    def set_loaded(self, endpoint: str, model_names):
+        """Replace the known resident models (e.g. from ``/api/ps``)."""
+        with self._lock:
+            state = self._state(endpoint)
+            state.models.clear()
+            for name in model_names:
+                self._mark_loaded(state, name)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                e: {
+                    "outstanding": s.outstanding,
+                    "requests": s.requests,
+                    "failures": s.failures,
+                    "ejected": s.ejected_until > now,
+                    "circuit": "closed" if s.failures < EJECT_AFTER_FAILURES
+                               else "open" if s.available_at() > now else "half-open",
+                    "models": list(s.models),
+                }
+                for e, s in self._endpoints.items()
+            }
+
+
+class _Lease:
+    """Counts a request as outstanding on ``endpoint`` while it runs."""
+
+    def __init__(self, balancer: LoadBalancer, endpoint: str, model_name):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.model_name = model_name
+
+    def __enter__(self):
+        self.balancer.begin(self.endpoint)
+        return self.endpoint
+
+    def __exit__(self, exc_type, exc, tb):
+        self.balancer.end(self.endpoint, self.model_name, exc)
+        return False
+
+
+# Общий балансировщик для всех нод
+balancer = LoadBalancer()
@@ -0,0 +1,124 @@
+# log_utils.py
+
+"""Logging helpers shared by all modules.
+
+* :func:`get_logger` no longer forces ``DEBUG``: the level comes from the
+  host (ComfyUI's ``--verbose``), unless ``OLLAMA_NODES_LOG_LEVEL`` is set.
+  Messages use ``%``-style arguments, so a disabled level costs a single
+  ``isEnabledFor`` check and nothing gets formatted.
+* :func:`abbreviate` wraps a response body or payload for logging: it is
+  cut to its head and tail (``OLLAMA_NODES_LOG_BODY_LIMIT`` characters,
+  2000 by default) and only when the record is actually emitted.
+* Request traces replace the raw dumps: with ``OLLAMA_NODES_TRACE=1`` every
+  request attempt is logged as one JSON line (node, model, server, status,
+  sizes and timings) on the ``OllamaTrace`` logger; with
+  ``OLLAMA_NODES_TRACE=/path/trace.jsonl`` the lines go to that file.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+BODY_LIMIT = 2000
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+_LEVEL = os.environ.get("OLLAMA_NODES_LOG_LEVEL", "").strip().upper()
+_BODY_LIMIT = _env_int("OLLAMA_NODES_LOG_BODY_LIMIT", BODY_LIMIT)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger ``name`` at the level configured by the host or ``OLLAMA_NODES_LOG_LEVEL``."""
+    logger = logging.getLogger(name)
+    if _LEVEL:
+        try:
+            logger.setLevel(_LEVEL)
+        except ValueError:
+            pass
+    return logger
+
+
+logger = get_logger("OllamaLog")
+
+
+class _Abbreviated:
+    __slots__ = ("body", "limit")
+
+    def __init__(self, body, limit: int):
+        self.body = body
+        self.limit = limit
+
+    def __str__(self) -> str:
+        body = self.body
+        if isinstance(body, (bytes, bytearray)):
+            body = bytes(body).decode("utf-8", "replace")
+        elif not isinstance(body, str):
+            body = str(body)
+        if self.limit <= 0 or len(body) <= self.limit:
+            return body
+        # Начало и конец тела: там обычно видно, что пошло не так
+        half = self.limit // 2
+        return f"{body[:half]} …[{len(body)} chars]… {body[-half:]}"
+
+    __repr__ = __str__
+
+
+def abbreviate(body, limit: int = None):
+    """``body`` for a log message, truncated lazily to ``limit`` characters."""
+    return _Abbreviated(body, _BODY_LIMIT if limit is None else limit)
+
+
+class _TraceSink:
+    def __init__(self, target: str):
+        self.target = target
+        self._file = None
+        self._lock = threading.Lock()
+        self._logger = None
+        if target.lower() in ("1", "true", "yes", "log"):
+            self._logger = get_logger("OllamaTrace")
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str)
+        if self._logger is not None:
+            self._logger.info("%s", line)
+            return
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.target, "a", encoding="utf-8")
+                self._file.write(line + "\n")
+                self._file.flush()
+            except OSError as e:
+                logger.warning("trace: can't write %s: %s", self.target, e)
+
+
+_trace_target = os.environ.get("OLLAMA_NODES_TRACE", "").strip()
+_sink = _TraceSink(_trace_target) if _trace_target and _trace_target != "0" else None
+
+
+def tracing() -> bool:
+    """Whether request traces are enabled."""
+    return _sink is not None
+
+
+def trace(record: dict):
+    """Write one trace record (a JSON line) if tracing is enabled."""
+    if _sink is None:
+        return
+    record.setdefault("ts", round(time.time(), 3))
+    _sink.write(record)
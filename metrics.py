@@ -0,0 +1,377 @@
+# metrics.py
+
+"""Latency and throughput metrics in Prometheus exposition format.
+
+Every request records how long it queued for a server slot, how long the
+connection and the first token took, the total time, generation speed and
+its outcome.  Image encoding, retries, model pulls and unloads are counted
+too.  Series are labeled by node type, model and server.
+
+The metrics are exported as text:
+
+* at ``GET /ollama/metrics`` on the ComfyUI server;
+* to the file named by ``OLLAMA_NODES_METRICS_FILE`` (rewritten every
+  ``OLLAMA_NODES_METRICS_INTERVAL`` seconds, 15 by default) for the node
+  exporter's textfile collector;
+* from :func:`render` for scripts and benchmarks.
+
+Cache and connection pool statistics are exported as gauges read at export
+time, so they cost nothing per request.
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+
+from .log_utils import _env_float, get_logger, trace, tracing
+
+logger = get_logger("OllamaMetrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        # Номер первой корзины, в которую попадает значение
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), series):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, key), series[-2]
+            yield f"{self.name}_count", _format_labels(self.labels, key), series[-1]
+
+
+class Gauges:
+    """Gauges computed at export time by ``collect() -> [(labels dict, value)]``."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.debug("Gauges %s: collect failed: %s", self.name, e)
+            return
+        for labels, value in values:
+            yield self.name, _format_labels(list(labels), list(labels.values())), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauges(self, name, help_text, collect) -> Gauges:
+        return self.register(Gauges(name, help_text, collect))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LABELS = ("node", "model", "server")
+
+requests_total = registry.counter(
+    "ollama_requests_total", "Chat requests by outcome.", REQUEST_LABELS + ("status",))
+request_seconds = registry.histogram(
+    "ollama_request_seconds", "Chat request time from send to last byte.", REQUEST_LABELS)
+ttft_seconds = registry.histogram(
+    "ollama_time_to_first_token_seconds", "Time from send to the first streamed token.", REQUEST_LABELS)
+tokens_per_second = registry.histogram(
+    "ollama_tokens_per_second", "Generation speed reported by the server or measured on the stream.",
+    REQUEST_LABELS, RATE_BUCKETS)
+queue_wait_seconds = registry.histogram(
+    "ollama_queue_wait_seconds", "Time waiting for a per-server request slot.", ("node", "server"))
+connect_seconds = registry.histogram(
+    "ollama_connect_seconds", "TCP/TLS connect time of new pooled connections.", ("server",))
+retries_total = registry.counter(
+    "ollama_retries_total", "Failed request attempts by reason (retried unless it was the last).",
+    ("node", "model", "reason"))
+coalesced_total = registry.counter(
+    "ollama_coalesced_total", "Requests answered by an identical request already in flight.", ("node", "model"))
+image_tokens_total = registry.counter(
+    "ollama_image_tokens_total", "Estimated image tokens sent, as planned for each model.", ("node", "model"))
+encode_seconds = registry.histogram(
+    "ollama_image_encode_seconds", "Image batch resize + JPEG encode time.", REQUEST_LABELS + ("cached",))
+pull_seconds = registry.histogram(
+    "ollama_pull_seconds", "Model pull time.", ("server", "model", "status"),
+    LATENCY_BUCKETS + (600.0, 1800.0, 3600.0))
+unloads_total = registry.counter(
+    "ollama_unloads_total", "Model unload requests by outcome.", ("server", "status"))
+
+
+def _host(server: str) -> str:
+    return server.split("://", 1)[-1]
+
+
+def request_labels(node: str, model: str, server: str) -> dict:
+    """Labels of the per-request metrics (:data:`REQUEST_LABELS`)."""
+    return {"node": node, "model": model, "server": _host(server.strip())}
+
+
+class _RequestTimer:
+    """Times one chat request; see :func:`track_request`."""
+
+    def __init__(self, node: str, model: str, server: str, attempt: int = 1, request_bytes: int = 0):
+        self.labels = request_labels(node, model, server)
+        self.attempt = attempt
+        self.request_bytes = request_bytes
+        self.started = None
+        self.first_token = None
+        self.tokens = 0
+        self.info = None
+        self._token = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_timer.reset(self._token)
+        elapsed = time.perf_counter() - self.started
+        if exc_type is None:
+            status = "ok"
+        elif exc_type.__name__ == "HTTPError":
+            status = f"http_{getattr(exc, 'code', 'error')}"
+        else:
+            status = exc_type.__name__
+        requests_total.inc(status=status, **self.labels)
+        request_seconds.observe(elapsed, **self.labels)
+        if exc_type is None:
+            self._record_speed(elapsed)
+        if tracing():
+            self._trace(status, elapsed)
+        return False
+
+    def _trace(self, status: str, elapsed: float):
+        record = dict(self.labels)
+        record.update(status=status, attempt=self.attempt, request_bytes=self.request_bytes,
+                      seconds=round(elapsed, 4), chunks=self.tokens)
+        if self.first_token is not None:
+            record["ttft"] = round(self.first_token, 4)
+        for key, value in (self.info or {}).items():
+            if key != "usage":
+                record[key] = value
+        usage = (self.info or {}).get("usage")
+        if usage:
+            record["prompt_tokens"] = usage.get("prompt_tokens")
+            record["completion_tokens"] = usage.get("completion_tokens")
+        trace(record)
+
+    def _record_speed(self, elapsed: float):
+        info = self.info or {}
+        eval_count, eval_duration = info.get("eval_count"), info.get("eval_duration")
+        if eval_count and eval_duration:
+            tokens_per_second.observe(eval_count / (eval_duration / 1e9), **self.labels)
+        elif self.tokens > 1 and self.first_token is not None and elapsed > self.first_token:
+            # Стрим без таймингов сервера: чанки после первого за время генерации
+            tokens_per_second.observe((self.tokens - 1) / (elapsed - self.first_token), **self.labels)
+
+
+_current_timer = contextvars.ContextVar("ollama_request_timer", default=None)
+
+
+def track_request(node: str, model: str, server: str, attempt: int = 1, request_bytes: int = 0) -> _RequestTimer:
+    """Context manager timing one chat request to ``server``.
+
+    Attach the response's timing ``info`` via ``timer.info`` so generation
+    speed comes from the server's own counters.  With tracing enabled (see
+    :mod:`log_utils`) the request is also written as one trace record.
+    """
+    return _RequestTimer(node, model, server, attempt, request_bytes)
+
+
+def mark_token():
+    """Called by the stream reader for every text chunk of the current request."""
+    timer = _current_timer.get()
+    if timer is None:
+        return
+    timer.tokens += 1
+    if timer.first_token is None:
+        timer.first_token = time.perf_counter() - timer.started
+        ttft_seconds.observe(timer.first_token, **timer.labels)
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format."""
+    return registry.render()
+
+
+def _register_route() -> bool:
+    try:
+        from server import PromptServer
+        from aiohttp import web
+    except ImportError:
+        return False
+    instance = getattr(PromptServer, "instance", None)
+    if instance is None:
+        return False
+
+    @instance.routes.get("/ollama/metrics")
+    async def metrics_route(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    return True
+
+
+def _write_file_loop(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(render())
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning("metrics: can't write %s: %s", path, e)
+
+
+def _collect_caches():
+    from .image_cache import image_cache_stats
+    from .response_cache import cache_stats
+
+    for cache, stats in (("response", cache_stats()), ("image", image_cache_stats())):
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)):
+                yield {"cache": cache, "stat": stat}, value
+
+
+def _collect_pools():
+    from .http_client import pool_stats
+
+    for pool, stats in pool_stats().items():
+        for stat, value in stats.items():
+            yield {"pool": pool, "stat": stat}, value
+
+
+def _collect_sessions():
+    from .chat_session import sessions
+
+    for stat, value in sessions.stats().items():
+        yield {"stat": stat}, value
+
+
+registry.gauges("ollama_cache", "Response and image cache statistics.", _collect_caches)
+registry.gauges("ollama_connection_pool", "Pooled HTTP connections per server.", _collect_pools)
+registry.gauges("ollama_sessions", "Chat sessions with server-side state.", _collect_sessions)
+
+
+def start_exporters():
+    """Expose metrics over HTTP (inside ComfyUI) and/or to a file."""
+    _register_route()
+    path = os.environ.get("OLLAMA_NODES_METRICS_FILE")
+    if path:
+        interval = _env_float("OLLAMA_NODES_METRICS_INTERVAL", 15.0)
+        threading.Thread(target=_write_file_loop, args=(path, interval), daemon=True,
+                         name="ollama-metrics-file").start()
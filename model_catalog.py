@@ -0,0 +1,277 @@
+# model_catalog.py
+
+"""What models the Ollama servers actually have.
+
+The model dropdowns used to come from hand-maintained ``list_models.json`` /
+``reasoning_model_list.json``, which drift from what is installed and turn
+a pick into a multi-GB download at run time.  The catalog asks the servers
+instead:
+
+* ``/api/tags`` — installed models with size, digest and quantization;
+* ``/api/show`` — context length and capabilities (``vision``,
+  ``thinking``...), fetched once per model digest since a digest never
+  changes.
+
+Results are cached for ``CATALOG_TTL`` seconds.  A stale entry is returned
+at once and refreshed in the background, so ``INPUT_TYPES`` doesn't wait on
+the network; only the very first lookup does (with a short timeout).  When
+no server answers the dropdowns fall back to the JSON files.
+
+Servers are ``OLLAMA_NODES_CATALOG_SERVERS`` (a comma list or
+``pool:<name>``, ``localhost:11434`` by default) plus every server the nodes
+have sent requests to.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .http_client import urlopen
+from .load_balancer import balancer, canonical_model_name, resolve_endpoints
+from .log_utils import get_logger
+
+logger = get_logger("OllamaCatalog")
+
+CATALOG_TTL = 60.0
+REQUEST_TIMEOUT = 3.0
+SHOW_WORKERS = 8
+NO_MODELS = "< no models >"
+
+
+class ModelInfo:
+    __slots__ = ("name", "size", "digest", "family", "parameter_size", "quantization",
+                 "context_length", "capabilities", "servers")
+
+    def __init__(self, name: str, size: int = 0, digest: str = "", family: str = "", parameter_size: str = "",
+                 quantization: str = ""):
+        self.name = name
+        self.size = size
+        self.digest = digest
+        self.family = family
+        self.parameter_size = parameter_size
+        self.quantization = quantization
+        self.context_length = 0
+        self.capabilities = None  # None — сервер не сообщил
+        self.servers = []
+
+    @property
+    def vision(self) -> bool:
+        return bool(self.capabilities and "vision" in self.capabilities)
+
+    @property
+    def reasoning(self) -> bool:
+        return bool(self.capabilities and "thinking" in self.capabilities)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "family": self.family,
+            "parameter_size": self.parameter_size,
+            "quantization": self.quantization,
+            "context_length": self.context_length,
+            "capabilities": sorted(self.capabilities) if self.capabilities is not None else None,
+            "servers": list(self.servers),
+        }
+
+
+def fetch_tags(server: str, timeout: float = REQUEST_TIMEOUT) -> list:
+    """Installed models on ``server`` (``/api/tags``) as :class:`ModelInfo`."""
+    with urlopen(server, "/api/tags", timeout=timeout) as resp:
+        data = json.loads(resp.read().decode("utf-8"))
+    models = []
+    for m in data.get("models") or []:
+        details = m.get("details") or {}
+        models.append(ModelInfo(
+            canonical_model_name(m.get("name") or m.get("model")),
+            size=int(m.get("size") or 0),
+            digest=m.get("digest") or "",
+            family=details.get("family") or "",
+            parameter_size=details.get("parameter_size") or "",
+            quantization=details.get("quantization_level") or "",
+        ))
+    return models
+
+
+def fetch_show(server: str, model_name: str, timeout: float = REQUEST_TIMEOUT) -> dict:
+    """``/api/show`` for ``model_name``: ``{"context_length": int, "capabilities": set | None}``."""
+    data = json.dumps({"model": model_name}).encode("utf-8")
+    with urlopen(server, "/api/show", data=data, timeout=timeout) as resp:
+        show = json.loads(resp.read().decode("utf-8"))
+    context_length = 0
+    for key, value in (show.get("model_info") or {}).items():
+        if key.endswith(".context_length"):
+            context_length = int(value or 0)
+            break
+    capabilities = show.get("capabilities")
+    if capabilities is not None:
+        capabilities = set(capabilities)
+    elif show.get("projector_info"):
+        # Старые версии Ollama не отдают capabilities, но проектор есть только у vision-моделей
+        capabilities = {"completion", "vision"}
+    return {"context_length": context_length, "capabilities": capabilities}
+
+
+def catalog_servers() -> list:
+    """Servers to list models from."""
+    servers = []
+    try:
+        servers = resolve_endpoints(os.environ.get("OLLAMA_NODES_CATALOG_SERVERS", "localhost:11434"))
+    except ValueError as e:
+        logger.warning("catalog_servers: %s", e)
+    for server in balancer.stats():
+        if server not in servers:
+            servers.append(server)
+    return servers
+
+
+class _ServerEntry:
+    __slots__ = ("models", "fetched_at", "refreshing", "error")
+
+    def __init__(self):
+        self.models = None
+        self.fetched_at = 0.0
+        self.refreshing = False
+        self.error = None
+
+
+class ModelCatalog:
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self._servers = {}
+        self._show = {}  # digest -> fetch_show()
+        self._lock = threading.Lock()
+
+    def _entry(self, server: str) -> _ServerEntry:
+        entry = self._servers.get(server)
+        if entry is None:
+            entry = self._servers[server] = _ServerEntry()
+        return entry
+
+    def _fetch(self, server: str) -> list:
+        models = fetch_tags(server)
+        todo = [m for m in models if m.digest not in self._show]
+        if todo:
+            def show(m):
+                try:
+                    return m.digest, fetch_show(server, m.name)
+                except Exception as e:
+                    logger.debug("ModelCatalog: /api/show %s on %s failed: %s", m.name, server, e)
+                    return m.digest, None
+
+            with ThreadPoolExecutor(max_workers=min(SHOW_WORKERS, len(todo))) as pool:
+                for digest, info in pool.map(show, todo):
+                    if info is not None:
+                        self._show[digest] = info
+        for m in models:
+            info = self._show.get(m.digest)
+            if info is not None:
+                m.context_length = info["context_length"]
+                m.capabilities = info["capabilities"]
+        return models
+
+    def _refresh(self, server: str):
+        try:
+            models = self._fetch(server)
+            error = None
+        except Exception as e:
+            models, error = None, e
+            logger.debug("ModelCatalog: %s unavailable: %s", server, e)
+        with self._lock:
+            entry = self._entry(server)
+            entry.refreshing = False
+            entry.error = error
+            entry.fetched_at = time.monotonic()
+            if models is not None:
+                entry.models = models
+
+    def installed(self, server: str, max_age: float = None, wait: bool = False):
+        """Models installed on ``server``; ``None`` if it can't be reached.
+
+        A stale list is returned as is and refreshed in the background,
+        unless ``wait`` is set.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._entry(server)
+            if time.monotonic() - entry.fetched_at < max_age:
+                return entry.models
+            background = entry.models is not None and not wait
+            if background:
+                if entry.refreshing:
+                    return entry.models
+                entry.refreshing = True
+        if background:
+            threading.Thread(target=self._refresh, args=(server,), daemon=True, name="ollama-catalog").start()
+            return entry.models
+        self._refresh(server)
+        return entry.models
+
+    def invalidate(self, server: str = None):
+        """Forget the cached model list (e.g. after a pull)."""
+        with self._lock:
+            for name, entry in self._servers.items():
+                if server is None or name == server:
+                    entry.fetched_at = 0.0
+
+    def models(self, servers=None) -> dict:
+        """``{name: ModelInfo}`` over ``servers`` (default :func:`catalog_servers`)."""
+        merged = {}
+        for server in servers or catalog_servers():
+            for m in self.installed(server) or []:
+                info = merged.get(m.name)
+                if info is None:
+                    info = merged[m.name] = ModelInfo(m.name, m.size, m.digest, m.family, m.parameter_size,
+                                                      m.quantization)
+                    info.context_length = m.context_length
+                    info.capabilities = m.capabilities
+                info.servers.append(server)
+        return merged
+
+    def describe(self, model_name: str):
+        """:class:`ModelInfo` for ``model_name`` or ``None`` if no server has it."""
+        return self.models().get(canonical_model_name(model_name))
+
+    def choices(self, fallback_file: str, capability: str = None) -> list:
+        """Dropdown values: installed models, or ``fallback_file`` when offline.
+
+        With ``capability`` only models reporting it are listed (servers too
+        old to report capabilities list everything).
+        """
+        models = self.models()
+        if models:
+            names = [
+                m.name for m in sorted(models.values(), key=lambda m: m.name)
+                if capability is None or m.capabilities is None or capability in m.capabilities
+            ]
+            return names or [NO_MODELS]
+        return _read_list(fallback_file)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                server: {
+                    "models": len(entry.models or []),
+                    "age": round(time.monotonic() - entry.fetched_at, 1) if entry.fetched_at else None,
+                    "error": str(entry.error) if entry.error else None,
+                }
+                for server, entry in self._servers.items()
+            }
+
+
+def _read_list(file_name: str) -> list:
+    path = os.path.join(os.path.dirname(__file__), file_name)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, list) and data:
+            return data
+    except Exception as e:
+        logger.warning("Can't read %s: %s", path, e)
+    return [NO_MODELS]
+
+
+# Общий каталог для всех нод
+model_catalog = ModelCatalog()
@@ -0,0 +1,81 @@
+# model_prefetch.py
+
+"""Fetching and warming up a graph's models as soon as it is queued.
+
+Without this a missing model is only noticed when its node runs: the
+request gets a 404, the node pulls the model while the whole graph waits,
+and the first request then also pays for loading the weights.
+
+When a prompt is queued, :func:`on_prompt` collects ``(ip_port,
+model_name)`` from the Ollama nodes (see :mod:`prompt_scan`) and, in a
+background thread:
+
+1. checks which models every server involved has (:mod:`model_catalog`);
+2. pulls the missing models, all at once (:mod:`model_pull`);
+3. preloads the first model of the graph, so the first request finds it in
+   VRAM.
+
+Nothing here blocks queuing, and a failed prefetch just leaves the node's
+own 404 → pull path to do the work.
+"""
+
+import threading
+
+from .load_balancer import balancer, canonical_model_name, resolve_endpoints
+from .log_utils import get_logger
+from .model_catalog import model_catalog
+from .model_pull import pull_coordinator
+from .model_residency import residency
+from .prompt_scan import models_in_prompt, register_prompt_handler
+
+logger = get_logger("OllamaPrefetch")
+
+# Насколько свежим должен быть список моделей сервера
+PREFETCH_MAX_AGE = 5.0
+
+
+def missing_models(used) -> list:
+    """``[(server, model_name)]`` from ``used`` that aren't installed yet."""
+    installed = {}
+    missing = []
+    for ip_port, model_name in used:
+        try:
+            endpoints = resolve_endpoints(ip_port)
+        except ValueError:
+            continue
+        server = balancer.preferred(endpoints, model_name)
+        if server not in installed:
+            models = model_catalog.installed(server, max_age=PREFETCH_MAX_AGE, wait=True)
+            installed[server] = None if models is None else {m.name for m in models}
+        names = installed[server]
+        if names is not None and canonical_model_name(model_name) not in names:
+            if (server, model_name) not in missing:
+                missing.append((server, model_name))
+    return missing
+
+
+def prefetch(used):
+    """Pull whatever ``used`` lacks, then warm up its first model."""
+    missing = missing_models(used)
+    if missing:
+        logger.info("prefetch: pulling %s", ', '.join(f'{m} on {s}' for s, m in missing))
+        results = pull_coordinator.pull_many(missing)
+        for (server, model_name), ok in zip(missing, results):
+            if not ok:
+                logger.warning("prefetch: pulling %s on %s failed", model_name, server)
+    residency.preload_first(used)
+
+
+def on_prompt(prompt: dict):
+    """Prompt hook: keep the graph's models and prefetch them in the background.
+
+    Runs on ComfyUI's server loop, so the network part goes to a thread.
+    """
+    used = models_in_prompt(prompt)
+    for ip_port, model_name in used:
+        residency.expect(ip_port, model_name)
+    if used:
+        threading.Thread(target=prefetch, args=(used,), daemon=True, name="ollama-prefetch").start()
+
+
+register_prompt_handler(on_prompt)
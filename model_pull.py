@@ -0,0 +1,219 @@
+# model_pull.py
+
+"""One shared, resumable download per model.
+
+``/api/pull`` streams NDJSON progress lines for every layer (``digest``) of
+the model.  The coordinator keeps at most one pull per ``(server, model)``
+in flight; every node or prefetch that needs the same model waits on that
+pull instead of starting its own.  A dropped connection or a stalled stream
+restarts the pull, and Ollama resumes the layers it already has.
+
+Progress is kept as running totals updated by each line's delta, so one
+line costs O(1) however many layers the model has.  Waiters show it on
+ComfyUI's progress bar from their own thread; the pull itself also logs a
+``tqdm`` bar to the console.
+"""
+
+import http.client
+import json
+import threading
+import time
+import urllib.error
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from . import metrics
+from .http_client import RequestCancelled, current_scope, urlopen
+from .load_balancer import canonical_model_name
+from .log_utils import _env_float, get_logger
+from .model_catalog import model_catalog
+
+logger = get_logger("OllamaPull")
+
+try:
+    import comfy.utils
+except ImportError:  # запуск вне ComfyUI
+    comfy = None
+
+# Сколько раз продолжать оборванную загрузку
+MAX_RESUMES = 5
+RESUME_BACKOFF_SECONDS = 2.0
+# Если сервер молчит дольше — считаем соединение оборванным
+READ_TIMEOUT = 120.0
+# Как часто ожидающие обновляют прогресс-бар ComfyUI
+PROGRESS_POLL_INTERVAL = 0.25
+
+
+# Сколько нода ждёт загрузку модели, секунд (0 — без ограничения); сама загрузка продолжается
+PULL_TIMEOUT = _env_float("OLLAMA_NODES_PULL_TIMEOUT", 1800.0) or None
+
+
+class PullJob:
+    """State of one pull, shared by everyone waiting for it."""
+
+    def __init__(self, server: str, model_name: str):
+        self.server = server
+        self.model_name = model_name
+        self.future = Future()
+        self.status = ""
+        self.total = 0
+        self.completed = 0
+        self._layers = {}  # digest -> [total, completed]
+
+    def update(self, info: dict):
+        """Account one progress line; O(1) per line."""
+        self.status = info.get("status", self.status)
+        digest = info.get("digest")
+        if not digest:
+            return
+        layer = self._layers.get(digest)
+        if layer is None:
+            layer = self._layers[digest] = [0, 0]
+        old_total, old_done = layer
+        new_total = int(info.get("total", old_total) or 0)
+        new_done = min(int(info.get("completed", old_done) or 0), new_total)
+        layer[0], layer[1] = new_total, new_done
+        self.total += new_total - old_total
+        self.completed += new_done - old_done
+
+    @property
+    def percent(self) -> int:
+        return int(self.completed * 100 / self.total) if self.total else 0
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the pull, mirroring its progress on ComfyUI's bar.
+
+        Cancelling the caller's request (ComfyUI interrupt) stops waiting
+        but leaves the pull running for the others.
+        """
+        scope = current_scope()
+        bar = comfy.utils.ProgressBar(100) if comfy is not None else None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        shown = -1
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            step = PROGRESS_POLL_INTERVAL if remaining is None else min(PROGRESS_POLL_INTERVAL, remaining)
+            try:
+                return self.future.result(timeout=step)
+            except FutureTimeout:
+                pass
+            if scope is not None and scope.cancelled:
+                raise RequestCancelled("request cancelled")
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            if bar is not None and self.percent != shown:
+                shown = self.percent
+                bar.update_absolute(shown, 100)
+
+
+class PullCoordinator:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+        self.resumes = 0
+
+    def start(self, server: str, model_name: str) -> PullJob:
+        """The in-flight pull of ``model_name`` on ``server``, started if needed."""
+        key = (server, canonical_model_name(model_name))
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                self.joined += 1
+                return job
+            job = self._jobs[key] = PullJob(server, model_name)
+            self.started += 1
+        threading.Thread(target=self._run, args=(key, job), daemon=True,
+                         name=f"ollama-pull-{model_name}").start()
+        return job
+
+    def pull(self, server: str, model_name: str, timeout: float = None) -> bool:
+        """Pull ``model_name`` on ``server`` (or join the running pull) and wait."""
+        return self.start(server, model_name).wait(timeout)
+
+    def pull_many(self, pairs, timeout: float = None) -> list:
+        """Pull several ``(server, model_name)`` at once; results in order."""
+        jobs = [self.start(server, model_name) for server, model_name in pairs]
+        return [job.wait(timeout) for job in jobs]
+
+    def _run(self, key, job: PullJob):
+        ok = False
+        started = time.monotonic()
+        try:
+            ok = self._pull_with_resume(job)
+        except Exception as e:
+            logger.error("PullCoordinator: pulling %s on %s failed: %s", job.model_name, job.server, e)
+        finally:
+            with self._lock:
+                self._jobs.pop(key, None)
+            metrics.pull_seconds.observe(time.monotonic() - started, server=job.server, model=job.model_name,
+                                         status="ok" if ok else "failed")
+            job.future.set_result(ok)
+
+    def _pull_with_resume(self, job: PullJob) -> bool:
+        for attempt in range(MAX_RESUMES + 1):
+            if attempt:
+                self.resumes += 1
+                logger.info("PullCoordinator: resuming %s on %s (%s/%s, %s%% done)",
+                            job.model_name, job.server, attempt, MAX_RESUMES, job.percent)
+                time.sleep(RESUME_BACKOFF_SECONDS * attempt)
+            try:
+                return self._stream(job)
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    logger.warning("PullCoordinator: HTTP %s pulling %s", e.code, job.model_name)
+                    return False
+                logger.warning("PullCoordinator: HTTP %s pulling %s, will resume", e.code, job.model_name)
+            except (OSError, http.client.HTTPException) as e:
+                logger.warning("PullCoordinator: connection lost pulling %s: %r", job.model_name, e)
+        return False
+
+    def _stream(self, job: PullJob) -> bool:
+        data = json.dumps({"name": job.model_name}).encode("utf-8")
+        logger.debug("PullCoordinator: POST %s/api/pull name=%s", job.server, job.model_name)
+        pbar = _console_bar(job.model_name)
+        try:
+            with urlopen(job.server, "/api/pull", data=data, timeout=READ_TIMEOUT) as resp:
+                for raw in resp:
+                    try:
+                        info = json.loads(raw.decode("utf-8"))
+                    except Exception:
+                        continue
+                    if info.get("error"):
+                        logger.warning("PullCoordinator: %s: %s", job.model_name, info['error'])
+                        return False
+                    job.update(info)
+                    if info.get("status") == "success":
+                        logger.info("PullCoordinator: %s on %s downloaded", job.model_name, job.server)
+                        model_catalog.invalidate(job.server)
+                        return True
+                    if pbar is not None:
+                        pbar.set_description(job.status)
+                        if job.percent > pbar.n:
+                            pbar.update(job.percent - pbar.n)
+            # Поток закончился без success — соединение оборвалось
+            raise ConnectionError("pull stream ended early")
+        finally:
+            if pbar is not None:
+                pbar.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": {f"{s}/{m}": self._jobs[(s, m)].percent for s, m in self._jobs},
+                "started": self.started,
+                "joined": self.joined,
+                "resumes": self.resumes,
+            }
+
+
+def _console_bar(model_name: str):
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        return None
+    return tqdm(total=100, unit="%", desc=model_name, bar_format="{l_bar}{bar}| {n_fmt}%")
+
+
+# Общий координатор для всех нод
+pull_coordinator = PullCoordinator()
@@ -0,0 +1,263 @@
+# model_residency.py
+
+"""Keeping the right models in VRAM on shared GPUs.
+
+``keep_in_memory`` used to mean either ``keep_alive: -1`` (pin forever) or
+``keep_alive: 0`` plus an explicit ``stop_model`` after every response
+(thrash on every call).  The residency manager replaces both:
+
+* every request asks Ollama to keep the model for ``IDLE_TIMEOUT`` seconds,
+  so idle models are evicted by the server itself;
+* with a VRAM budget set, loading a model that doesn't fit first unloads the
+  least recently used idle models on that server (resident models and their
+  ``size_vram`` come from ``/api/ps``, the size of the incoming model from
+  :mod:`model_catalog`);
+* ``keep_in_memory=False`` no longer unloads right away: the unload is
+  queued and done in one batch once no Ollama request has run for
+  ``UNLOAD_GRACE`` seconds (i.e. at the end of the graph), and cancelled if
+  the model is needed again;
+* :meth:`ResidencyManager.preload_first` warms up the first model a queued prompt needs
+  (called by :mod:`model_prefetch`).
+
+Settings come from the environment: ``OLLAMA_NODES_VRAM_BUDGET_GB`` (0 — no
+budget), ``OLLAMA_NODES_IDLE_TIMEOUT`` (seconds, -1 — forever) and
+``OLLAMA_NODES_UNLOAD_GRACE`` (seconds).
+"""
+
+import json
+import threading
+import time
+
+from .http_client import urlopen
+from .load_balancer import balancer, canonical_model_name, resolve_endpoints
+from .log_utils import _env_float, get_logger
+from .model_catalog import model_catalog
+from .utils import stop_model
+
+logger = get_logger("OllamaResidency")
+
+
+VRAM_BUDGET = int(_env_float("OLLAMA_NODES_VRAM_BUDGET_GB", 0) * 1024 ** 3)
+IDLE_TIMEOUT = int(_env_float("OLLAMA_NODES_IDLE_TIMEOUT", 1800))
+UNLOAD_GRACE = _env_float("OLLAMA_NODES_UNLOAD_GRACE", 5.0)
+# Как долго доверять ответу /api/ps
+PS_TTL = 5.0
+
+
+def fetch_ps(server: str, timeout: float = 5.0) -> list:
+    """Models currently loaded on ``server`` (``/api/ps``)."""
+    with urlopen(server, "/api/ps", timeout=timeout) as resp:
+        data = json.loads(resp.read().decode("utf-8"))
+    return data.get("models") or []
+
+
+def preload_model(server: str, model_name: str, keep_alive=None, timeout: float = None) -> bool:
+    """Load ``model_name`` into memory without generating anything."""
+    payload = {"model": model_name, "keep_alive": IDLE_TIMEOUT if keep_alive is None else keep_alive}
+    data = json.dumps(payload).encode("utf-8")
+    try:
+        with urlopen(server, "/api/generate", data=data, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except Exception as e:
+        logger.warning("preload_model: %s on %s failed: %s", model_name, server, e)
+        return False
+    if ok:
+        balancer.mark_loaded(server, model_name)
+    return ok
+
+
+class _Server:
+    def __init__(self):
+        self.resident = {}  # model -> size_vram
+        self.ps_at = 0.0
+        self.last_used = {}  # model -> monotonic time
+        self.in_use = {}  # model -> count
+        self.pending_unload = set()
+
+
+class ResidencyManager:
+    def __init__(self, vram_budget=VRAM_BUDGET, idle_timeout=IDLE_TIMEOUT, unload_grace=UNLOAD_GRACE):
+        self.vram_budget = vram_budget
+        self.idle_timeout = idle_timeout
+        self.unload_grace = unload_grace
+        self._servers = {}
+        self._lock = threading.RLock()
+        self._active = 0
+        self._timer = None
+        self.unloads = 0
+        self.preloads = 0
+
+    def _server(self, server: str) -> _Server:
+        state = self._servers.get(server)
+        if state is None:
+            state = self._servers[server] = _Server()
+        return state
+
+    def keep_alive(self):
+        """``keep_alive`` value to send with every request."""
+        return self.idle_timeout if self.idle_timeout >= 0 else -1
+
+    def refresh(self, server: str, force: bool = False) -> dict:
+        """Resident models on ``server`` with their VRAM size, from ``/api/ps``."""
+        with self._lock:
+            state = self._server(server)
+            if not force and time.monotonic() - state.ps_at < PS_TTL:
+                return dict(state.resident)
+        try:
+            models = fetch_ps(server)
+        except Exception as e:
+            logger.debug("ResidencyManager: /api/ps on %s failed: %s", server, e)
+            return dict(state.resident)
+        resident = {canonical_model_name(m.get("name") or m.get("model")): int(m.get("size_vram") or m.get("size") or 0) for m in models}
+        with self._lock:
+            state.resident = resident
+            state.ps_at = time.monotonic()
+        balancer.set_loaded(server, list(resident))
+        return dict(resident)
+
+    @staticmethod
+    def _model_size(server: str, model_name: str, resident: dict) -> int:
+        """Bytes ``model_name`` will take: its size in the catalog, else the largest resident model."""
+        name = canonical_model_name(model_name)
+        for m in model_catalog.installed(server) or []:
+            if m.name == name and m.size:
+                return m.size
+        # Размер новой модели неизвестен — берём крупнейшую из загруженных
+        return max(resident.values(), default=0)
+
+    def _make_room(self, server: str, model_name: str):
+        """Unload LRU idle models until ``model_name`` fits the VRAM budget."""
+        resident = self.refresh(server)
+        if canonical_model_name(model_name) in resident:
+            return
+        sizes = list(resident.values())
+        needed = self._model_size(server, model_name, resident)
+        with self._lock:
+            state = self._server(server)
+            victims = sorted(
+                (m for m in resident if not state.in_use.get(m)),
+                key=lambda m: state.last_used.get(m, 0.0),
+            )
+        used = sum(sizes)
+        for victim in victims:
+            if used + needed <= self.vram_budget:
+                break
+            logger.info("ResidencyManager: unloading %s on %s to stay in VRAM budget", victim, server)
+            if stop_model(server, victim):
+                self.unloads += 1
+                used -= resident[victim]
+                with self._lock:
+                    state.resident.pop(victim, None)
+
+    def acquire(self, server: str, model_name: str):
+        model_name = canonical_model_name(model_name)
+        with self._lock:
+            state = self._server(server)
+            state.in_use[model_name] = state.in_use.get(model_name, 0) + 1
+            state.pending_unload.discard(model_name)
+            self._active += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self.vram_budget > 0:
+            self._make_room(server, model_name)
+
+    def release(self, server: str, model_name: str, keep_in_memory: bool = True):
+        model_name = canonical_model_name(model_name)
+        with self._lock:
+            state = self._server(server)
+            state.in_use[model_name] = max(0, state.in_use.get(model_name, 0) - 1)
+            state.last_used[model_name] = time.monotonic()
+            if not keep_in_memory:
+                state.pending_unload.add(model_name)
+            self._active = max(0, self._active - 1)
+            if self._active == 0 and any(s.pending_unload for s in self._servers.values()):
+                self._timer = threading.Timer(self.unload_grace, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def use(self, server: str, model_name: str, keep_in_memory: bool = True):
+        """Context manager wrapping one request to ``model_name`` on ``server``."""
+        return _Use(self, server, model_name, keep_in_memory)
+
+    def flush(self):
+        """Unload every model queued for unloading that isn't in use."""
+        with self._lock:
+            self._timer = None
+            if self._active:
+                return
+            batch = []
+            for server, state in self._servers.items():
+                for model_name in list(state.pending_unload):
+                    if not state.in_use.get(model_name):
+                        batch.append((server, model_name))
+                state.pending_unload.clear()
+        for server, model_name in batch:
+            result = stop_model(server, model_name)
+            logger.info("ResidencyManager: unloaded %s on %s: %s", model_name, server, result)
+            if result:
+                self.unloads += 1
+                with self._lock:
+                    self._server(server).resident.pop(model_name, None)
+
+    def expect(self, ip_port: str, model_name: str):
+        """Note that ``model_name`` will be needed soon: keep it resident."""
+        try:
+            servers = resolve_endpoints(ip_port)
+        except ValueError:
+            return
+        with self._lock:
+            for server in servers:
+                self._server(server).pending_unload.discard(canonical_model_name(model_name))
+
+    def preload_first(self, used):
+        """Preload the first of ``[(ip_port, model_name)]`` that isn't resident."""
+        for ip_port, model_name in used:
+            try:
+                endpoints = resolve_endpoints(ip_port)
+            except ValueError:
+                continue
+            server = balancer.preferred(endpoints, model_name)
+            if canonical_model_name(model_name) in self.refresh(server):
+                continue
+            logger.info("ResidencyManager: preloading %s on %s", model_name, server)
+            self._preload(server, model_name)
+            break
+
+    def _preload(self, server: str, model_name: str):
+        if self.vram_budget > 0:
+            self._make_room(server, model_name)
+        if preload_model(server, model_name, self.keep_alive()):
+            self.preloads += 1
+            with self._lock:
+                self._server(server).last_used[canonical_model_name(model_name)] = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "unloads": self.unloads,
+                "preloads": self.preloads,
+                "pending_unload": {s: sorted(st.pending_unload) for s, st in self._servers.items() if st.pending_unload},
+                "resident": {s: dict(st.resident) for s, st in self._servers.items()},
+            }
+
+
+class _Use:
+    def __init__(self, manager: ResidencyManager, server: str, model_name: str, keep_in_memory: bool):
+        self.manager = manager
+        self.server = server
+        self.model_name = model_name
+        self.keep_in_memory = keep_in_memory
+
+    def __enter__(self):
+        self.manager.acquire(self.server, self.model_name)
+        return self
+
+    def __exit__(self, *exc):
+        self.manager.release(self.server, self.model_name, self.keep_in_memory)
+        return False
+
+
+# Общий менеджер для всех нод
+residency = ResidencyManager()
@@ -1,14 +1,13 @@
 # ollama_node_base.py
 
-import urllib.request
-import json
-import logging
-
-from .utils import pull_model, stop_model
+from .async_engine import run_blocking
+from .chat_backend import BACKENDS
+from .log_utils import get_logger
+from .request_core import ChatRequest, execute
+from .response_cache import CACHE_MODES
 
 # Настраиваем логгер для этой ноды
-logger = logging.getLogger("OllamaNodeBase")
-logger.setLevel(logging.DEBUG)
+logger = get_logger("OllamaNodeBase")
 
 class OllamaNodeBase:
     @classmethod
@@ -20,67 +19,34 @@ class OllamaNodeBase:
                 "system_prompt": ("STRING", {"multiline": True}),
                 "user_prompt":   ("STRING", {"multiline": True}),
                 "keep_in_memory": ("BOOLEAN", {"default": True, "forceInput": False}),
+            },
+            "optional": {
+                "stream":        ("BOOLEAN", {"default": False}),
+                "stop_sequence": ("STRING", {"multiline": True, "default": ""}),
+                "token_budget":  ("INT", {"default": 0, "min": 0}),
+                "cache_mode":    (CACHE_MODES, {"default": "off"}),
+                "backend":       (BACKENDS, {"default": "openai"}),
+                "ollama_options": ("STRING", {"multiline": True, "default": ""}),  # JSON: {"num_ctx": 8192}
             }
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("response", "timings")
     FUNCTION     = "call_ollama"
     CATEGORY     = "OllamaComfy"
 
-    def call_ollama(self, ip_port, model_name, system_prompt, user_prompt, keep_in_memory=True):
-        url = f"http://{ip_port}/v1/chat/completions"
-        headers = {
-            "Content-Type":  "application/json",
-        }
-        payload = {
-            "model":    model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user",   "content": user_prompt}
-            ],
-            "keep_alive": -1 if keep_in_memory else 0
-        }
-        data = json.dumps(payload).encode("utf-8")
-
-        pulled = False
-        for attempt in range(1, 4):
-            logger.info(f"OllamaNodeBase: Attempt {attempt}/3")
-            logger.debug(f"OllamaNodeBase: POST {url} (payload {len(data)} bytes)")
-
-            req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    status = getattr(resp, "status", resp.getcode())
-                    logger.info(f"OllamaNodeBase: HTTP {status}")
-
-                    raw = resp.read().decode("utf-8")
-                    logger.debug(f"OllamaNodeBase: Raw response: {raw}")
-
-                    resp_json = json.loads(raw)
-                    content = resp_json["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaNodeBase: Got content length={len(content)}")
-                    if not keep_in_memory:
-                        result = stop_model(ip_port, model_name)
-                        logger.info(f"OllamaNodeBase: stop_model result={result}")
-                    return (content,)
-
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaNodeBase: {err} on attempt {attempt}")
-                if e.code == 404 and not pulled:
-                    logger.info("OllamaNodeBase: model not found, pulling...")
-                    pulled = pull_model(ip_port, model_name)
-                    continue
-                if attempt == 3:
-                    return (f"Error: {err}",)
-
-            except Exception as e:
-                logger.warning(f"OllamaNodeBase: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
-
-        return ("Error: exhausted retries",)
+    async def call_ollama(self, ip_port, **kwargs):
+        return await run_blocking(ip_port, self._call_ollama, ip_port, **kwargs)
+
+    def _call_ollama(self, ip_port, model_name, system_prompt, user_prompt, keep_in_memory=True,
+                     stream=False, stop_sequence="", token_budget=0, cache_mode="off", backend="openai",
+                     ollama_options=""):
+        result = execute(ChatRequest(
+            type(self).__name__, ip_port, model_name, system_prompt, user_prompt,
+            keep_in_memory=keep_in_memory, stream=stream, stop_sequence=stop_sequence, token_budget=token_budget,
+            cache_mode=cache_mode, backend=backend, ollama_options=ollama_options,
+        ))
+        return result.outputs()
 
 # Регистрация ноды
 NODE_CLASS_MAPPINGS = {
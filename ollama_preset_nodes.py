@@ -1,5 +1,8 @@
-import os
-from .utils import get_presets_dir
+from .image_encoding import DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+from .preset_format import KEEP_ALIVE_POLICIES, Preset, dump_preset
+from .preset_store import preset_store
+
+PRESET_FORMATS = ["txt", "json"]
 
 
 class OllamaSavePresetNode:
@@ -23,15 +26,38 @@ class OllamaSavePresetNode:
                 "prompt": ("STRING", {"multiline": True, "lines": 5, "default": ""}),
                 "name": ("STRING", {"default": ""}),
                 "save_preset": ("BOOLEAN", {"default": False, "forceInput": False}),
-            }
+            },
+            # Настройки ниже сохраняются только в формате json
+            "optional": {
+                "format": (PRESET_FORMATS, {"default": "txt"}),
+                "model_name": ("STRING", {"default": ""}),
+                "max_tokens": ("INT", {"default": 0, "min": 0}),
+                "temperature": ("FLOAT", {"default": -1.0, "min": -1.0, "max": 2.0, "step": 0.05}),
+                "seed": ("INT", {"default": -1, "min": -1, "max": 2 ** 31 - 1}),
+                "num_ctx": ("INT", {"default": 0, "min": 0}),
+                "image_max_side": ("INT", {"default": DEFAULT_MAX_SIDE, "min": 64, "max": 4096}),
+                "jpeg_quality": ("INT", {"default": DEFAULT_QUALITY, "min": 1, "max": 100}),
+                "keep_alive": (KEEP_ALIVE_POLICIES, {"default": "default"}),
+            },
         }
 
-    def process(self, prompt: str, name: str, save_preset: bool):
+    def process(self, prompt: str, name: str, save_preset: bool, format="txt", model_name="", max_tokens=0,
+                temperature=-1.0, seed=-1, num_ctx=0, image_max_side=DEFAULT_MAX_SIDE,
+                jpeg_quality=DEFAULT_QUALITY, keep_alive="default"):
         if save_preset and name.strip():
             try:
-                path = os.path.join(get_presets_dir(), f"{name}.txt")
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(prompt)
+                if format == "json":
+                    options = {}
+                    if temperature >= 0:
+                        options["temperature"] = temperature
+                    if seed >= 0:
+                        options["seed"] = seed
+                    preset = Preset(system_prompt=prompt, model=model_name.strip(), max_tokens=max_tokens,
+                                    options=options, num_ctx=num_ctx, image_max_side=image_max_side,
+                                    image_quality=jpeg_quality, keep_alive=keep_alive)
+                    preset_store.save(f"{name}.json", dump_preset(preset))
+                else:
+                    preset_store.save(f"{name}.txt", prompt)
             except Exception as e:
                 print(f"[OllamaSavePresetNode] error saving preset: {e}")
         return (prompt,)
@@ -50,21 +76,10 @@ class OllamaLoadPresetNode:
 
     @classmethod
     def INPUT_TYPES(cls):
-        preset_dir = get_presets_dir()
-        files = sorted(
-            f for f in os.listdir(preset_dir) if f.lower().endswith(".txt")
-        ) or ["< no .txt files >"]
+        files = preset_store.names() or ["< no presets >"]
         return {"required": {"file_name": (files,)}}
 
     def load(self, file_name: str):
-        preset_dir = get_presets_dir()
-        path = os.path.join(preset_dir, file_name)
-        text = ""
-        if os.path.isfile(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except Exception as e:
-                print(f"[OllamaLoadPresetNode] Can't read {path}: {e}")
+        text = preset_store.get_preset(file_name).system_prompt
         overlay = {"text": text, "image": None}
         return (text, overlay)
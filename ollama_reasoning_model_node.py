@@ -1,5 +1,4 @@
-import json
-import os
+from .model_catalog import model_catalog
 
 
 class OllamaReasoningModelNode:
@@ -14,15 +13,7 @@ class OllamaReasoningModelNode:
 
     @classmethod
     def INPUT_TYPES(cls):
-        path = os.path.join(os.path.dirname(__file__), "reasoning_model_list.json")
-        models = ["< no models >"]
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, list) and data:
-                models = data
-        except Exception as e:
-            print(f"[OllamaReasoningModelNode] Can't read {path}: {e}")
+        models = model_catalog.choices("reasoning_model_list.json", capability="thinking")
         return {"required": {"model_name": (models,)}}
 
     def select(self, model_name: str):
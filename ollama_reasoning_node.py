@@ -1,13 +1,13 @@
-import json
-import urllib.request
-import urllib.error
-import logging
-import re
+from .async_engine import run_blocking
+from .chat_backend import BACKENDS
+from .log_utils import get_logger
+from .request_core import ChatRequest, execute
+from .response_cache import CACHE_MODES
 
-from .utils import pull_model, stop_model
+# "answer" — закрыть размышления и попросить ответ, "stop" — вернуть то, что есть
+THINKING_BUDGET_MODES = ["answer", "stop"]
 
-logger = logging.getLogger("OllamaReasoningNode")
-logger.setLevel(logging.DEBUG)
+logger = get_logger("OllamaReasoningNode")
 
 
 class OllamaReasoningNode:
@@ -20,64 +20,41 @@ class OllamaReasoningNode:
                 "system_prompt": ("STRING", {"multiline": True}),
                 "user_prompt": ("STRING", {"multiline": True}),
                 "keep_in_memory": ("BOOLEAN", {"default": True, "forceInput": False}),
+            },
+            "optional": {
+                "stream":        ("BOOLEAN", {"default": False}),
+                "stop_sequence": ("STRING", {"multiline": True, "default": ""}),
+                "token_budget":  ("INT", {"default": 0, "min": 0}),
+                "cache_mode":    (CACHE_MODES, {"default": "off"}),
+                "backend":       (BACKENDS, {"default": "openai"}),
+                "ollama_options": ("STRING", {"multiline": True, "default": ""}),  # JSON: {"num_ctx": 8192}
+                # 0 — без ограничения; с лимитом ответ всегда читается потоком
+                "thinking_budget": ("INT", {"default": 0, "min": 0}),
+                "on_thinking_budget": (THINKING_BUDGET_MODES, {"default": "answer"}),
+                "discard_thoughts": ("BOOLEAN", {"default": False}),
             }
         }
 
-    RETURN_TYPES = ("STRING", "STRING")
-    RETURN_NAMES = ("thoughts", "response")
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("thoughts", "response", "timings")
     FUNCTION = "run"
     CATEGORY = "OllamaComfy"
 
-    def _parse_answer(self, text: str):
-        # Собираем все блоки <think>…</think>
-        thoughts_list = re.findall(r"(?is)<think>(.*?)</think>", text)
-        thoughts = "\n\n".join(t.strip() for t in thoughts_list) if thoughts_list else ""
-        # Убираем их из основного текста
-        response = re.sub(r"(?is)<think>.*?</think>", "", text).strip()
-        return thoughts, response
-
-    def run(self, ip_port, model_name, system_prompt, user_prompt, keep_in_memory=True):
-        url = f"http://{ip_port}/v1/chat/completions"
-        headers = {"Content-Type": "application/json"}
-        payload = {
-            "model": model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            "keep_alive": -1 if keep_in_memory else 0,
-        }
-        data = json.dumps(payload).encode("utf-8")
-
-        pulled = False
-        for attempt in range(1, 4):
-            logger.info(f"OllamaReasoningNode: Attempt {attempt}/3")
-            req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    raw = resp.read().decode("utf-8")
-                    logger.debug(f"OllamaReasoningNode: Raw response: {raw}")
-                    j = json.loads(raw)
-                    text = j["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaReasoningNode: Got content length={len(text)}")
-                    if not keep_in_memory:
-                        result = stop_model(ip_port, model_name)
-                        logger.info(f"OllamaReasoningNode: stop_model result={result}")
-                    return self._parse_answer(text)
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaReasoningNode: {err} on attempt {attempt}")
-                if e.code == 404 and not pulled:
-                    logger.info("OllamaReasoningNode: model not found, pulling...")
-                    pulled = pull_model(ip_port, model_name)
-                    continue
-                if attempt == 3:
-                    return ("", f"Error: {err}")
-            except Exception as e:
-                logger.warning(f"OllamaReasoningNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return ("", f"Error: {e}")
-        return ("", "Error: exhausted retries")
+    async def run(self, ip_port, **kwargs):
+        return await run_blocking(ip_port, self._run, ip_port, **kwargs)
+
+    def _run(self, ip_port, model_name, system_prompt, user_prompt, keep_in_memory=True,
+             stream=False, stop_sequence="", token_budget=0, cache_mode="off", backend="openai", ollama_options="",
+             thinking_budget=0, on_thinking_budget="answer", discard_thoughts=False):
+        result = execute(ChatRequest(
+            type(self).__name__, ip_port, model_name, system_prompt, user_prompt,
+            keep_in_memory=keep_in_memory, stream=stream, stop_sequence=stop_sequence, token_budget=token_budget,
+            cache_mode=cache_mode, backend=backend, ollama_options=ollama_options, think=True,
+            thinking_budget=thinking_budget, on_thinking_budget=on_thinking_budget, discard_thoughts=discard_thoughts,
+        ))
+        if not result.ok:
+            return ("", result.response, "")
+        return (result.thoughts, result.text, result.timings)
 
 
 NODE_CLASS_MAPPINGS = {
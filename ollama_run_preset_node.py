@@ -1,48 +1,23 @@
-import os
-import json
-import urllib.request
-import urllib.error
-import io
-import base64
-import logging
-from PIL import Image
-import numpy as np
+from .async_engine import run_blocking
+from .chat_backend import BACKENDS
+from .log_utils import get_logger
+from .model_catalog import model_catalog
+from .model_residency import residency
+from .preset_store import preset_store
+from .request_core import ChatRequest, execute
+from .response_cache import CACHE_MODES
 
-from .utils import get_presets_dir, pull_model, stop_model
+logger = get_logger("OllamaRunPresetNode")
 
-logger = logging.getLogger("OllamaRunPresetNode")
-logger.setLevel(logging.DEBUG)
-
-
-def _to_pil(img):
-    if isinstance(img, Image.Image):
-        return img
-    if hasattr(img, "cpu"):
-        arr = img.cpu().detach().numpy()
-    else:
-        arr = np.array(img)
-    arr = np.squeeze(arr)
-    if np.issubdtype(arr.dtype, np.floating):
-        arr = (arr * 255).clip(0, 255).astype(np.uint8)
-    if arr.ndim == 3 and arr.shape[0] in (1, 3, 4):
-        arr = np.transpose(arr, (1, 2, 0))
-    if arr.ndim == 3:
-        ch = arr.shape[2]
-        mode = {1: "L", 3: "RGB", 4: "RGBA"}.get(ch)
-        if not mode:
-            raise TypeError(f"Unsupported channels: {ch}")
-    elif arr.ndim == 2:
-        mode = "L"
-    else:
-        raise TypeError(f"Cannot handle shape: {arr.shape}")
-    return Image.fromarray(arr, mode)
+# Пункт списка моделей: взять модель из json-пресета
+PRESET_MODEL = "< preset model >"
 
 
 class OllamaRunPresetNode:
     CATEGORY = "OllamaComfy"
     NODE_TITLE = "Ollama Run Preset"
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("response", "timings")
     FUNCTION = "run"
 
     WRITEABLE = ["ip_port", "preset_name", "model_name", "user_prompt"]
@@ -56,20 +31,9 @@ class OllamaRunPresetNode:
 
     @classmethod
     def INPUT_TYPES(cls):
-        preset_dir = get_presets_dir()
-        presets = sorted(
-            f for f in os.listdir(preset_dir) if f.lower().endswith(".txt")
-        ) or ["< no .txt files >"]
+        presets = preset_store.names() or ["< no presets >"]
 
-        model_path = os.path.join(os.path.dirname(__file__), "list_models.json")
-        models = ["< no models >"]
-        try:
-            with open(model_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, list) and data:
-                models = data
-        except Exception as e:
-            print(f"[OllamaRunPresetNode] Can't read {model_path}: {e}")
+        models = model_catalog.choices("list_models.json") + [PRESET_MODEL]
 
         return {
             "required": {
@@ -81,80 +45,35 @@ class OllamaRunPresetNode:
             },
             "optional": {
                 "img": ("IMAGE", {}),
+                "image_tokens": ("INT", {"default": 0, "min": 0}),  # 0 — по умолчанию для модели
+                "stream": ("BOOLEAN", {"default": False}),
+                "stop_sequence": ("STRING", {"multiline": True, "default": ""}),
+                "token_budget": ("INT", {"default": 0, "min": 0}),
+                "cache_mode": (CACHE_MODES, {"default": "off"}),
+                "backend": (BACKENDS, {"default": "openai"}),
+                "ollama_options": ("STRING", {"multiline": True, "default": ""}),
             },
         }
 
-    def run(self, ip_port: str, preset_name: str, model_name: str, user_prompt: str, keep_in_memory=True, img=None):
-        preset_dir = get_presets_dir()
-        path = os.path.join(preset_dir, preset_name)
-        system_prompt = ""
-        if os.path.isfile(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    system_prompt = f.read()
-            except Exception as e:
-                print(f"[OllamaRunPresetNode] Can't read {path}: {e}")
-
-        url = f"http://{ip_port}/v1/chat/completions"
-        headers = {"Content-Type": "application/json"}
-
-        if img is not None:
-            try:
-                pil = _to_pil(img)
-            except Exception as e:
-                logger.error("Conversion to PIL failed", exc_info=True)
-                return (f"Error converting image: {e}",)
-            pil.thumbnail((512, 512))
-            buf = io.BytesIO()
-            pil.save(buf, format="JPEG", quality=75)
-            data_url = "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
-            messages = [
-                {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_prompt},
-                        {"type": "image_url", "image_url": {"url": data_url}},
-                    ],
-                },
-            ]
-            payload = {"model": model_name, "messages": messages, "max_tokens": 1024, "keep_alive": -1 if keep_in_memory else 0}
-        else:
-            payload = {
-                "model": model_name,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                "keep_alive": -1 if keep_in_memory else 0,
-            }
+    async def run(self, ip_port, **kwargs):
+        return await run_blocking(ip_port, self._run, ip_port, **kwargs)
 
-        body = json.dumps(payload).encode("utf-8")
+    def _run(self, ip_port: str, preset_name: str, model_name: str, user_prompt: str, keep_in_memory=True, img=None,
+             image_tokens=0, stream=False, stop_sequence="", token_budget=0, cache_mode="off", backend="openai", ollama_options=""):
+        preset = preset_store.get_preset(preset_name)
+        if model_name == PRESET_MODEL or model_name.startswith("< no"):
+            if not preset.model:
+                return (f"Error: preset '{preset_name}' doesn't name a model", "")
+            model_name = preset.model
 
-        pulled = False
-        for attempt in range(1, 4):
-            logger.info(f"OllamaRunPresetNode: Attempt {attempt}/3")
-            req = urllib.request.Request(url, data=body, headers=headers, method="POST")
-            try:
-                with urllib.request.urlopen(req) as resp:
-                    data = json.loads(resp.read().decode("utf-8"))
-                    text = data["choices"][0]["message"]["content"]
-                    logger.info(f"OllamaRunPresetNode: Got content length={len(text)}")
-                    if not keep_in_memory:
-                        result = stop_model(ip_port, model_name)
-                        logger.info(f"OllamaRunPresetNode: stop_model result={result}")
-                    return (text,)
-            except urllib.error.HTTPError as e:
-                err = f"HTTPError {e.code}: {e.reason}"
-                logger.warning(f"OllamaRunPresetNode: {err} on attempt {attempt}")
-                if e.code == 404 and not pulled:
-                    logger.info("OllamaRunPresetNode: model not found, pulling...")
-                    pulled = pull_model(ip_port, model_name)
-                    continue
-                if attempt == 3:
-                    return (f"Error: {err}",)
-            except Exception as e:
-                logger.warning(f"OllamaRunPresetNode: Exception on attempt {attempt}: {e}", exc_info=True)
-                if attempt == 3:
-                    return (f"Error: {e}",)
-        return ("Error: exhausted retries",)
+        result = execute(ChatRequest(
+            type(self).__name__, ip_port, model_name, preset.system_prompt, user_prompt,
+            [img] if img is not None else [],
+            keep_in_memory=preset.keep_in_memory(keep_in_memory),
+            max_tokens=1024 if img is not None else 0,
+            stream=stream, stop_sequence=stop_sequence, token_budget=token_budget, cache_mode=cache_mode,
+            backend=backend, ollama_options=ollama_options,
+            keep_alive=preset.keep_alive_value(residency.keep_alive()), preset=preset,
+            image_max_side=preset.image_max_side, image_quality=preset.image_quality, image_tokens=image_tokens,
+        ))
+        return result.outputs()
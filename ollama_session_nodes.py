@@ -0,0 +1,79 @@
+# ollama_session_nodes.py
+
+from .async_engine import run_blocking
+from .chat_session import ChatSession
+from .log_utils import get_logger
+from .request_core import ChatRequest, execute
+from .response_cache import CACHE_MODES
+
+logger = get_logger("OllamaSessionNodes")
+
+SESSION_TYPE = "OLLAMA_SESSION"
+
+
+class OllamaSessionNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "ip_port":       ("STRING", {"default": "localhost:11434"}),
+                "model_name":    ("STRING", {"multiline": False}),
+                "system_prompt": ("STRING", {"multiline": True}),
+            },
+        }
+
+    RETURN_TYPES = (SESSION_TYPE,)
+    RETURN_NAMES = ("session",)
+    FUNCTION = "start"
+    CATEGORY = "OllamaComfy"
+
+    def start(self, ip_port, model_name, system_prompt):
+        session = ChatSession(ip_port, model_name, system_prompt)
+        logger.info("Started %r on %s", session, ip_port)
+        return (session,)
+
+
+class OllamaSessionChatNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "session":       (SESSION_TYPE, {}),
+                "user_prompt":   ("STRING", {"multiline": True}),
+                "keep_in_memory": ("BOOLEAN", {"default": True, "forceInput": False}),
+            },
+            "optional": {
+                "img":           ("IMAGE", {}),
+                "max_tokens":    ("INT", {"default": 0, "min": 0}),
+                "stream":        ("BOOLEAN", {"default": False}),
+                "stop_sequence": ("STRING", {"multiline": True, "default": ""}),
+                "cache_mode":    (CACHE_MODES, {"default": "off"}),
+                "ollama_options": ("STRING", {"multiline": True, "default": ""}),  # JSON: {"num_ctx": 8192}
+            }
+        }
+
+    RETURN_TYPES = (SESSION_TYPE, "STRING", "STRING")
+    RETURN_NAMES = ("session", "response", "timings")
+    FUNCTION = "chat"
+    CATEGORY = "OllamaComfy"
+
+    async def chat(self, session, **kwargs):
+        return await run_blocking(session.ip_port, self._chat, session, **kwargs)
+
+    def _chat(self, session, user_prompt, keep_in_memory=True, img=None, max_tokens=0, stream=False,
+              stop_sequence="", cache_mode="off", ollama_options=""):
+        # Сессии работают через нативный API: только он возвращает context
+        result = execute(ChatRequest(
+            type(self).__name__, session.ip_port, session.model_name, session.system_prompt, user_prompt,
+            [img] if img is not None else [],
+            keep_in_memory=keep_in_memory, max_tokens=max_tokens, stream=stream, stop_sequence=stop_sequence,
+            cache_mode=cache_mode, backend="native", ollama_options=ollama_options, session=session,
+        ))
+        # Ошибочный ход в историю не попадает
+        return (result.session or session,) + result.outputs()
+
+
+NODE_CLASS_MAPPINGS = {
+    "OllamaSessionNode": OllamaSessionNode,
+    "OllamaSessionChatNode": OllamaSessionChatNode,
+}
@@ -0,0 +1,113 @@
+# ollama_structured_nodes.py
+
+import json
+
+from .async_engine import run_blocking
+from .chat_backend import BACKENDS
+from .log_utils import get_logger
+from .request_core import ChatRequest, execute
+from .response_cache import CACHE_MODES
+from .structured_output import parse_schema
+
+logger = get_logger("OllamaStructuredNodes")
+
+
+class OllamaStructuredNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "ip_port":       ("STRING", {"default": "localhost:11434"}),
+                "model_name":    ("STRING", {"multiline": False}),
+                "system_prompt": ("STRING", {"multiline": True}),
+                "user_prompt":   ("STRING", {"multiline": True}),
+                # JSON Schema ответа; пусто — любой JSON
+                "json_schema":   ("STRING", {"multiline": True, "default": ""}),
+                "keep_in_memory": ("BOOLEAN", {"default": True, "forceInput": False}),
+            },
+            "optional": {
+                "img":           ("IMAGE", {}),
+                "max_tokens":    ("INT", {"default": 0, "min": 0}),
+                "image_tokens":  ("INT", {"default": 0, "min": 0}),
+                "cache_mode":    (CACHE_MODES, {"default": "off"}),
+                "backend":       (BACKENDS, {"default": "native"}),
+                "ollama_options": ("STRING", {"multiline": True, "default": ""}),  # JSON: {"num_ctx": 8192}
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("json", "timings")
+    FUNCTION = "call_ollama"
+    CATEGORY = "OllamaComfy"
+
+    async def call_ollama(self, ip_port, **kwargs):
+        return await run_blocking(ip_port, self._call_ollama, ip_port, **kwargs)
+
+    def _call_ollama(self, ip_port, model_name, system_prompt, user_prompt, json_schema="", keep_in_memory=True,
+                     img=None, max_tokens=0, image_tokens=0, cache_mode="off", backend="native", ollama_options=""):
+        try:
+            schema = parse_schema(json_schema)
+        except ValueError as e:
+            return (f"Error: bad json_schema: {e}", "")
+        result = execute(ChatRequest(
+            type(self).__name__, ip_port, model_name, system_prompt, user_prompt,
+            [img] if img is not None else [],
+            keep_in_memory=keep_in_memory, max_tokens=max_tokens, cache_mode=cache_mode, backend=backend,
+            ollama_options=ollama_options, image_tokens=image_tokens, json_schema=schema,
+        ))
+        return result.outputs()
+
+
+def _lookup(data, path: str):
+    """Value at a dotted ``path`` (``items.0.name``) in parsed JSON."""
+    for part in filter(None, path.split(".")):
+        if isinstance(data, list):
+            data = data[int(part)]
+        elif isinstance(data, dict):
+            data = data[part]
+        else:
+            raise KeyError(part)
+    return data
+
+
+def _number(value, kind):
+    try:
+        return kind(value if isinstance(value, (bool, int, float)) else float(value))
+    except (TypeError, ValueError, OverflowError):
+        return kind(0)
+
+
+class OllamaJsonFieldNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "json_text": ("STRING", {"forceInput": True}),
+                "path": ("STRING", {"default": ""}),  # "items.0.name"; пусто — весь ответ
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "INT", "FLOAT", "BOOLEAN")
+    RETURN_NAMES = ("text", "int", "float", "boolean")
+    FUNCTION = "extract"
+    CATEGORY = "OllamaComfy"
+
+    def extract(self, json_text, path=""):
+        if json_text.startswith("Error:"):
+            # Ошибка ноды выше по графу — передаём как есть
+            return (json_text, 0, 0.0, False)
+        try:
+            value = _lookup(json.loads(json_text), path)
+        except (ValueError, KeyError, IndexError) as e:
+            logger.warning("OllamaJsonFieldNode: %s: %s", path or "$", e)
+            return (f"Error: {path or '$'}: {e!r}", 0, 0.0, False)
+        # Строки — как есть, остальное — JSON-текстом
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        truthy = value.strip().lower() in ("true", "yes", "1") if isinstance(value, str) else bool(value)
+        return (text, _number(value, int), _number(value, float), truthy)
+
+
+NODE_CLASS_MAPPINGS = {
+    "OllamaStructuredNode": OllamaStructuredNode,
+    "OllamaJsonFieldNode": OllamaJsonFieldNode,
+}
@@ -0,0 +1,115 @@
+# ollama_vision_batch_node.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .async_engine import default_parallel, run_blocking, server_slots
+from .chat_backend import BACKENDS
+from .image_encoding import encode_images
+from .image_planner import geometry_for
+from .log_utils import get_logger
+from .ollama_vision_node_base import OllamaVisionNodeBase
+from .response_cache import CACHE_MODES
+
+try:
+    import comfy.utils
+    import comfy.model_management
+except ImportError:  # запуск вне ComfyUI
+    comfy = None
+
+logger = get_logger("OllamaVisionBatchNode")
+
+
+class OllamaVisionBatchNode(OllamaVisionNodeBase):
+    """Caption every frame of an IMAGE batch, several requests at a time.
+
+    Frames are encoded together, then every frame is sent as its own request
+    through the server's concurrency slots (see :mod:`async_engine`), at most
+    ``max_in_flight`` at a time and never more than the server allows;
+    captions come back as a list in input order.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "ip_port":       ("STRING", {"default": "localhost:11434"}),
+                "model_name":    ("STRING", {"multiline": False}),
+                "system_prompt": ("STRING", {"multiline": True}),
+                "user_prompt":   ("STRING", {"multiline": True}),
+                "images":        ("IMAGE", {}),
+                "keep_in_memory": ("BOOLEAN", {"default": True, "forceInput": False}),
+            },
+            "optional": {
+                "max_tokens":    ("INT", {"default": 1024}),
+                "image_tokens":  ("INT", {"default": 0, "min": 0}),  # на кадр; 0 — по умолчанию для модели
+                # 0 — взять OLLAMA_NUM_PARALLEL; больше слотов сервера не бывает
+                "max_in_flight": ("INT", {"default": 0, "min": 0, "max": 64}),
+                "cache_mode":    (CACHE_MODES, {"default": "off"}),
+                "backend":       (BACKENDS, {"default": "openai"}),
+                "ollama_options": ("STRING", {"multiline": True, "default": ""}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("responses", "timings")
+    OUTPUT_IS_LIST = (True, True)
+    FUNCTION     = "caption_batch"
+    CATEGORY     = "OllamaComfy"
+
+    async def caption_batch(self, ip_port, model_name, system_prompt, user_prompt, images, keep_in_memory=True,
+                            max_tokens=1024, image_tokens=0, max_in_flight=0, cache_mode="off", backend="openai",
+                            ollama_options=""):
+        # Кодирование кадров — без слота сервера, запросы — каждый через семафор сервера
+        encoded = await run_blocking(None, self._encode_frames, ip_port, images, model_name, image_tokens)
+        if isinstance(encoded, str):
+            return ([encoded], [""])
+
+        frames = len(encoded)
+        slots = server_slots(ip_port)
+        if max_in_flight > slots:
+            logger.warning("OllamaVisionBatchNode: max_in_flight %s exceeds the %s slots of %s, using %s",
+                           max_in_flight, slots, ip_port, slots)
+        workers = min(max_in_flight or slots, slots, frames) or 1
+        logger.info("OllamaVisionBatchNode: %s frames, %s in flight", frames, workers)
+
+        pbar = comfy.utils.ProgressBar(frames) if comfy is not None else None
+        gate = asyncio.Semaphore(workers)
+
+        async def caption(frame):
+            async with gate:
+                result = await run_blocking(ip_port, self._caption_frame, ip_port, model_name, system_prompt,
+                                            user_prompt, frame, keep_in_memory=keep_in_memory,
+                                            max_tokens=max_tokens, cache_mode=cache_mode, backend=backend,
+                                            ollama_options=ollama_options)
+            if pbar is not None:
+                pbar.update(1)
+            return result
+
+        results = await asyncio.gather(*(caption(frame) for frame in encoded))
+        return ([text for text, _ in results], [timings for _, timings in results])
+
+    def _encode_frames(self, ip_port, images, model_name, image_tokens):
+        """Encoded frames of the batch, or an ``"Error: ..."`` string."""
+        frames = images.shape[0] if len(images.shape) == 4 else 1
+        try:
+            # Уменьшение и квантование — одной векторной операцией на весь батч,
+            # JPEG-кодирование кадров — в пуле потоков
+            with ThreadPoolExecutor(max_workers=min(frames, default_parallel()) or 1,
+                                    thread_name_prefix="ollama-encode") as pool:
+                return encode_images(images, executor=pool, geometry=geometry_for(model_name),
+                                     token_budget=image_tokens,
+                                     labels=metrics.request_labels(type(self).__name__, model_name, ip_port))
+        except Exception as e:
+            logger.error("Image encoding failed", exc_info=True)
+            return f"Error converting image: {e}"
+
+    def _caption_frame(self, ip_port, model_name, system_prompt, user_prompt, frame, **kwargs):
+        if comfy is not None and comfy.model_management.processing_interrupted():
+            return "Error: interrupted", ""
+        return self._call_with_images(ip_port, model_name, system_prompt, user_prompt, [frame], **kwargs)
+
+NODE_CLASS_MAPPINGS = {
+    "OllamaVisionBatchNode": OllamaVisionBatchNode
+}
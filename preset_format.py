@@ -0,0 +1,138 @@
+# preset_format.py
+
+"""Structured presets.
+
+A legacy ``.txt`` preset is just a system prompt.  A ``.json`` preset may
+also carry everything else a workload is tuned by::
+
+    {
+      "system_prompt": "You are a translator...",
+      "model": "gemma3:4b",
+      "max_tokens": 256,
+      "options": {"temperature": 0.2, "top_p": 0.9, "seed": 42},
+      "num_ctx": 4096,
+      "image": {"max_side": 384, "quality": 70},
+      "keep_alive": "unload"
+    }
+
+Every key except ``system_prompt`` is optional; a missing key means "use
+the node's setting".  ``keep_alive`` is ``"default"`` (the residency
+manager decides), ``"pin"`` (keep loaded), ``"unload"`` (unload after the
+graph) or a number of seconds.
+"""
+
+import json
+
+from .image_encoding import DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+from .log_utils import get_logger
+
+logger = get_logger("OllamaPresetFormat")
+
+KEEP_ALIVE_POLICIES = ["default", "pin", "unload"]
+# Параметры, которые OpenAI-совместимый эндпоинт Ollama принимает на верхнем уровне
+OPENAI_OPTIONS = ("temperature", "top_p", "seed", "frequency_penalty", "presence_penalty")
+
+
+class Preset:
+    def __init__(self, system_prompt: str = "", model=None, max_tokens=None, options=None, num_ctx=None,
+                 image_max_side=None, image_quality=None, keep_alive=None):
+        self.system_prompt = system_prompt
+        self.model = model or None
+        self.max_tokens = max_tokens or None
+        self.options = dict(options or {})
+        self.num_ctx = num_ctx or None
+        self.image_max_side = image_max_side or DEFAULT_MAX_SIDE
+        self.image_quality = image_quality or DEFAULT_QUALITY
+        self.keep_alive = keep_alive if keep_alive not in (None, "") else "default"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Preset":
+        image = data.get("image") or {}
+        return cls(
+            system_prompt=str(data.get("system_prompt") or ""),
+            model=data.get("model"),
+            max_tokens=_int(data.get("max_tokens")),
+            options=data.get("options") if isinstance(data.get("options"), dict) else None,
+            num_ctx=_int(data.get("num_ctx")),
+            image_max_side=_int(image.get("max_side")),
+            image_quality=_int(image.get("quality")),
+            keep_alive=data.get("keep_alive"),
+        )
+
+    def to_dict(self) -> dict:
+        data = {"system_prompt": self.system_prompt}
+        if self.model:
+            data["model"] = self.model
+        if self.max_tokens:
+            data["max_tokens"] = self.max_tokens
+        if self.options:
+            data["options"] = dict(self.options)
+        if self.num_ctx:
+            data["num_ctx"] = self.num_ctx
+        if (self.image_max_side, self.image_quality) != (DEFAULT_MAX_SIDE, DEFAULT_QUALITY):
+            data["image"] = {"max_side": self.image_max_side, "quality": self.image_quality}
+        if self.keep_alive != "default":
+            data["keep_alive"] = self.keep_alive
+        return data
+
+    def keep_in_memory(self, node_setting: bool) -> bool:
+        """The node's ``keep_in_memory`` switch, overridden by the policy."""
+        if self.keep_alive == "pin":
+            return True
+        if self.keep_alive == "unload":
+            return False
+        return node_setting
+
+    def keep_alive_value(self, default):
+        """``keep_alive`` to send: seconds from the preset or ``default``."""
+        if self.keep_alive == "pin":
+            return -1
+        if isinstance(self.keep_alive, (int, float)) and not isinstance(self.keep_alive, bool):
+            return self.keep_alive
+        return default
+
+    def apply(self, payload: dict):
+        """Put the preset's sampling settings into a chat ``payload``.
+
+        Options the OpenAI-compatible endpoint knows go to the top level; the
+        rest (``num_ctx``, ``top_k``, ``repeat_penalty``...) go to
+        ``options``, which only Ollama's native API reads.
+        """
+        if self.max_tokens:
+            payload["max_tokens"] = self.max_tokens
+        native = {}
+        for name, value in self.options.items():
+            if name in OPENAI_OPTIONS:
+                payload[name] = value
+            else:
+                native[name] = value
+        if self.num_ctx:
+            native["num_ctx"] = self.num_ctx
+        if native:
+            payload["options"] = native
+
+
+def _int(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_preset(name: str, text: str) -> Preset:
+    """Parse a preset file: JSON for ``.json``, plain system prompt otherwise."""
+    if name.lower().endswith(".json"):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            logger.warning("parse_preset: %s is not valid JSON: %s", name, e)
+            return Preset()
+        if isinstance(data, dict):
+            return Preset.from_dict(data)
+        logger.warning("parse_preset: %s must hold a JSON object", name)
+        return Preset()
+    return Preset(system_prompt=text)
+
+
+def dump_preset(preset: Preset) -> str:
+    return json.dumps(preset.to_dict(), ensure_ascii=False, indent=2) + "\n"
@@ -0,0 +1,172 @@
+# preset_store.py
+
+"""In-memory index of the presets folder.
+
+ComfyUI asks for node definitions often, and the preset nodes used to list
+``Ollama_presets`` and re-read the preset file every time — slow with many
+presets on a network share.  The store keeps the file list and the file
+contents in memory:
+
+* :meth:`PresetStore.names` and :meth:`PresetStore.get` never touch the disk
+  once a preset has been read;
+* a daemon thread watches the folder: its mtime is checked every
+  ``WATCH_INTERVAL`` seconds (files added, removed or renamed), and every
+  ``RESCAN_INTERVAL`` seconds the files themselves are re-stat'ed to catch
+  presets edited in place;
+* :meth:`PresetStore.save` writes through the cache, so a saved preset is
+  listed right away.
+"""
+
+import os
+import threading
+import time
+
+from .log_utils import get_logger
+from .preset_format import Preset, parse_preset
+from .utils import get_presets_dir
+
+logger = get_logger("OllamaPresetStore")
+
+EXTENSIONS = (".txt", ".json")
+WATCH_INTERVAL = 2.0
+RESCAN_INTERVAL = 30.0
+
+
+class _Entry:
+    __slots__ = ("mtime", "text", "preset")
+
+    def __init__(self, mtime: float):
+        self.mtime = mtime
+        self.text = None  # читается при первом обращении
+        self.preset = None
+
+
+class PresetStore:
+    def __init__(self, directory: str = None):
+        self._directory = directory
+        self._entries = {}
+        self._names = []
+        self._dir_mtime = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self.reads = 0
+        self.rescans = 0
+
+    @property
+    def directory(self) -> str:
+        if self._directory is None:
+            self._directory = get_presets_dir()
+        return self._directory
+
+    def _ensure_started(self):
+        if self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._scan()
+            self._watcher = threading.Thread(target=self._watch, daemon=True, name="ollama-preset-watch")
+            self._watcher.start()
+
+    def _scan(self):
+        """Rebuild the index from the folder; keeps cached text of unchanged files."""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+            found = {}
+            with os.scandir(self.directory) as it:
+                for de in it:
+                    if de.name.lower().endswith(EXTENSIONS) and de.is_file():
+                        found[de.name] = de.stat().st_mtime
+        except OSError as e:
+            logger.warning("PresetStore: can't scan %s: %s", self.directory, e)
+            return
+        entries = {}
+        for name, mtime in found.items():
+            old = self._entries.get(name)
+            entries[name] = old if old is not None and old.mtime == mtime else _Entry(mtime)
+        self._entries = entries
+        self._names = sorted(entries)
+        self._dir_mtime = dir_mtime
+        self._scanned_at = time.monotonic()
+        self.rescans += 1
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            try:
+                self.check()
+            except Exception as e:
+                logger.debug("PresetStore: watch failed: %s", e)
+
+    def check(self):
+        """Re-index if the folder changed (or a periodic rescan is due)."""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+        except OSError:
+            dir_mtime = None
+        with self._lock:
+            if dir_mtime != self._dir_mtime or time.monotonic() - self._scanned_at >= RESCAN_INTERVAL:
+                self._scan()
+
+    def names(self) -> list:
+        """Sorted preset file names."""
+        self._ensure_started()
+        return list(self._names)
+
+    def get(self, name: str) -> str:
+        """Text of preset ``name``; ``""`` if there is no such preset."""
+        self._ensure_started()
+        entry = self._entries.get(name)
+        if entry is None:
+            return ""
+        if entry.text is None:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry.text = f.read()
+                self.reads += 1
+            except Exception as e:
+                logger.warning("PresetStore: can't read %s: %s", path, e)
+                return ""
+        return entry.text
+
+    def get_preset(self, name: str) -> Preset:
+        """Parsed preset ``name`` (see :mod:`preset_format`)."""
+        text = self.get(name)
+        entry = self._entries.get(name)
+        if entry is None:
+            return Preset()
+        if entry.text is None:
+            return Preset()
+        if entry.preset is None:
+            entry.preset = parse_preset(name, text)
+        return entry.preset
+
+    def save(self, name: str, text: str) -> str:
+        """Write preset ``name`` and update the index; returns the file name."""
+        self._ensure_started()
+        if not name.lower().endswith(EXTENSIONS):
+            name += EXTENSIONS[0]
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        entry = _Entry(os.stat(path).st_mtime)
+        entry.text = text
+        with self._lock:
+            if name not in self._entries:
+                self._names = sorted(self._names + [name])
+            self._entries[name] = entry
+        return name
+
+    def stats(self) -> dict:
+        return {
+            "presets": len(self._names),
+            "cached": sum(1 for e in self._entries.values() if e.text is not None),
+            "reads": self.reads,
+            "rescans": self.rescans,
+        }
+
+
+# Общее хранилище для всех нод
+preset_store = PresetStore()
@@ -0,0 +1,91 @@
+# prompt_scan.py
+
+"""Finding Ollama models in a queued ComfyUI prompt.
+
+A prompt is ``{node_id: {"class_type": ..., "inputs": {...}}}``; an input
+is either a literal or a link ``[source_id, output_index]``.  Links are
+followed through selector nodes such as ``OllamaModelNode`` whose input has
+the same name as the value they output.
+"""
+
+from .log_utils import get_logger
+
+logger = get_logger("OllamaPromptScan")
+
+_MAX_LINK_DEPTH = 8
+
+
+def _resolve(prompt: dict, value, name: str, depth: int = 0):
+    """Literal value of input ``name``, following links where possible."""
+    if isinstance(value, list) and len(value) == 2 and depth < _MAX_LINK_DEPTH:
+        source = prompt.get(str(value[0]))
+        if not isinstance(source, dict):
+            return None
+        inputs = source.get("inputs") or {}
+        if name in inputs:
+            return _resolve(prompt, inputs[name], name, depth + 1)
+        return None
+    return value if isinstance(value, str) else None
+
+
+def _node_order(node_id):
+    try:
+        return (0, int(node_id))
+    except (TypeError, ValueError):
+        return (1, str(node_id))
+
+
+def models_in_prompt(prompt: dict, class_types=None) -> list:
+    """``[(ip_port, model_name), ...]`` used by Ollama nodes, in node order.
+
+    ``class_types`` limits the scan to these node classes; by default every
+    class whose name starts with ``Ollama`` and has both inputs is used.
+    """
+    found = []
+    if not isinstance(prompt, dict):
+        return found
+    for node_id in sorted(prompt, key=_node_order):
+        node = prompt[node_id]
+        if not isinstance(node, dict):
+            continue
+        class_type = node.get("class_type", "")
+        if class_types is not None and class_type not in class_types:
+            continue
+        if class_types is None and not class_type.startswith("Ollama"):
+            continue
+        inputs = node.get("inputs") or {}
+        if "ip_port" not in inputs or "model_name" not in inputs:
+            continue
+        ip_port = _resolve(prompt, inputs["ip_port"], "ip_port")
+        model_name = _resolve(prompt, inputs["model_name"], "model_name")
+        if ip_port and model_name and not model_name.startswith("<"):
+            pair = (ip_port.strip(), model_name.strip())
+            if pair not in found:
+                found.append(pair)
+    return found
+
+
+def register_prompt_handler(handler) -> bool:
+    """Call ``handler(prompt)`` for every prompt queued in ComfyUI.
+
+    Errors in ``handler`` are logged and never block queuing.  Returns
+    ``False`` when not running inside ComfyUI.
+    """
+    try:
+        from server import PromptServer
+    except ImportError:
+        return False
+    instance = getattr(PromptServer, "instance", None)
+    if instance is None or not hasattr(instance, "add_on_prompt_handler"):
+        return False
+
+    def on_prompt(json_data):
+        try:
+            handler(json_data.get("prompt") or {})
+        except Exception as e:
+            logger.warning("prompt handler %s failed: %s", getattr(handler, '__name__', handler), e,
+                           exc_info=True)
+        return json_data
+
+    instance.add_on_prompt_handler(on_prompt)
+    return True
@@ -0,0 +1,476 @@
+# request_core.py
+
+"""One request path for all chat nodes.
+
+Every node used to carry its own copy of payload building, caching, server
+choice, retries, model pulls and response parsing; each optimization had to
+be made five times and the copies drifted.  The nodes now describe their
+call as a :class:`ChatRequest` and hand it to :data:`pipeline`, which runs
+it through a chain of middleware stages:
+
+* ``encode`` — encode images at the size planned for the model
+  (:mod:`image_planner`), build the payload and serialize it for the
+  chosen backend (or as the next turn of a chat session);
+* ``session`` — record a session's new turn, its server and context
+  (:mod:`chat_session`);
+* ``cache`` — answer from the response cache, or store the answer;
+* ``coalesce`` — attach to an identical deterministic request already in
+  flight instead of sending another one (:mod:`single_flight`);
+* ``think`` — when a reasoning model spends its thinking budget, ask it to
+  answer right away (:mod:`think_parser`);
+* ``route`` — resolve the servers and drive the attempt loop: server
+  choice (a session's own server first), retries (:mod:`retry_policy`),
+  failing over to a pool server that has a missing model, else pulling it;
+* ``metrics`` — time each attempt (:mod:`metrics`);
+* ``send`` — keep the model resident, lease the server and open the
+  connection;
+* ``parse`` — read the streamed or plain response, taking the thoughts out
+  of the answer for reasoning requests and checking a JSON answer against
+  its schema as it arrives (:mod:`structured_output`).
+
+A stage is ``stage(request, call_next)``: it may change the request, call
+the rest of the chain (possibly several times, like ``route``) or answer
+without calling it (like ``cache``).  New features are added as stages with
+:meth:`RequestPipeline.use` and apply to every node at once.
+"""
+
+from . import metrics
+from .chat_backend import (apply_format, apply_options, build_generate_request, build_request, format_timings,
+                           parse_options)
+from .chat_session import sessions
+from .http_client import RequestCancelled, urlopen
+from .image_encoding import EncodedImage, encode_image, image_part
+from .image_planner import geometry_for
+from .load_balancer import balancer, canonical_model_name, resolve_endpoints
+from .log_utils import get_logger
+from .model_catalog import model_catalog
+from .model_pull import PULL_TIMEOUT
+from .model_residency import residency
+from .response_cache import cache_key, is_deterministic, response_cache
+from .retry_policy import Retry, describe, model_missing
+from .single_flight import single_flight
+from .streaming import apply_stream_options, parse_stop_sequences, read_chat_response
+from .structured_output import JsonValidator, SchemaMismatch
+from .think_parser import ThinkParser, join_thoughts, split_thoughts
+from .utils import pull_model
+
+logger = get_logger("OllamaRequest")
+
+
+class RequestError(Exception):
+    """A request that can't be made; the message goes to the node output."""
+
+
+class ChatRequest:
+    """One node call: the node's inputs plus the state the stages fill in."""
+
+    def __init__(self, node: str, ip_port: str, model_name: str, system_prompt: str = "", user_prompt: str = "",
+                 images=(), keep_in_memory=True, max_tokens=0, stream=False, stop_sequence="", token_budget=0,
+                 cache_mode="off", backend="openai", ollama_options="", keep_alive=None, preset=None,
+                 think=False, thinking_budget=0, on_thinking_budget="answer", discard_thoughts=False,
+                 image_max_side=None, image_quality=None, image_tokens=0, session=None, json_schema=None):
+        self.node = node
+        self.ip_port = ip_port
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        # Тензоры IMAGE или уже закодированные EncodedImage
+        self.images = list(images)
+        self.keep_in_memory = keep_in_memory
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.stop_sequence = stop_sequence
+        self.token_budget = token_budget
+        self.cache_mode = cache_mode
+        self.backend = backend
+        self.ollama_options = ollama_options
+        self.keep_alive = keep_alive
+        self.preset = preset
+        self.think = think
+        # Лимит токенов размышлений и что делать по его исчерпании: "answer" или "stop"
+        self.thinking_budget = thinking_budget
+        self.on_thinking_budget = on_thinking_budget
+        self.discard_thoughts = discard_thoughts
+        self.image_max_side = image_max_side
+        self.image_quality = image_quality
+        # Бюджет токенов на все картинки запроса (0 — по умолчанию для модели)
+        self.image_tokens = image_tokens
+        # ChatSession: история и context предыдущих ходов
+        self.session = session
+        # Схема JSON-ответа (dict) или "json" — любой JSON; None — обычный текст
+        self.json_schema = json_schema
+
+        # Заполняются стадиями
+        self.stop = []
+        self.chat_payload = None  # до преобразования под backend
+        self.payload = None
+        self.path = None
+        self.body = None
+        self.cache_key = None
+        self.endpoints = []
+        self.host = None
+        self.attempt = 0
+        self.retry = None
+        self.timer = None
+        self.response = None
+        self.text = None
+        self.info = {}
+        self.context = None
+        self.image_token_estimate = 0
+
+
+class ChatResult:
+    __slots__ = ("text", "thoughts", "info", "error", "cached", "shared", "session")
+
+    def __init__(self, text: str = "", info=None, error: str = None, cached: bool = False, shared: bool = False,
+                 thoughts: str = "", session=None):
+        self.text = text
+        # Размышления модели (только для запросов с think)
+        self.thoughts = thoughts
+        self.info = info or {}
+        self.error = error
+        self.cached = cached
+        # Получен от такого же запроса, выполнявшегося одновременно
+        self.shared = shared
+        # Сессия после этого хода (для запросов с session)
+        self.session = session
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def response(self) -> str:
+        """The answer, or the error text nodes put on their output."""
+        return self.text if self.error is None else f"Error: {self.error}"
+
+    @property
+    def timings(self) -> str:
+        return format_timings(self.info)
+
+    def outputs(self) -> tuple:
+        """``(response, timings)`` — what most chat nodes return."""
+        return (self.response, self.timings if self.error is None else "")
+
+
+def _payload_messages(request: ChatRequest) -> list:
+    # Системный промпт — всегда строка: одинаковый префикс для кеша промпта Ollama
+    system = {"role": "system", "content": request.system_prompt}
+    history = list(request.session.messages) if request.session is not None else []
+    if not request.images:
+        return [system] + history + [{"role": "user", "content": request.user_prompt}]
+    content = [{"type": "text", "text": request.user_prompt}]
+    content += [image_part(i) for i in range(len(request.images))]
+    return [system] + history + [{"role": "user", "content": content}]
+
+
+def _build_request(request: ChatRequest, payload: dict):
+    """``(path, body, payload)`` for ``payload``: a session's next turn or a chat request."""
+    session = request.session
+    if session is not None and payload["messages"][-1]["role"] == "user":
+        context = sessions.context(session)
+        if context is not None or not session.messages:
+            # Только новый ход: остальное сервер помнит по context
+            return build_generate_request(payload, request.images, context)
+    # Начало ответа ассистента /api/generate не передать — такой запрос идёт в /api/chat с полной историей
+    return build_request(payload, request.images, request.backend)
+
+
+def encode_stage(request: ChatRequest, call_next):
+    try:
+        options = parse_options(request.ollama_options)
+    except ValueError as e:
+        raise RequestError(f"bad ollama_options: {e}")
+    if any(not isinstance(img, EncodedImage) for img in request.images):
+        # Размер под геометрию модели; бюджет токенов делим поровну между картинками
+        kwargs = {"geometry": geometry_for(request.model_name),
+                  "token_budget": request.image_tokens // len(request.images),
+                  "labels": metrics.request_labels(request.node, request.model_name, request.ip_port)}
+        if request.image_max_side:
+            kwargs["max_side"] = request.image_max_side
+        if request.image_quality:
+            kwargs["quality"] = request.image_quality
+        try:
+            request.images = [img if isinstance(img, EncodedImage) else encode_image(img, **kwargs)
+                              for img in request.images]
+        except Exception as e:
+            logger.error("%s: image encoding failed", request.node, exc_info=True)
+            raise RequestError(f"converting image: {e}")
+        logger.debug("%s: data URL lengths %s", request.node, [img.data_url_length for img in request.images])
+    if request.images:
+        request.image_token_estimate = sum(img.tokens or 0 for img in request.images)
+        metrics.image_tokens_total.inc(request.image_token_estimate, node=request.node, model=request.model_name)
+        logger.info("%s: %s images, ~%s image tokens (%s)", request.node, len(request.images),
+                    request.image_token_estimate, ", ".join(f"{img.width}x{img.height}" for img in request.images))
+
+    payload = {
+        "model": request.model_name,
+        "messages": _payload_messages(request),
+        "keep_alive": residency.keep_alive() if request.keep_alive is None else request.keep_alive,
+    }
+    if request.max_tokens:
+        payload["max_tokens"] = request.max_tokens
+    if request.preset is not None:
+        request.preset.apply(payload)
+    if (request.think and (request.thinking_budget or request.discard_thoughts)) or request.json_schema is not None:
+        # Прервать размышления или испорченный JSON и не держать в памяти весь ответ
+        # с размышлениями можно только в потоковом ответе
+        request.stream = True
+    if request.json_schema is not None:
+        apply_format(payload, request.json_schema)
+    request.stop = parse_stop_sequences(request.stop_sequence)
+    apply_stream_options(payload, request.stream, request.stop, request.token_budget)
+    apply_options(payload, options)
+    if request.think and request.backend == "native":
+        # Нативный API отдаёт рассуждения отдельным полем только с think
+        payload["think"] = True
+    request.max_tokens = payload.get("max_tokens", 0)
+    request.chat_payload = payload
+    request.path, request.body, request.payload = _build_request(request, payload)
+    return call_next(request)
+
+
+def session_stage(request: ChatRequest, call_next):
+    result = call_next(request)
+    if request.session is None or not result.ok:
+        return result
+    result.session = request.session.advance(request.user_prompt, result.text)
+    # Ответ из кеша или чужого запроса: ни сервера, ни context у этого хода нет
+    sessions.remember(result.session, request.host, request.context)
+    logger.debug("%s: %r on %s, context %s", request.node, result.session, request.host,
+                 len(request.context) if request.context else "lost")
+    return result
+
+
+def _request_key(request: ChatRequest, mode: str):
+    salt = ""
+    if request.think:
+        # Бюджет и режим размышлений меняют ответ, но не тело запроса
+        salt = f"think:{request.thinking_budget}:{request.on_thinking_budget}:{request.discard_thoughts}"
+    return cache_key(request.path, request.body, request.payload, mode, salt)
+
+
+def cache_stage(request: ChatRequest, call_next):
+    request.cache_key = _request_key(request, request.cache_mode)
+    cached = response_cache.get(request.cache_key)
+    if cached is not None:
+        logger.info("%s: served from response cache", request.node)
+        if request.think:
+            thoughts, text = split_thoughts(cached, request.discard_thoughts)
+            return ChatResult(text, cached=True, thoughts=thoughts)
+        return ChatResult(cached, cached=True)
+    result = call_next(request)
+    if result.ok and not result.shared:
+        response_cache.put(request.cache_key,
+                           join_thoughts(result.thoughts, result.text) if request.think else result.text)
+    return result
+
+
+def coalesce_stage(request: ChatRequest, call_next):
+    # Объединяем только детерминированные запросы: их ответы и так совпали бы
+    key = _request_key(request, "deterministic")
+    result, shared = single_flight.do(key, lambda: call_next(request))
+    if not shared:
+        return result
+    logger.info("%s: attached to an identical request in flight", request.node)
+    metrics.coalesced_total.inc(node=request.node, model=request.model_name)
+    return ChatResult(result.text, result.info, result.error, shared=True, thoughts=result.thoughts)
+
+
+def think_stage(request: ChatRequest, call_next):
+    result = call_next(request)
+    if not (result.ok and result.info.get("thinking_truncated") and request.on_thinking_budget == "answer"):
+        return result
+    # Закрываем размышления за модель: последнее сообщение ассистента она продолжит сразу ответом
+    logger.info("%s: thinking budget spent, asking for the answer", request.node)
+    payload = dict(request.chat_payload)
+    payload.pop("think", None)
+    payload["messages"] = payload["messages"] + [
+        {"role": "assistant", "content": f"<think>\n{result.thoughts}\n</think>\n\n"}]
+    request.chat_payload = payload
+    request.path, request.body, request.payload = _build_request(request, payload)
+    request.thinking_budget = 0
+    answer = call_next(request)
+    if not answer.ok:
+        return answer
+    answer.info["thinking_tokens"] = result.info.get("thinking_tokens")
+    answer.info["thinking_truncated"] = True
+    return ChatResult(answer.text, answer.info, thoughts=result.thoughts)
+
+
+def _model_holders(endpoints, model_name: str, exclude=()) -> list:
+    """Servers of ``endpoints`` whose catalog lists ``model_name``."""
+    name = canonical_model_name(model_name)
+    holders = []
+    for endpoint in endpoints:
+        if endpoint in exclude:
+            continue
+        models = model_catalog.installed(endpoint)
+        if models and any(m.name == name for m in models):
+            holders.append(endpoint)
+    return holders
+
+
+def route_stage(request: ChatRequest, call_next):
+    try:
+        request.endpoints = resolve_endpoints(request.ip_port)
+    except ValueError as e:
+        raise RequestError(str(e))
+    retry = request.retry = Retry(request.node, request.model_name)
+    # Сессия — на сервер, где лежит её KV-кеш
+    pinned = sessions.server(request.session) if request.session is not None else None
+    tried = []
+    missing = []  # серверы, ответившие, что модели у них нет
+    pulled = False
+    for attempt in retry:
+        request.attempt = attempt
+        try:
+            # Повтор уходит на другой сервер, если он есть
+            candidates = [e for e in request.endpoints if e not in missing] or request.endpoints
+            request.host = host = balancer.choose(candidates, request.model_name, exclude=tried, prefer=pinned)
+            tried.append(host)
+            logger.info("%s: attempt %s/%s on %s", request.node, attempt, retry.max_attempts, host)
+            return call_next(request)
+        except (RequestCancelled, RequestError):
+            raise
+        except Exception as e:
+            logger.warning("%s: %s on attempt %s", request.node, describe(e), attempt)
+            if retry.failed(e, failover=len(set(tried)) < len(request.endpoints)):
+                continue
+            if model_missing(e) and not pulled:
+                missing.append(host)
+                holders = _model_holders(request.endpoints, request.model_name, missing)
+                if holders:
+                    # Модель есть на другом сервере пула — идём туда, а не качаем
+                    logger.info("%s: model not found on %s, trying %s", request.node, host, ", ".join(holders))
+                    tried = [t for t in tried if t not in holders]
+                    retry.grant_attempt()
+                    continue
+                logger.info("%s: model not found, pulling...", request.node)
+                pulled = pull_model(request.host, request.model_name, timeout=PULL_TIMEOUT)
+                if pulled:
+                    # Модель теперь есть на этом сервере — повторяем на нём же;
+                    # время загрузки не в счёт таймаута запроса и числа попыток
+                    balancer.mark_loaded(request.host, request.model_name)
+                    tried.remove(request.host)
+                    missing.remove(request.host)
+                    pinned = request.host
+                    retry.grant_attempt(fresh_deadline=True)
+                    continue
+            break
+    return ChatResult(error=retry.error)
+
+
+def metrics_stage(request: ChatRequest, call_next):
+    with metrics.track_request(request.node, request.model_name, request.host, request.attempt,
+                               len(request.body)) as timer:
+        request.timer = timer
+        result = call_next(request)
+        timer.info = result.info
+        return result
+
+
+def send_stage(request: ChatRequest, call_next):
+    host = request.host
+    with residency.use(host, request.model_name, request.keep_in_memory), balancer.lease(host, request.model_name), \
+            urlopen(host, request.path, data=request.body, timeout=request.retry.timeout()) as resp:
+        request.response = resp
+        return call_next(request)
+
+
+# Ответ оборван по лимиту токенов: повтор оборвётся так же
+_TRUNCATED = ("length", "token_budget", "stop_sequence")
+
+
+def _prepare_schema_retry(request: ChatRequest, finish_reason, error: SchemaMismatch):
+    """Get the request ready to retry after ``error``, or fail it if a retry would repeat it.
+
+    A truncated answer or greedy sampling (temperature 0) gives the same
+    broken JSON again; a fixed seed is changed for the next attempt.
+    """
+    if finish_reason in _TRUNCATED:
+        raise RequestError(f"{error}; the answer was cut off ({finish_reason}), raise max_tokens")
+    payload = request.payload
+    options = payload.get("options") or {}
+    if payload.get("temperature", options.get("temperature")) == 0:
+        raise RequestError(f"{error}; not retried at temperature 0")
+    if not is_deterministic(payload):
+        return
+    # Фиксированный сид повторил бы тот же ответ — берём следующий
+    chat_payload = dict(request.chat_payload)
+    chat_options = dict(chat_payload.get("options") or {})
+    if "seed" in chat_options:
+        chat_options["seed"] += 1
+        chat_payload["options"] = chat_options
+    else:
+        chat_payload["seed"] += 1
+    logger.info("%s: retrying with seed %s", request.node, chat_options.get("seed", chat_payload.get("seed")))
+    request.chat_payload = chat_payload
+    request.path, request.body, request.payload = _build_request(request, chat_payload)
+
+
+def parse_stage(request: ChatRequest, call_next):
+    info = {}
+    think = ThinkParser(request.thinking_budget, request.discard_thoughts) if request.think else None
+    validator = JsonValidator(request.json_schema) if request.json_schema is not None else None
+    try:
+        # SchemaMismatch из on_text обрывает поток; route_stage повторит запрос
+        text = read_chat_response(request.response, request.stream, request.stop, request.token_budget,
+                                  request.max_tokens, info=info, think=think,
+                                  on_text=validator.feed if validator is not None else None)
+        if validator is not None:
+            validator.close()
+    except SchemaMismatch as e:
+        _prepare_schema_retry(request, info.get("finish_reason"), e)
+        raise
+    request.text = text = text.strip()
+    request.context = info.pop("context", None)
+    if request.image_token_estimate:
+        info["image_tokens"] = request.image_token_estimate
+    request.info = info
+    logger.info("%s: got content length=%s", request.node, len(text))
+    if think is None:
+        return ChatResult(text, info)
+    info["thinking_tokens"] = think.thinking_tokens
+    if think.budget_hit:
+        info["thinking_truncated"] = True
+    logger.debug("%s: %s thinking tokens, %s chars of thoughts", request.node, think.thinking_tokens,
+                 think.thinking_chars)
+    return ChatResult(text, info, thoughts=think.thoughts)
+
+
+class RequestPipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def use(self, stage, before: str = None, after: str = None):
+        """Insert middleware ``stage`` before or after the stage named so (default: last)."""
+        names = [s.__name__ for s in self.stages]
+        if before is not None:
+            self.stages.insert(names.index(before), stage)
+        elif after is not None:
+            self.stages.insert(names.index(after) + 1, stage)
+        else:
+            self.stages.append(stage)
+
+    def _call(self, index: int, request: ChatRequest):
+        stage = self.stages[index]
+        if index + 1 == len(self.stages):
+            return stage(request, None)
+        return stage(request, lambda r: self._call(index + 1, r))
+
+    def execute(self, request: ChatRequest) -> ChatResult:
+        """Run ``request`` through all stages; errors come back in the result."""
+        try:
+            return self._call(0, request)
+        except RequestError as e:
+            return ChatResult(error=str(e))
+
+
+# Общий конвейер для всех нод
+pipeline = RequestPipeline([encode_stage, session_stage, cache_stage, coalesce_stage, think_stage, route_stage,
+                            metrics_stage, send_stage, parse_stage])
+
+
+def execute(request: ChatRequest) -> ChatResult:
+    return pipeline.execute(request)
@@ -0,0 +1,252 @@
+# response_cache.py
+
+"""Opt-in cache of Ollama answers keyed on the request body.
+
+Re-queuing a graph re-sends byte-identical payloads; with the cache enabled
+they are answered from an in-memory LRU tier or an on-disk tier stored in
+``Ollama_cache`` next to the presets folder.  The key is a SHA-256 of the
+endpoint path and the serialized request body, which already carries the
+model, prompts, image bytes and sampling parameters.
+
+Cache modes:
+
+* ``off`` — never cache;
+* ``deterministic`` — only requests with ``temperature`` 0 or a fixed
+  ``seed`` (where repeating the call would give the same answer);
+* ``always`` — any identical request.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .log_utils import get_logger
+from .utils import get_presets_dir
+
+logger = get_logger("OllamaResponseCache")
+
+try:
+    import comfy.model_management
+except ImportError:  # запуск вне ComfyUI
+    comfy = None
+
+CACHE_MODES = ["off", "deterministic", "always"]
+
+MEMORY_MAX_ENTRIES = 512
+DISK_MAX_BYTES = 256 * 1024 * 1024
+TTL_SECONDS = 7 * 24 * 3600
+
+
+def get_cache_dir() -> str:
+    """``Ollama_cache`` folder next to ``Ollama_presets``."""
+    path = os.path.join(os.path.dirname(get_presets_dir()), "Ollama_cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_deterministic(payload: dict) -> bool:
+    """Whether ``payload``, as sent to the server, fixes the sampling (temperature 0 or a seed)."""
+    options = payload.get("options") or {}
+    temperature = payload.get("temperature", options.get("temperature"))
+    seed = payload.get("seed", options.get("seed"))
+    # Сид — только целое число (True и строки сидом не считаются)
+    has_seed = isinstance(seed, int) and not isinstance(seed, bool) and seed >= 0
+    return (temperature == 0 and not isinstance(temperature, bool)) or has_seed
+
+
+def cache_key(path: str, body: bytes, payload: dict, mode: str = "off", salt: str = ""):
+    """Key for a request, or ``None`` if ``mode`` says not to cache it.
+
+    ``salt`` — settings that change the answer but aren't sent to the server.
+    """
+    if mode == "off" or not mode:
+        return None
+    if mode == "deterministic" and not is_deterministic(payload):
+        return None
+    h = hashlib.sha256()
+    h.update(path.encode("utf-8"))
+    h.update(b"\0")
+    h.update(body)
+    if salt:
+        h.update(b"\0")
+        h.update(salt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=None, max_entries=MEMORY_MAX_ENTRIES,
+                 max_disk_bytes=DISK_MAX_BYTES, ttl=TTL_SECONDS):
+        self._cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (created, text)
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def cache_dir(self) -> str:
+        if self._cache_dir is None:
+            self._cache_dir = get_cache_dir()
+        return self._cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry[1]
+
+    def put(self, key, text: str):
+        if key is None or text is None:
+            return
+        if comfy is not None and comfy.model_management.processing_interrupted():
+            # Оборванный ответ не кешируем
+            return
+        entry = (time.time(), text)
+        with self._lock:
+            self.stores += 1
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            created, text = float(data["created"]), data["text"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("ResponseCache: dropping unreadable entry %s: %s", path, e)
+            self._remove(path)
+            return None
+        if self._expired(created):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # mtime служит временем последнего доступа для LRU
+        except OSError:
+            pass
+        return created, text
+
+    def _write_disk(self, key, entry):
+        if self.max_disk_bytes <= 0:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            data = json.dumps({"created": entry[0], "text": entry[1]}).encode("utf-8")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning("ResponseCache: can't write %s: %s", path, e)
+            self._remove(tmp)
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            over = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Drop expired files, then least recently used until under budget."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if self.ttl > 0 and time.time() - st.st_mtime > self.ttl:
+                self._remove(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._disk_bytes = None
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+# Общий кеш для всех нод
+response_cache = ResponseCache()
+
+
+def cache_stats() -> dict:
+    return response_cache.stats()
@@ -0,0 +1,282 @@
+# retry_policy.py
+
+"""When and how soon a failed request is tried again.
+
+The nodes used to retry three times immediately, whatever went wrong, and
+without a timeout a dead server could hold a worker for minutes.  A
+:class:`Retry` drives the attempt loop of one node request instead:
+
+* errors are classified (:func:`classify`): a refused connection, a
+  timeout, a 5xx or 429 response, a garbled body and an answer that breaks
+  the requested JSON schema are retried, other 4xx responses and
+  unexpected exceptions fail at once;
+* between attempts on the same server it sleeps an exponential back-off
+  with full jitter (``OLLAMA_NODES_BACKOFF_BASE``, 0.5 s, doubling up to
+  ``OLLAMA_NODES_BACKOFF_MAX``, 10 s), or as long as the server's
+  ``Retry-After`` asks; failing over to another server or past a schema
+  mismatch doesn't wait;
+* every request has a deadline, ``OLLAMA_NODES_REQUEST_TIMEOUT`` seconds
+  (600 by default, 0 — none), which also bounds each socket read, and all
+  requests of one queued graph share ``OLLAMA_NODES_GRAPH_TIMEOUT``
+  (off by default);
+* ``OLLAMA_NODES_MAX_ATTEMPTS`` (3) attempts at most.
+
+Dead servers are short-circuited by the load balancer's circuit breaker
+(see :mod:`load_balancer`), which raises :class:`ServerUnavailable`
+without touching the network; the retry waits for the breaker only if it
+reopens within ``BACKOFF_MAX`` and the deadline allows it.
+"""
+
+import email.utils
+import http.client
+import json
+import random
+import time
+import urllib.error
+
+from . import metrics
+from .http_client import current_scope
+from .load_balancer import ServerUnavailable
+from .log_utils import _env_float, get_logger
+from .structured_output import SchemaMismatch
+
+logger = get_logger("OllamaRetry")
+
+
+MAX_ATTEMPTS = max(1, int(_env_float("OLLAMA_NODES_MAX_ATTEMPTS", 3)))
+BACKOFF_BASE = _env_float("OLLAMA_NODES_BACKOFF_BASE", 0.5)
+BACKOFF_MAX = _env_float("OLLAMA_NODES_BACKOFF_MAX", 10.0)
+REQUEST_TIMEOUT = _env_float("OLLAMA_NODES_REQUEST_TIMEOUT", 600.0)
+GRAPH_TIMEOUT = _env_float("OLLAMA_NODES_GRAPH_TIMEOUT", 0.0)
+# Дольше этого Retry-After не ждём
+MAX_RETRY_AFTER = 60.0
+# Пауза, если Ollama ответила, что модель ещё загружается
+LOADING_DELAY = 2.0
+
+# Коды, после которых повтор бессмысленен
+_FATAL_STATUS = {400, 401, 403, 404, 405, 413, 422}
+
+
+def retry_after(exc) -> float | None:
+    """Seconds from a ``Retry-After`` header (delta or HTTP date), if any."""
+    headers = getattr(exc, "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
+
+
+def error_body(exc: urllib.error.HTTPError) -> str:
+    """Body of an HTTP error response (read once, then cached on it)."""
+    body = getattr(exc, "_ollama_body", None)
+    if body is None:
+        try:
+            body = exc.read().decode("utf-8", "replace")
+        except Exception:
+            body = ""
+        exc._ollama_body = body
+    return body
+
+
+def classify(exc) -> tuple:
+    """``(reason, retryable, delay)`` for a failed attempt.
+
+    ``delay`` is the minimum wait the server asked for (or ``None``).
+    """
+    if isinstance(exc, urllib.error.HTTPError):
+        reason = f"http_{exc.code}"
+        if exc.code in _FATAL_STATUS or (400 <= exc.code < 500 and exc.code not in (408, 429)):
+            return reason, False, None
+        delay = retry_after(exc)
+        if delay is None and exc.code >= 500 and "loading" in error_body(exc).lower():
+            delay = LOADING_DELAY
+        return reason, True, delay
+    if isinstance(exc, ServerUnavailable):
+        return "circuit_open", True, exc.retry_in
+    if isinstance(exc, TimeoutError):
+        return "timeout", True, None
+    if isinstance(exc, ConnectionRefusedError):
+        return "connection_refused", True, None
+    if isinstance(exc, (OSError, http.client.HTTPException)):
+        return "connection", True, None
+    if isinstance(exc, SchemaMismatch):
+        # Ответ не по схеме: сервер исправен, повторяем сразу
+        return "schema_mismatch", True, None
+    if isinstance(exc, ValueError):
+        # Обрезанный или испорченный ответ (JSONDecodeError, UnicodeDecodeError)
+        return "bad_response", True, None
+    return type(exc).__name__, False, None
+
+
+def model_missing(exc) -> bool:
+    """Whether the server doesn't have the model (it may be pulled and retried)."""
+    return isinstance(exc, urllib.error.HTTPError) and exc.code == 404
+
+
+def describe(exc) -> str:
+    """Short error text for a node output."""
+    if isinstance(exc, urllib.error.HTTPError):
+        detail = error_body(exc)
+        try:
+            detail = json.loads(detail).get("error") or ""
+        except (ValueError, AttributeError):
+            detail = ""
+        return f"HTTPError {exc.code}: {exc.reason}" + (f" ({detail})" if detail else "")
+    if isinstance(exc, TimeoutError):
+        return "timed out"
+    return str(exc) or type(exc).__name__
+
+
+class Deadline:
+    """Absolute point in ``time.monotonic()``; ``None`` means no deadline."""
+
+    __slots__ = ("expires",)
+
+    def __init__(self, expires: float | None):
+        self.expires = expires
+
+    @classmethod
+    def after(cls, seconds: float | None) -> "Deadline":
+        return cls(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+    def earliest(self, other: "Deadline") -> "Deadline":
+        if other.expires is None:
+            return self
+        if self.expires is None:
+            return other
+        return self if self.expires <= other.expires else other
+
+    def remaining(self) -> float | None:
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+_graph_deadlines = {}
+
+
+def _current_prompt_id():
+    try:
+        from server import PromptServer
+    except ImportError:
+        return None
+    instance = getattr(PromptServer, "instance", None)
+    return getattr(instance, "last_prompt_id", None)
+
+
+def graph_deadline() -> Deadline:
+    """Deadline shared by the requests of the graph ComfyUI is running."""
+    if GRAPH_TIMEOUT <= 0:
+        return Deadline(None)
+    prompt_id = _current_prompt_id()
+    if prompt_id is None:
+        return Deadline(None)
+    deadline = _graph_deadlines.get(prompt_id)
+    if deadline is None:
+        # Отсчёт с первого запроса графа; старые графы забываем
+        if len(_graph_deadlines) > 32:
+            _graph_deadlines.clear()
+        deadline = _graph_deadlines[prompt_id] = Deadline.after(GRAPH_TIMEOUT)
+    return deadline
+
+
+class Retry:
+    """Attempt loop of one node request.
+
+    ::
+
+        retry = Retry(node, model_name)
+        for attempt in retry:
+            try:
+                ...  # urlopen(..., timeout=retry.timeout())
+                return result
+            except Exception as e:
+                if not retry.failed(e, failover=...):
+                    break
+        return error(retry.error)
+    """
+
+    def __init__(self, node: str = "", model: str = "", max_attempts: int = None, timeout: float = None):
+        self.node = node
+        self.model = model
+        self.max_attempts = max_attempts or MAX_ATTEMPTS
+        self._timeout = REQUEST_TIMEOUT if timeout is None else timeout
+        self.deadline = Deadline.after(self._timeout).earliest(graph_deadline())
+        self.attempt = 0
+        self.error = "exhausted retries"
+        self._delay = 0.0
+
+    def __iter__(self):
+        while self.attempt < self.max_attempts:
+            if self._delay > 0:
+                remaining = self.deadline.remaining()
+                if remaining is not None and remaining <= self._delay:
+                    self.error += " (deadline exceeded)"
+                    return
+                logger.debug("Retry: waiting %.2fs before attempt %s", self._delay, self.attempt + 1)
+                self._sleep(self._delay)
+                self._delay = 0.0
+            if self.deadline.expired:
+                self.error = f"{self.error} (deadline exceeded)" if self.attempt else "deadline exceeded"
+                return
+            self.attempt += 1
+            yield self.attempt
+
+    @staticmethod
+    def _sleep(seconds: float):
+        scope = current_scope()
+        if scope is not None:
+            scope.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def timeout(self) -> float | None:
+        """Socket timeout for the current attempt: whatever is left of the deadline."""
+        remaining = self.deadline.remaining()
+        return None if remaining is None else max(remaining, 0.001)
+
+    def grant_attempt(self, fresh_deadline: bool = False):
+        """Allow one more attempt, right away, after a failure the server can't help.
+
+        With ``fresh_deadline`` the request's own deadline starts over (the
+        graph's one doesn't) — e.g. after pulling the model, whose download
+        time isn't the request's.
+        """
+        self.max_attempts = max(self.max_attempts, self.attempt + 1)
+        self._delay = 0.0
+        if fresh_deadline:
+            self.deadline = Deadline.after(self._timeout).earliest(graph_deadline())
+
+    def failed(self, exc, failover: bool = False) -> bool:
+        """Record a failed attempt; whether another attempt should follow.
+
+        ``failover`` — the next attempt goes to a different server, so the
+        back-off (which protects the failed one) is skipped.
+        """
+        reason, retryable, delay = classify(exc)
+        self.error = describe(exc)
+        metrics.retries_total.inc(node=self.node, model=self.model, reason=reason)
+        if reason == type(exc).__name__:
+            logger.warning("Retry: unexpected %s", reason, exc_info=exc)
+        if not retryable or self.attempt >= self.max_attempts:
+            return False
+        if reason == "circuit_open" and delay > BACKOFF_MAX:
+            # Сервер недоступен надолго — не держим воркер
+            return False
+        if (failover and reason != "circuit_open") or reason == "schema_mismatch":
+            self._delay = 0.0
+        else:
+            backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.attempt - 1)))
+            self._delay = max(backoff, delay or 0.0)
+        return True
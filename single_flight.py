@@ -0,0 +1,103 @@
+# single_flight.py
+
+"""Coalescing of identical requests that are in flight at the same time.
+
+When several graph branches (or queued jobs) send the same model, prompt
+and images at once, each used to generate the same answer on the same GPU.
+With deterministic sampling (``temperature`` 0 or a fixed ``seed``) the
+answers are identical anyway, so the first request is sent and the others
+attach to it and get its result.
+
+The key is the response-cache key (endpoint path + serialized body), so
+only byte-identical requests are merged.  Followers keep honouring their
+own cancellation; if the leader is cancelled or fails with an exception the
+followers send their own requests.  ``OLLAMA_NODES_COALESCE=0`` turns
+coalescing off.
+"""
+
+import os
+import threading
+
+from .http_client import current_scope
+from .log_utils import get_logger
+
+logger = get_logger("OllamaSingleFlight")
+
+ENABLED = os.environ.get("OLLAMA_NODES_COALESCE", "1").strip().lower() not in ("0", "false", "no", "off")
+# Как часто ожидающий запрос проверяет свою отмену
+POLL_INTERVAL = 0.25
+
+
+class _Flight:
+    __slots__ = ("done", "result", "failed", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """``fn()``, shared with concurrent callers passing the same ``key``.
+
+        Returns ``(result, shared)``; ``shared`` is ``True`` for followers
+        that got the leader's result.  ``key=None`` just calls ``fn``.
+        """
+        if key is None or not ENABLED:
+            return fn(), False
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                flight.followers += 1
+        if leader:
+            return self._lead(key, flight, fn), False
+        if self._follow(flight):
+            with self._lock:
+                self.coalesced += 1
+            return flight.result, True
+        # Ведущий запрос не дал результата — отправляем свой
+        return fn(), False
+
+    def _lead(self, key, flight, fn):
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    @staticmethod
+    def _follow(flight) -> bool:
+        scope = current_scope()
+        while not flight.done.wait(POLL_INTERVAL):
+            if scope is not None:
+                scope.check()
+        return not flight.failed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
+
+
+# Общий экземпляр для всех нод
+single_flight = SingleFlight()
@@ -0,0 +1,250 @@
+# streaming.py
+
+"""Reading ``/v1/chat/completions`` responses, streamed or not.
+
+With ``stream`` enabled Ollama sends the answer as Server-Sent Events
+(``data: {...}`` lines, terminated by ``data: [DONE]``); the native API uses
+NDJSON.  Both are parsed line by line as they arrive, so progress is reported
+to ComfyUI while the model is still generating and the request can be cut
+short on a stop sequence, a token budget or a ComfyUI interrupt.
+"""
+
+import json
+
+from . import metrics
+from .log_utils import abbreviate, get_logger
+
+logger = get_logger("OllamaStreaming")
+
+try:
+    import comfy.utils
+    import comfy.model_management
+except ImportError:  # запуск вне ComfyUI
+    comfy = None
+
+
+def parse_stop_sequences(text: str) -> list:
+    """One stop sequence per line; ``\\n`` inside a line means a newline."""
+    if not text:
+        return []
+    return [line.replace("\\n", "\n") for line in text.splitlines() if line]
+
+
+def apply_stream_options(payload: dict, stream=False, stop=None, token_budget=0) -> dict:
+    """Add streaming, stop and budget fields to a chat payload in place."""
+    if stream:
+        payload["stream"] = True
+    if stop:
+        payload["stop"] = list(stop)
+    if token_budget and token_budget > 0:
+        limit = payload.get("max_tokens")
+        payload["max_tokens"] = min(limit, token_budget) if limit else token_budget
+    return payload
+
+
+def iter_events(lines):
+    """Yield JSON chunks from an SSE or NDJSON byte-line iterator."""
+    for raw in lines:
+        line = raw.decode("utf-8").strip() if isinstance(raw, bytes) else raw.strip()
+        if not line or line.startswith(":"):
+            continue
+        if line.startswith("data:"):
+            line = line[5:].strip()
+            if line == "[DONE]":
+                return
+        elif line.startswith(("event:", "id:", "retry:")):
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            logger.debug("iter_events: skipping malformed chunk %r", line[:200])
+
+
+def chunk_text(chunk: dict) -> str:
+    """Text delta of one chunk in either OpenAI or native format."""
+    choices = chunk.get("choices")
+    if choices:
+        delta = choices[0].get("delta") or choices[0].get("message") or {}
+        return delta.get("content") or ""
+    message = chunk.get("message")
+    if message:
+        return message.get("content") or ""
+    return chunk.get("response") or ""
+
+
+def chunk_thinking(chunk: dict) -> str:
+    """Thinking delta of a native chunk (``"think": true``)."""
+    message = chunk.get("message")
+    return (message.get("thinking") or "") if message else ""
+
+
+def _tag_thinking(delta: str, thinking: str, in_think: bool):
+    """Wrap native thinking deltas in ``<think>…</think>`` like the shim does."""
+    if not thinking and not (in_think and delta):
+        return delta, in_think
+    prefix = "" if in_think else "<think>"
+    close = "</think>" if delta else ""
+    return prefix + thinking + close + delta, bool(thinking) and not delta
+
+
+class _Progress:
+    """ComfyUI progress bar that tolerates an unknown total."""
+
+    def __init__(self, total: int):
+        self.total = max(int(total or 0), 1)
+        self.bar = comfy.utils.ProgressBar(self.total) if comfy is not None else None
+
+    def update(self, n: int):
+        if self.bar is None:
+            return
+        if n >= self.total:
+            self.total = n + 1
+        self.bar.update_absolute(n, self.total)
+
+    def finish(self, n: int):
+        if self.bar is not None:
+            self.bar.update_absolute(max(n, 1), max(n, 1))
+
+
+def _interrupted() -> bool:
+    return comfy is not None and comfy.model_management.processing_interrupted()
+
+
+class StreamResult:
+    def __init__(self):
+        self.text = ""
+        self.tokens = 0
+        self.finish_reason = None
+        self.final = None  # последний чанк с таймингами / usage
+
+    @property
+    def stopped_early(self) -> bool:
+        return self.finish_reason in ("stop_sequence", "token_budget", "thinking_budget", "interrupted")
+
+
+def _find_stop(text: str, stop, start: int = 0) -> int:
+    """Earliest index of any stop sequence that ends at or after ``start``."""
+    hits = [text.find(s, max(0, start - len(s) + 1)) for s in stop]
+    return min((i for i in hits if i >= 0), default=-1)
+
+
+def read_stream(resp, stop=None, token_budget=0, progress_total=0, on_text=None, think=None) -> StreamResult:
+    """Consume a streamed chat response chunk by chunk.
+
+    ``on_text`` is called with every text delta.  Reading stops early when a
+    stop sequence shows up, ``token_budget`` chunks have arrived or ComfyUI
+    is interrupted; the caller's ``with`` block then drops the connection.
+
+    With a :class:`think_parser.ThinkParser` as ``think`` the deltas go
+    through it: ``text`` and ``on_text`` get only the answer, stop
+    sequences apply to the answer, and reading stops once the parser's
+    thinking budget is spent.
+    """
+    result = StreamResult()
+    text = ""
+    in_think = False
+    progress = _Progress(progress_total or token_budget)
+
+    for chunk in iter_events(resp):
+        delta, in_think = _tag_thinking(chunk_text(chunk), chunk_thinking(chunk), in_think)
+        if delta:
+            result.tokens += 1
+            metrics.mark_token()
+            if think is not None:
+                delta = think.feed(delta)
+            prev_len = len(text)
+            text += delta
+            cut = _find_stop(text, stop, prev_len) if stop else -1
+            if cut >= 0:
+                text = text[:cut]
+                if on_text and cut > prev_len:
+                    on_text(text[prev_len:])
+                result.finish_reason = "stop_sequence"
+                break
+            if on_text and delta:
+                on_text(delta)
+            progress.update(result.tokens)
+
+        choices = chunk.get("choices")
+        reason = choices[0].get("finish_reason") if choices else None
+        if reason or chunk.get("done"):
+            # Дочитываем до конца тела, чтобы соединение вернулось в пул
+            result.finish_reason = reason or chunk.get("done_reason") or "stop"
+            result.final = chunk
+            continue
+        if token_budget and result.tokens >= token_budget:
+            result.finish_reason = "token_budget"
+            break
+        if think is not None and think.budget_hit:
+            logger.info("read_stream: thinking budget of %s tokens spent", think.budget)
+            result.finish_reason = "thinking_budget"
+            break
+        if _interrupted():
+            logger.info("read_stream: interrupted, dropping the rest of the stream")
+            result.finish_reason = "interrupted"
+            break
+
+    if not result.stopped_early and hasattr(resp, "read"):
+        resp.read()
+    tail = ""
+    if in_think:
+        tail = think.feed("</think>") if think is not None else "</think>"
+    if think is not None and result.finish_reason != "stop_sequence":
+        tail += think.close()
+    if on_text and tail:
+        on_text(tail)
+    result.text = text + tail
+    progress.finish(result.tokens)
+    return result
+
+
+def _response_info(chunk: dict) -> dict:
+    """Timing / usage fields of a final response chunk."""
+    if not chunk:
+        return {}
+    info = {k: v for k, v in chunk.items() if k.endswith(("_duration", "_count"))}
+    if chunk.get("usage"):
+        info["usage"] = chunk["usage"]
+    if chunk.get("context"):
+        # Токены диалога от /api/generate — для следующего хода сессии
+        info["context"] = chunk["context"]
+    return info
+
+
+def read_chat_response(resp, stream=False, stop=None, token_budget=0, progress_total=0, info=None,
+                       think=None, on_text=None) -> str:
+    """Return the assistant message from an open chat response.
+
+    ``info``, if given, is filled with the response's timing and usage
+    fields (see :func:`chat_backend.format_timings`) and ``finish_reason``.  ``think`` — a
+    :class:`think_parser.ThinkParser` that takes the thoughts out of the
+    answer, ``on_text`` — called with the answer as it arrives (see
+    :func:`read_stream`; a plain response is passed in one piece).
+    """
+    if stream:
+        result = read_stream(resp, stop=stop, token_budget=token_budget, progress_total=progress_total,
+                             on_text=on_text, think=think)
+        logger.info("read_chat_response: streamed %s chunks, finish_reason=%s",
+                    result.tokens, result.finish_reason)
+        if info is not None:
+            info.update(_response_info(result.final))
+            info["finish_reason"] = result.finish_reason
+        return result.text
+
+    raw = resp.read().decode("utf-8")
+    logger.debug("read_chat_response: %s chars: %s", len(raw), abbreviate(raw))
+    data = json.loads(raw)
+    if info is not None:
+        info.update(_response_info(data))
+        choices = data.get("choices")
+        info["finish_reason"] = (choices[0].get("finish_reason") if choices else None) or data.get("done_reason")
+    text, _ = _tag_thinking(chunk_text(data), chunk_thinking(data), False)
+    if think is not None:
+        text = think.feed(text) + think.close()
+    if stop:
+        cut = _find_stop(text, stop)
+        if cut >= 0:
+            text = text[:cut]
+    if on_text and text:
+        on_text(text)
+    return text
@@ -0,0 +1,355 @@
+# structured_output.py
+
+"""JSON answers that are checked while they are being generated.
+
+Graphs that parse a node's ``response`` as JSON used to find out about a
+malformed answer only after the whole generation, and then had to re-run
+it by hand.  With a schema the request now asks Ollama for constrained
+output (``format`` in the native API, ``response_format`` in the OpenAI
+one) and feeds every streamed delta to a :class:`JsonValidator`: a small
+state machine that follows the JSON text character by character and
+raises :class:`SchemaMismatch` as soon as the prefix can no longer become
+a valid document — broken syntax, a value of the wrong type, an unknown
+key where ``additionalProperties`` is false, a string that no ``enum``
+value starts with, too many items.  The request drops the connection at
+that point and is retried (see :mod:`retry_policy`) unless the retry would
+only repeat it (see ``request_core``).
+
+Supported keywords: ``type``, ``properties``, ``required``,
+``additionalProperties``, ``items``, ``minItems``/``maxItems``, ``enum``,
+``const``, ``minLength``/``maxLength``, ``minimum``/``maximum`` and their
+exclusive forms.  Anything else (``$ref``, ``anyOf``…) is passed to the
+server but checked for syntax only.
+"""
+
+import json
+import re
+
+# Ключевые слова, при которых проверка подсхемы не сводится к перечисленным выше
+_OPAQUE = ("$ref", "anyOf", "oneOf", "allOf", "not", "if")
+_WS = " \t\r\n"
+_LITERALS = {"t": "true", "f": "false", "n": "null"}
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+
+
+class SchemaMismatch(ValueError):
+    """The answer is not JSON matching the schema (and never will be)."""
+
+
+def parse_schema(text: str):
+    """Schema given on a node as JSON; ``""`` means any JSON value (``"json"``)."""
+    if not text or not text.strip():
+        return "json"
+    schema = json.loads(text)
+    if not isinstance(schema, dict):
+        raise ValueError("schema must be a JSON object")
+    return schema
+
+
+def _schema(schema):
+    """``schema`` if its keywords can be checked incrementally, else ``None``."""
+    if not isinstance(schema, dict) or any(k in schema for k in _OPAQUE):
+        return None
+    return schema
+
+
+def _types(schema):
+    kind = schema.get("type") if schema else None
+    if kind is None:
+        return None
+    return {kind} if isinstance(kind, str) else set(kind)
+
+
+def _same(value, option) -> bool:
+    """JSON equality of scalars: ``true`` is not ``1``, ``1.0`` is ``1``."""
+    if isinstance(value, bool) or isinstance(option, bool):
+        return type(value) is type(option) and value == option
+    if isinstance(value, (int, float)) and isinstance(option, (int, float)):
+        return value == option
+    return type(value) is type(option) and value == option
+
+
+class _Frame:
+    __slots__ = ("kind", "schema", "path", "state", "keys", "count", "child")
+
+    def __init__(self, kind: str, schema, path: str, state: str):
+        self.kind = kind
+        self.schema = schema
+        self.path = path
+        self.state = state
+        self.keys = set()
+        self.count = 0
+        self.child = None  # (схема, путь) значения после ключа
+
+
+class JsonValidator:
+    """Incremental checker of one JSON document against ``schema``.
+
+    ``schema`` — a JSON schema dict, or ``"json"``/``None`` for any JSON.
+    :meth:`feed` takes text deltas and raises :class:`SchemaMismatch` at the
+    first character that rules the document out; :meth:`close` checks that
+    the document is complete.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = _schema(schema)
+        self.chars = 0
+        self._stack = []
+        self._done = False
+        self._mode = None  # None, "string", "key", "number" или "literal"
+        self._buf = []
+        self._escape = None  # None, "" сразу после \ или "u" и набранные цифры \uXXXX
+        self._scalar = (None, "$")  # схема и путь текущего скаляра
+
+    def _fail(self, message: str, path: str = None):
+        where = f" at {path}" if path else ""
+        raise SchemaMismatch(f"bad JSON answer: {message}{where} (char {self.chars})")
+
+    def feed(self, text: str):
+        for c in text:
+            self.chars += 1
+            self._char(c)
+
+    def close(self):
+        if self._mode == "number":
+            self._end_number()
+        if not self._done:
+            self._fail("incomplete JSON")
+
+    # --- символы ---
+
+    def _char(self, c: str):
+        mode = self._mode
+        if mode == "string" or mode == "key":
+            self._string_char(c)
+            return
+        if mode == "number":
+            if c in "0123456789+-.eE":
+                self._buf.append(c)
+                return
+            self._end_number()
+        elif mode == "literal":
+            self._buf.append(c)
+            word = "".join(self._buf)
+            literal = _LITERALS[word[0]]
+            if not literal.startswith(word):
+                self._fail(f"invalid literal {word!r}", self._scalar[1])
+            if word == literal:
+                self._mode = None
+                self._end_scalar(None if literal == "null" else literal == "true")
+            return
+        self._structural(c)
+
+    def _structural(self, c: str):
+        if c in _WS:
+            return
+        if self._done:
+            self._fail(f"unexpected {c!r} after the JSON value")
+        if not self._stack:
+            self._start_value(c, self.schema, "$")
+            return
+        frame = self._stack[-1]
+        state = frame.state
+        if frame.kind == "object":
+            if state in ("key_or_end", "key") and c == '"':
+                self._mode = "key"
+                self._buf = []
+            elif c == "}" and state in ("key_or_end", "comma_or_end"):
+                self._close_object(frame)
+            elif state == "colon" and c == ":":
+                frame.state = "value"
+            elif state == "value":
+                self._start_value(c, *frame.child)
+            elif state == "comma_or_end" and c == ",":
+                frame.state = "key"
+            else:
+                self._fail(f"unexpected {c!r}", frame.path)
+        else:
+            if c == "]" and state in ("value_or_end", "comma_or_end"):
+                self._close_array(frame)
+            elif state in ("value_or_end", "value"):
+                schema = frame.schema
+                limit = schema.get("maxItems") if schema else None
+                if limit is not None and frame.count >= limit:
+                    self._fail(f"more than {limit} items", frame.path)
+                items = _schema(schema.get("items")) if schema else None
+                frame.state = "value"
+                self._start_value(c, items, f"{frame.path}[{frame.count}]")
+            elif state == "comma_or_end" and c == ",":
+                frame.state = "value"
+            else:
+                self._fail(f"unexpected {c!r}", frame.path)
+
+    def _string_char(self, c: str):
+        if self._escape is not None:
+            if self._escape == "":
+                if c == "u":
+                    self._escape = "u"
+                    return
+                if c not in _ESCAPES:
+                    self._fail(f"invalid escape \\{c}", self._scalar[1])
+                self._buf.append(_ESCAPES[c])
+                self._escape = None
+            else:
+                if c not in "0123456789abcdefABCDEF":
+                    self._fail("invalid \\u escape", self._scalar[1])
+                self._escape += c
+                if len(self._escape) < 5:
+                    return
+                self._buf.append(chr(int(self._escape[1:], 16)))
+                self._escape = None
+        elif c == "\\":
+            self._escape = ""
+            return
+        elif c == '"':
+            if self._mode == "key":
+                self._end_key("".join(self._buf))
+            else:
+                self._end_string("".join(self._buf))
+            return
+        elif c < " ":
+            self._fail("control character in a string", self._scalar[1])
+        else:
+            self._buf.append(c)
+        self._check_string_prefix()
+
+    def _check_string_prefix(self):
+        if self._mode == "key":
+            frame = self._stack[-1]
+            schema = frame.schema
+            if schema and schema.get("additionalProperties") is False:
+                key = "".join(self._buf)
+                if not any(name.startswith(key) for name in schema.get("properties") or {}):
+                    self._fail(f"unexpected key {key!r}", frame.path)
+            return
+        schema, path = self._scalar
+        if not schema:
+            return
+        limit = schema.get("maxLength")
+        if limit is not None and len(self._buf) > limit:
+            self._fail(f"string longer than {limit}", path)
+        options = self._options(schema)
+        if options is not None:
+            prefix = "".join(self._buf)
+            if not any(isinstance(v, str) and v.startswith(prefix) for v in options):
+                self._fail(f"{prefix!r} is not one of {options}", path)
+
+    # --- значения ---
+
+    @staticmethod
+    def _options(schema):
+        if "const" in schema:
+            return [schema["const"]]
+        return schema.get("enum")
+
+    def _check_type(self, schema, kind: str, path: str):
+        types = _types(schema)
+        if types is None or kind in types or (kind == "number" and "integer" in types):
+            return
+        self._fail(f"expected {'/'.join(sorted(types))}, got {kind}", path)
+
+    def _start_value(self, c: str, schema, path: str):
+        if c == "{":
+            self._check_type(schema, "object", path)
+            self._stack.append(_Frame("object", schema, path, "key_or_end"))
+        elif c == "[":
+            self._check_type(schema, "array", path)
+            self._stack.append(_Frame("array", schema, path, "value_or_end"))
+        elif c == '"':
+            self._check_type(schema, "string", path)
+            self._mode = "string"
+            self._buf = []
+            self._scalar = (schema, path)
+        elif c == "-" or c.isdigit():
+            self._check_type(schema, "number", path)
+            self._mode = "number"
+            self._buf = [c]
+            self._scalar = (schema, path)
+        elif c in _LITERALS:
+            self._check_type(schema, "null" if c == "n" else "boolean", path)
+            self._mode = "literal"
+            self._buf = [c]
+            self._scalar = (schema, path)
+        else:
+            self._fail(f"unexpected {c!r}", path)
+
+    def _end_key(self, key: str):
+        self._mode = None
+        frame = self._stack[-1]
+        schema = frame.schema
+        path = f"{frame.path}.{key}"
+        child = None
+        if schema:
+            properties = schema.get("properties") or {}
+            extra = schema.get("additionalProperties")
+            if key in properties:
+                child = _schema(properties[key])
+            elif extra is False:
+                self._fail(f"unexpected key {key!r}", frame.path)
+            else:
+                child = _schema(extra)
+        frame.keys.add(key)
+        frame.child = (child, path)
+        frame.state = "colon"
+
+    def _end_string(self, value: str):
+        self._mode = None
+        schema, path = self._scalar
+        limit = schema.get("minLength") if schema else None
+        if limit is not None and len(value) < limit:
+            self._fail(f"string shorter than {limit}", path)
+        self._end_scalar(value)
+
+    def _end_number(self):
+        self._mode = None
+        text = "".join(self._buf)
+        schema, path = self._scalar
+        match = _NUMBER.fullmatch(text)
+        if match is None:
+            self._fail(f"invalid number {text!r}", path)
+        value = float(text) if match.group(1) or match.group(2) else int(text)
+        types = _types(schema)
+        if types and "number" not in types and isinstance(value, float) and not value.is_integer():
+            self._fail(f"expected integer, got {text}", path)
+        if schema:
+            if "minimum" in schema and value < schema["minimum"]:
+                self._fail(f"{text} < minimum {schema['minimum']}", path)
+            if "maximum" in schema and value > schema["maximum"]:
+                self._fail(f"{text} > maximum {schema['maximum']}", path)
+            if "exclusiveMinimum" in schema and value <= schema["exclusiveMinimum"]:
+                self._fail(f"{text} <= exclusiveMinimum {schema['exclusiveMinimum']}", path)
+            if "exclusiveMaximum" in schema and value >= schema["exclusiveMaximum"]:
+                self._fail(f"{text} >= exclusiveMaximum {schema['exclusiveMaximum']}", path)
+        self._end_scalar(value)
+
+    def _end_scalar(self, value):
+        schema, path = self._scalar
+        options = self._options(schema) if schema else None
+        if options is not None and not any(_same(value, o) for o in options):
+            self._fail(f"{value!r} is not one of {options}", path)
+        self._end_value()
+
+    def _close_object(self, frame: _Frame):
+        required = frame.schema.get("required") if frame.schema else None
+        missing = [k for k in required or () if k not in frame.keys]
+        if missing:
+            self._fail(f"missing required {', '.join(missing)}", frame.path)
+        self._stack.pop()
+        self._end_value()
+
+    def _close_array(self, frame: _Frame):
+        limit = frame.schema.get("minItems") if frame.schema else None
+        if limit is not None and frame.count < limit:
+            self._fail(f"fewer than {limit} items", frame.path)
+        self._stack.pop()
+        self._end_value()
+
+    def _end_value(self):
+        if not self._stack:
+            self._done = True
+            return
+        frame = self._stack[-1]
+        if frame.kind == "array":
+            frame.count += 1
+        frame.state = "comma_or_end"
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from ollama_nodes.ollama_vision_batch_node import OllamaVisionBatchNode
+from ollama_nodes.ollama_vision_node_base import OllamaVisionNodeBase
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("OLLAMA_NUM_PARALLEL", "2")
+    srv = MockOllama(MockConfig(latency=0.05, token_rate=0, tokens=4)).start()
+    yield srv
+    srv.stop()
+
+
+def frames(count):
+    return np.random.default_rng(0).random((count, 32, 32, 3), dtype=np.float32)
+
+
+def test_max_in_flight_is_clamped_to_server_slots(server):
+    node = OllamaVisionBatchNode()
+    texts, _ = asyncio.run(node.caption_batch(server.address, "mock", "s", "u", frames(6), max_in_flight=16,
+                                              backend="native"))
+    assert len(texts) == 6 and not any(t.startswith("Error") for t in texts)
+    assert server.peak == 2
+
+
+def test_batch_shares_slots_with_other_nodes(server):
+    async def graph():
+        batch = OllamaVisionBatchNode().caption_batch(server.address, "mock", "s", "u", frames(4), backend="native")
+        single = OllamaVisionNodeBase().call_ollama(server.address, model_name="mock", system_prompt="s",
+                                                    user_prompt="other", img=frames(1), backend="native")
+        return await asyncio.gather(batch, single)
+
+    (texts, _), _ = asyncio.run(graph())
+    assert len(texts) == 4
+    assert server.peak == 2
@@ -0,0 +1,24 @@
+from ollama_nodes.chat_session import ChatSession, SessionStore
+
+
+def test_branches_of_one_handle_keep_their_own_context():
+    store = SessionStore()
+    root = ChatSession("h:1", "m", "sys").advance("hi", "hello")
+    store.remember(root, "h:1", [1, 2])
+    branch_a = root.advance("a?", "answer a")
+    branch_b = root.advance("b?", "answer b")
+    store.remember(branch_a, "h:1", [1, 2, 3])
+    store.remember(branch_b, "h:1", [1, 2, 4])
+
+    assert store.context(branch_a) == [1, 2, 3]
+    assert store.context(branch_b) == [1, 2, 4]
+    assert store.context(root) == [1, 2]
+    # Ветка, для которой context не сохранялся, повторяет историю
+    assert store.context(root.advance("c?", "answer c")) is None
+
+
+def test_same_history_shares_context():
+    store = SessionStore()
+    root = ChatSession("h:1", "m", "sys")
+    store.remember(root.advance("q", "a"), "h:1", [7])
+    assert store.context(root.advance("q", "a")) == [7]
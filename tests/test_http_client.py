@@ -0,0 +1,113 @@
+import http.client
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+from ollama_nodes import http_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_pools():
+    http_client.close_all()
+    yield
+    http_client.close_all()
+
+
+@pytest.fixture
+def server():
+    srv = MockOllama(MockConfig(latency=0, token_rate=0)).start()
+    yield srv
+    srv.stop()
+
+
+class OneAnswerServer:
+    """Answers the first request on each connection, reads the second and hangs up."""
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.requests = 0
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def address(self):
+        return "%s:%s" % self.sock.getsockname()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._connection, args=(conn,), daemon=True).start()
+
+    def _read_request(self, stream):
+        length = 0
+        line = stream.readline()
+        while line not in (b"\r\n", b""):
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+            line = stream.readline()
+        stream.read(length)
+        self.requests += 1
+
+    def _connection(self, conn):
+        with conn, conn.makefile("rb") as stream:
+            self._read_request(stream)
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\n{}")
+            self._read_request(stream)
+
+    def close(self):
+        self.sock.close()
+
+
+def test_connections_per_host_are_capped(server, monkeypatch):
+    monkeypatch.setattr(http_client, "MAX_CONNECTIONS_PER_HOST", 2)
+    held = [http_client.urlopen(server.address, "/api/tags", timeout=5) for _ in range(2)]
+    with pytest.raises(TimeoutError):
+        http_client.urlopen(server.address, "/api/tags", timeout=0.3)
+
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(http_client.urlopen(server.address, "/api/tags",
+                                                                               timeout=5).read()))
+    waiter.start()
+    held[0].read()
+    waiter.join(5)
+    held[1].read()
+    assert result and result[0].startswith(b"{")
+    stats = http_client.pool_stats()[f"http://{server.address}"]
+    assert stats["created"] == 2 and stats["active"] == 0
+
+
+def test_expired_idle_connections_are_swept(server, monkeypatch):
+    other = MockOllama(MockConfig(latency=0, token_rate=0)).start()
+    try:
+        http_client.urlopen(other.address, "/api/tags", timeout=5).read()
+        assert http_client.pool_stats()[f"http://{other.address}"]["idle"] == 1
+        http_client._get_pool("http", other.address).idle_timeout = 0
+        monkeypatch.setattr(http_client, "EVICT_INTERVAL", 0)
+        http_client.urlopen(server.address, "/api/tags", timeout=5).read()
+        assert http_client.pool_stats()[f"http://{other.address}"]["idle"] == 0
+    finally:
+        other.stop()
+
+
+@pytest.mark.parametrize("method, data, resent", [("GET", None, True), ("POST", b"{}", False)])
+def test_written_post_is_not_resent(method, data, resent):
+    srv = OneAnswerServer()
+    try:
+        http_client.urlopen(srv.address, "/api/tags", data=data, method=method, timeout=5).read()
+        if resent:
+            assert http_client.urlopen(srv.address, "/api/tags", method=method, timeout=5).read() == b"{}"
+            assert srv.requests == 3
+        else:
+            with pytest.raises(http.client.RemoteDisconnected):
+                http_client.urlopen(srv.address, "/api/tags", data=data, method=method, timeout=5)
+            assert srv.requests == 2
+    finally:
+        srv.close()
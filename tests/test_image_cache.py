@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from ollama_nodes.image_cache import fingerprint
+
+
+@pytest.mark.parametrize("size", [512, 1024, 640])
+@pytest.mark.parametrize("channel", [1, 2])
+def test_fingerprint_sees_a_single_channel_change(size, channel):
+    rng = np.random.default_rng(0)
+    img = rng.random((1, size, size, 3), dtype=np.float32)
+    changed = img.copy()
+    changed[0, :size - 24, :, channel] = 0.0
+    assert fingerprint(img) != fingerprint(changed)
+
+
+def test_fingerprint_sees_one_pixel_outside_the_sample():
+    img = np.zeros((1, 1024, 1024, 3), dtype=np.float32)
+    changed = img.copy()
+    changed[0, 1, 1, 2] = 0.5
+    assert fingerprint(img) != fingerprint(changed)
+
+
+def test_fingerprint_is_stable_and_includes_shape_and_dtype():
+    img = np.ones((1, 64, 48, 3), dtype=np.float32)
+    assert fingerprint(img) == fingerprint(img.copy())
+    assert fingerprint(img) != fingerprint(img.reshape(1, 48, 64, 3))
+    assert fingerprint(img) != fingerprint(img.astype(np.float64))
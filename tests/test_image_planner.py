@@ -0,0 +1,22 @@
+import itertools
+
+import pytest
+
+from ollama_nodes.image_planner import FAMILIES, GENERIC, TiledGeometry, plan_image
+
+GEOMETRIES = [GENERIC] + [geometry for _, geometry in FAMILIES]
+
+
+@pytest.mark.parametrize("geometry", GEOMETRIES, ids=lambda g: g.name)
+def test_plan_never_exceeds_max_side(geometry):
+    for (height, width), max_side, budget in itertools.product(
+            [(2000, 3000), (3000, 800), (300, 200), (1080, 1920)], [20, 100, 300, 500, 1000, 1500], [0, 700, 5000]):
+        plan = plan_image(geometry, height, width, budget, max_side)
+        assert plan.height <= plan.canvas_height and plan.width <= plan.canvas_width
+        assert max(plan.canvas_height, plan.canvas_width) <= max_side, (height, width, max_side, budget, plan)
+
+
+def test_tiled_plan_below_one_tile_shrinks_the_single_tile():
+    plan = TiledGeometry("llava-1.6", 336, 576, 4).plan(1000, 2000, max_side=200)
+    assert (plan.height, plan.width, plan.canvas_height, plan.canvas_width) == (100, 200, 200, 200)
+    assert plan.tokens == 576
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import numpy as np
+
+from ollama_nodes import metrics
+from ollama_nodes.request_core import ChatRequest, execute
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+
+def test_encode_time_is_labelled_like_requests():
+    server = MockOllama(MockConfig(latency=0, token_rate=0)).start()
+    try:
+        img = np.random.default_rng(3).random((1, 48, 40, 3), dtype=np.float32)
+        for _ in range(2):
+            assert execute(ChatRequest("MetricsTest", server.address, "mock", "s", "u", [img])).ok
+        labels = {"node": "MetricsTest", "model": "mock", "server": server.address}
+        assert metrics.encode_seconds.count(cached="false", **labels) == 1
+        assert metrics.encode_seconds.count(cached="true", **labels) == 1
+        assert metrics.request_seconds.count(**labels) == 2
+    finally:
+        server.stop()
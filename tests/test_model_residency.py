@@ -0,0 +1,30 @@
+import pytest
+
+from ollama_nodes import model_residency
+from ollama_nodes.model_catalog import ModelInfo
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    stopped = []
+    monkeypatch.setattr(model_residency, "stop_model", lambda server, model: stopped.append(model) or True)
+    monkeypatch.setattr(model_residency.model_catalog, "installed",
+                        lambda server: [ModelInfo("small:latest", 2 * GB), ModelInfo("big:latest", 6 * GB)])
+    manager = model_residency.ResidencyManager(vram_budget=10 * GB)
+    resident = {"old:latest": 4 * GB, "recent:latest": 3 * GB}
+    monkeypatch.setattr(manager, "refresh", lambda server: dict(resident))
+    manager._server("s").last_used.update({"old:latest": 1.0, "recent:latest": 2.0})
+    manager.stopped = stopped
+    return manager
+
+
+@pytest.mark.parametrize("model, stopped", [
+    ("small", []),                # 7 + 2 ГБ помещаются
+    ("big", ["old:latest"]),      # 7 + 6 — выгружаем самую давнюю
+    ("unknown", ["old:latest"]),  # размер неизвестен — как крупнейшая загруженная, 4 ГБ
+])
+def test_make_room_uses_catalog_size(manager, model, stopped):
+    manager._make_room("s", model)
+    assert manager.stopped == stopped
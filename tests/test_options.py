@@ -0,0 +1,35 @@
+import pytest
+
+from ollama_nodes.chat_backend import parse_options
+from ollama_nodes.request_core import ChatRequest, execute
+from ollama_nodes.response_cache import is_deterministic
+
+
+@pytest.mark.parametrize("payload, expected", [
+    ({"options": {"seed": 42}}, True),
+    ({"seed": 0}, True),
+    ({"temperature": 0}, True),
+    ({"options": {"seed": "x"}}, False),
+    ({"options": {"seed": True}}, False),
+    ({"seed": -1}, False),
+    ({"temperature": False}, False),
+    ({}, False),
+])
+def test_is_deterministic_only_trusts_integer_seeds(payload, expected):
+    assert is_deterministic(dict(payload, model="m", messages=[])) is expected
+
+
+@pytest.mark.parametrize("text", ['{"seed": "x"}', '{"temperature": "hot"}', '{"num_ctx": 8192.5}',
+                                  '{"stop": [1]}'])
+def test_parse_options_rejects_wrong_types(text):
+    with pytest.raises(ValueError):
+        parse_options(text)
+
+
+def test_parse_options_passes_unknown_and_valid_options():
+    assert parse_options('{"seed": 1, "temperature": 0.5, "stop": "x", "custom": "y"}')["custom"] == "y"
+
+
+def test_bad_seed_becomes_a_node_error():
+    result = execute(ChatRequest("Test", "localhost:1", "m", "s", "u", ollama_options='{"seed": "x"}'))
+    assert result.response.startswith("Error: bad ollama_options: seed must be an integer")
@@ -0,0 +1,85 @@
+import importlib.util
+import os
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "structured_output", os.path.join(os.path.dirname(__file__), os.pardir, "structured_output.py"))
+structured_output = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(structured_output)
+
+JsonValidator = structured_output.JsonValidator
+SchemaMismatch = structured_output.SchemaMismatch
+
+
+def validate(text, schema, chunk=1):
+    validator = JsonValidator(schema)
+    for i in range(0, len(text), chunk):
+        validator.feed(text[i:i + chunk])
+    validator.close()
+
+
+@pytest.mark.parametrize("text, schema", [
+    ("true", {"enum": [1, 2]}),
+    ("1", {"enum": [True]}),
+    ("0", {"enum": [False, None]}),
+    ("false", {"const": 0}),
+    ('{"a": true}', {"type": "object", "properties": {"a": {"enum": [1]}}}),
+])
+def test_enum_does_not_mix_booleans_and_numbers(text, schema):
+    with pytest.raises(SchemaMismatch):
+        validate(text, schema)
+
+
+@pytest.mark.parametrize("text, schema", [
+    ("true", {"enum": [True, 1]}),
+    ("1", {"enum": [True, 1]}),
+    ("1.0", {"enum": [1]}),
+    ("null", {"const": None}),
+    ('"b"', {"enum": ["a", "b"]}),
+])
+def test_enum_matches_equal_json_values(text, schema):
+    validate(text, schema)
+
+
+def test_mismatch_is_reported_at_the_first_bad_character():
+    validator = JsonValidator({"type": "object", "properties": {"n": {"type": "integer"}}})
+    validator.feed('{"n": ')
+    with pytest.raises(SchemaMismatch):
+        validator.feed('"x')
+    assert validator.chars == len('{"n": "')
+
+
+OBJECT = {"type": "object", "properties": {"name": {"type": "string"}, "n": {"type": "integer"}},
+          "required": ["name", "n"], "additionalProperties": False}
+
+
+@pytest.mark.parametrize("text", [
+    '{"name": "a", "n": 1}',
+    ' {"n": -3, "name": "\\u0061"}\n',
+])
+def test_valid_object(text):
+    validate(text, OBJECT, chunk=4)
+
+
+@pytest.mark.parametrize("text, prefix", [
+    ('{"name": 1, "n": 1}', '{"name": 1'),
+    ('{"name": "a", "n": 1.5}', '{"name": "a", "n": 1.5}'),
+    ('["a"]', "["),
+    ('{"name": "a"}', '{"name": "a"}'),
+    ('{"name": "a", "n": 1, "extra": 0}', '{"name": "a", "n": 1, "e'),
+    ('{"name": "a", "n": 1,}', '{"name": "a", "n": 1,}'),
+])
+def test_mismatch_stops_at_the_first_bad_character(text, prefix):
+    validator = JsonValidator(OBJECT)
+    with pytest.raises(SchemaMismatch):
+        validator.feed(text)
+        validator.close()
+    assert validator.chars == len(prefix)
+
+
+def test_incomplete_document_fails_on_close():
+    validator = JsonValidator(OBJECT)
+    validator.feed('{"name": "a", "n": 1')
+    with pytest.raises(SchemaMismatch, match="incomplete JSON"):
+        validator.close()
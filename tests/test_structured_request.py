@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+from ollama_nodes.request_core import ChatRequest, execute
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+# Мок отвечает {"answer": "<слова>"}: со строкой ответ подходит, с числом — нет
+STRING_SCHEMA = {"type": "object", "properties": {"answer": {"type": "string"}}, "required": ["answer"]}
+INTEGER_SCHEMA = {"type": "object", "properties": {"answer": {"type": "integer"}}}
+
+
+@pytest.fixture
+def server():
+    srv = MockOllama(MockConfig(latency=0, token_rate=0, tokens=8)).start()
+    yield srv
+    srv.stop()
+
+
+def ask(server, schema, backend="native", **kwargs):
+    return execute(ChatRequest("Test", server.address, "mock", "s", "u", json_schema=schema, backend=backend,
+                               **kwargs))
+
+
+def chat_calls(server, backend="native"):
+    return server.requests.get("/api/chat" if backend == "native" else "/v1/chat/completions", 0)
+
+
+@pytest.mark.parametrize("backend", ["native", "openai"])
+def test_matching_answer_is_returned(server, backend):
+    result = ask(server, STRING_SCHEMA, backend)
+    assert result.ok and result.text.startswith('{"answer": "')
+    assert chat_calls(server, backend) == 1
+
+
+def test_truncated_answer_is_not_retried(server):
+    result = ask(server, STRING_SCHEMA, max_tokens=4)
+    assert "incomplete JSON" in result.error and "cut off (length)" in result.error
+    assert chat_calls(server) == 1
+
+
+def test_greedy_request_is_not_retried(server):
+    result = ask(server, INTEGER_SCHEMA, ollama_options='{"temperature": 0}')
+    assert "expected integer" in result.error and "temperature 0" in result.error
+    assert chat_calls(server) == 1
+
+
+def test_fixed_seed_is_changed_on_retry(server):
+    result = ask(server, INTEGER_SCHEMA, ollama_options='{"seed": 7, "temperature": 0.8}')
+    assert "expected integer" in result.error
+    seeds = [r["options"]["seed"] for r in server.recent]
+    assert seeds == [7, 8, 9]
+
+
+def test_random_sampling_is_retried(server):
+    result = ask(server, INTEGER_SCHEMA)
+    assert not result.ok
+    assert chat_calls(server) == 3
@@ -0,0 +1,113 @@
+# think_parser.py
+
+"""Splitting a reasoning model's ``<think>…</think>`` blocks from its answer.
+
+The reasoning node used to wait for the whole response and then scan it
+twice with regular expressions.  :class:`ThinkParser` is a small state
+machine fed with stream deltas as they arrive: it routes each piece of text
+to the thoughts or to the answer in one pass, holds back a tag split across
+two chunks, and counts the thinking tokens so that a budget can cut the
+thinking short.  With ``discard=True`` the thoughts are counted but never
+kept in memory.
+"""
+
+import re
+
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+_OPEN = re.compile(re.escape(OPEN_TAG), re.IGNORECASE)
+_CLOSE = re.compile(re.escape(CLOSE_TAG), re.IGNORECASE)
+
+
+def _partial_tag(text: str, start: int, tag: str) -> int:
+    """Length of the longest end of ``text[start:]`` that begins ``tag``."""
+    for k in range(min(len(tag) - 1, len(text) - start), 0, -1):
+        if text[-k:].lower() == tag[:k]:
+            return k
+    return 0
+
+
+class ThinkParser:
+    """Incremental splitter of thoughts and answer.
+
+    ``budget`` — thinking tokens (stream chunks with thought text) after
+    which :attr:`budget_hit` is set; ``0`` — no limit.
+    """
+
+    def __init__(self, budget: int = 0, discard: bool = False):
+        self.budget = budget
+        self.discard = discard
+        self.in_think = False
+        self.thinking_tokens = 0
+        self.thinking_chars = 0
+        self.budget_hit = False
+        self._blocks = []
+        self._block = []
+        self._pending = ""  # хвост чанка, который может оказаться началом тега
+
+    def _thought(self, text: str):
+        if text:
+            self.thinking_chars += len(text)
+            if not self.discard:
+                self._block.append(text)
+
+    def _end_block(self):
+        if self._block:
+            self._blocks.append("".join(self._block))
+            self._block = []
+
+    def feed(self, delta: str) -> str:
+        """Consume one delta; returns the part of it that belongs to the answer."""
+        text = self._pending + delta
+        self._pending = ""
+        answer = []
+        chars = self.thinking_chars
+        pos = 0
+        while pos < len(text):
+            tag = CLOSE_TAG if self.in_think else OPEN_TAG
+            match = (_CLOSE if self.in_think else _OPEN).search(text, pos)
+            if match is None:
+                end = len(text) - _partial_tag(text, pos, tag)
+                self._pending = text[end:]
+            else:
+                end = match.start()
+            if self.in_think:
+                self._thought(text[pos:end])
+            else:
+                answer.append(text[pos:end])
+            if match is None:
+                break
+            pos = match.end()
+            if self.in_think:
+                self._end_block()
+            self.in_think = not self.in_think
+        if self.thinking_chars > chars:
+            self.thinking_tokens += 1
+            if self.budget and self.in_think and self.thinking_tokens >= self.budget:
+                self.budget_hit = True
+        return "".join(answer)
+
+    def close(self) -> str:
+        """Flush the held-back tail; an unclosed block still counts as thoughts."""
+        tail, self._pending = self._pending, ""
+        if self.in_think:
+            self._thought(tail)
+            tail = ""
+        self._end_block()
+        return tail
+
+    @property
+    def thoughts(self) -> str:
+        return "\n\n".join(b.strip() for b in self._blocks if b.strip())
+
+
+def split_thoughts(text: str, discard: bool = False) -> tuple:
+    """``(thoughts, answer)`` of a complete response."""
+    parser = ThinkParser(discard=discard)
+    answer = parser.feed(text) + parser.close()
+    return parser.thoughts, answer.strip()
+
+
+def join_thoughts(thoughts: str, answer: str) -> str:
+    """Inverse of :func:`split_thoughts`, for storing a parsed answer."""
+    return f"{OPEN_TAG}{thoughts}{CLOSE_TAG}\n{answer}" if thoughts else answer
@@ -1,85 +1,41 @@
 import os
-import logging
-import urllib.request
 import json
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+from . import metrics
+from .http_client import urlopen
+from .load_balancer import balancer
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+_presets_dir = None
 
 
 def get_presets_dir() -> str:
     """Return absolute path to the presets folder in ComfyUI root."""
-    base = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-    presets_dir = os.path.join(base, "Ollama_presets")
-    os.makedirs(presets_dir, exist_ok=True)
-    return presets_dir
+    global _presets_dir
+    # Папку создаём один раз, а не при каждом обращении
+    if _presets_dir is None:
+        base = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+        presets_dir = os.path.join(base, "Ollama_presets")
+        os.makedirs(presets_dir, exist_ok=True)
+        _presets_dir = presets_dir
+    return _presets_dir
 
 
-def pull_model(ip_port: str, model_name: str) -> bool:
+def pull_model(ip_port: str, model_name: str, timeout: float | None = None) -> bool:
     """Try to download a model via the Ollama API.
 
-    If the model isn't available locally Ollama begins downloading it.  This
-    helper shows a simple progress bar similar to the ``ollama`` CLI while the
-    files are pulled.  ``True`` is returned on success, ``False`` otherwise.
+    If the model isn't available locally Ollama begins downloading it.  The
+    download is shared with anyone else pulling the same model on the same
+    server (see :mod:`model_pull`) and its progress is shown on the node.
+    ``True`` is returned on success, ``False`` otherwise.
     """
-    import json
-    import urllib.request
-    from tqdm import tqdm
-
-    url = f"http://{ip_port}/api/pull"
-    headers = {"Content-Type": "application/json"}
-    data = json.dumps({"name": model_name}).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-    logger.debug(f"pull_model: POST {url} name={model_name}")
-
-    try:
-        with urllib.request.urlopen(req) as resp:
-            code = resp.getcode()
-            if code != 200:
-                logger.warning(f"pull_model: HTTP {code} starting pull")
-                return False
-
-            totals = {}
-            completed = {}
-            pbar = tqdm(total=100, unit="%", bar_format="{l_bar}{bar}| {n_fmt}%")
-
-            for raw in resp:
-                try:
-                    info = json.loads(raw.decode("utf-8"))
-                except Exception:
-                    continue
+    from .model_pull import pull_coordinator
 
-                status = info.get("status", "")
-                if status == "success":
-                    pbar.n = 100
-                    pbar.refresh()
-                    pbar.close()
-                    logger.info("pull_model: download completed")
-                    return True
-
-                digest = info.get("digest")
-                if digest:
-                    if "total" in info:
-                        totals[digest] = info["total"]
-                    if "completed" in info:
-                        completed[digest] = info["completed"]
-
-                    total_sum = sum(totals.values())
-                    completed_sum = sum(min(completed.get(d, 0), totals[d]) for d in totals)
-                    if total_sum > 0:
-                        percent = int(completed_sum * 100 / total_sum)
-                        if percent > pbar.n:
-                            pbar.update(percent - pbar.n)
-
-                pbar.set_description(status)
-
-            pbar.close()
-            logger.warning("pull_model: download did not complete")
-            return False
-
-    except Exception as e:
-        logger.error(f"pull_model: failed to pull {model_name}: {e}")
-        return False
+    logger.debug("pull_model: %s name=%s", ip_port, model_name)
+    return pull_coordinator.pull(ip_port, model_name, timeout)
 
 
 def stop_model(ip_port: str, model_name: str | None = None) -> bool:
@@ -87,9 +43,6 @@ def stop_model(ip_port: str, model_name: str | None = None) -> bool:
     Send a request to unload the model from memory using the generate/chat endpoint.
     """
     # 1) Выбираем эндпоинт: generate для чистого unload-а
-    url = f"http://{ip_port}/api/generate"
-    headers = {"Content-Type": "application/json"}
-
     # 2) Формируем payload
     payload: dict = {}
     if model_name:
@@ -97,13 +50,17 @@ def stop_model(ip_port: str, model_name: str | None = None) -> bool:
         payload["keep_alive"] = 0
     data = json.dumps(payload).encode("utf-8")
 
-    logger.debug(f"stop_model: POST {url} payload={payload}")
-    req = urllib.request.Request(url, data=data, headers=headers, method="POST")
+    logger.debug("stop_model: POST %s/api/generate payload=%s", ip_port, payload)
     try:
-        with urllib.request.urlopen(req) as resp:
+        with urlopen(ip_port, "/api/generate", data=data) as resp:
             code = resp.getcode()
-            logger.info(f"stop_model: HTTP {code}")
+            resp.read()
+            logger.info("stop_model: HTTP %s", code)
+            if code == 200:
+                balancer.mark_unloaded(ip_port, model_name)
+            metrics.unloads_total.inc(server=ip_port, status="ok" if code == 200 else f"http_{code}")
             return code == 200
     except Exception as e:
-        logger.warning(f"stop_model: failed to stop model: {e}")
+        logger.warning("stop_model: failed to stop model: %s", e)
+        metrics.unloads_total.inc(server=ip_port, status=type(e).__name__)
         return False